@@ -24,6 +24,9 @@ setup(
       description=("Rain-type classification code in Cartesian coordinates, replacing Steiner et al. (1995)."),
       license='GNU',
       packages=PACKAGES,
+      entry_points={
+          'console_scripts': ['uw_raintype = uw_raintype.cli:main'],
+          },
       classifiers=["""
           Development Status :: V1.0,
           Programming Language :: Python",
@@ -0,0 +1,34 @@
+""" Helpers shared by the tests
+"""
+
+import netCDF4 as nc4
+import numpy as np
+
+def writeinput(fname,refl,timeval=None,level=5,missing_value=-9999):
+
+  #Writes the 2-D reflectivity refl as level level (1-based) of a REFL (time,z,y,x)
+  #variable, as runraintype.py expects to read it. With timeval (seconds since 1970),
+  #the coordinate variables of the 'cf' output format are written too.
+  (ny,nx) = refl.shape
+  ncid = nc4.Dataset(fname,'w')
+  try:
+    ncid.createDimension('time',1)
+    ncid.createDimension('z',level)
+    ncid.createDimension('y',ny)
+    ncid.createDimension('x',nx)
+    var = ncid.createVariable('REFL',np.float32,('time','z','y','x'))
+    var.missing_value = missing_value
+    data = np.full((1,level,ny,nx),missing_value,dtype=np.float32)
+    data[0,level-1] = refl
+    var[:] = data
+    if timeval is not None:
+      ncid.createVariable('time',np.float64,('time',))[:] = [timeval]
+      ncid.createVariable('x0',np.float64,('x',))[:] = np.arange(nx)
+      ncid.createVariable('y0',np.float64,('y',))[:] = np.arange(ny)
+      ncid.createVariable('lat0',np.float64,('y','x'))[:] = np.zeros((ny,nx))
+      ncid.createVariable('lon0',np.float64,('y','x'))[:] = np.zeros((ny,nx))
+      gm = ncid.createVariable('grid_mapping_0',np.int32)
+      gm.latitude_of_projection_origin = 0.
+      gm.longitude_of_projection_origin = 0.
+  finally:
+    ncid.close()
@@ -0,0 +1,101 @@
+""" Batch drivers of batch.py
+"""
+
+import os
+import netCDF4 as nc4
+import numpy as np
+import pytest
+from uw_raintype import batch
+from uw_raintype import netcdf_io as net
+from uw_raintype import benchmark as bench
+from conftest import writeinput
+
+def sameinputs(tmpdir):
+
+  #Two input files with the same name in different directories.
+  files = []
+  for (k,sub) in enumerate(['a','b']):
+    os.makedirs(os.path.join(str(tmpdir),sub))
+    files.append(os.path.join(str(tmpdir),sub,'scan.nc'))
+    writeinput(files[-1],bench.makescene('isolated',(40,50),ncores=5,seed=k))
+  return files
+
+@pytest.mark.parametrize('driver',[batch.runbatch,batch.runpipeline])
+def test_same_output_name_is_an_error(tmpdir,driver):
+
+  files = sameinputs(tmpdir)
+  outdir = os.path.join(str(tmpdir),'out')
+  with pytest.raises(ValueError,match='same output file|both be written'):
+    driver(files,outdir,{'outputFormat': 'basic'})
+  assert not os.path.exists(os.path.join(outdir,'raintype.scan.nc'))
+
+def test_same_name_in_time_series(tmpdir):
+
+  #Time-series files are named by time, so the same name is fine.
+  files = sameinputs(tmpdir)
+  outdir = os.path.join(str(tmpdir),'out')
+  summary = batch.runbatch(files,outdir,{'outputFormat': 'basic','timeseries': 'all'})
+
+  assert len(summary['ok']) == 2
+  assert net.readraintype(os.path.join(outdir,'raintype.series.nc')).shape == (2,40,50)
+
+def test_watch_same_output_name(tmpdir):
+
+  files = sameinputs(tmpdir)
+  outdir = os.path.join(str(tmpdir),'out')
+  summary = batch.watch([os.path.join(str(tmpdir),d,'*.nc') for d in 'ab'],outdir,
+                        {'outputFormat': 'basic'},interval=0,settle=0,maxpolls=3)
+
+  assert summary['ok'] == [(files[0],os.path.join(outdir,'raintype.scan.nc'))]
+  assert [f for (f,err) in summary['failed']] == [files[1]]
+
+def test_sparse_ignores_stale_part_file(tmpdir):
+
+  #A .part file left by a killed run holds an earlier scan; it must not end up in the output.
+  infile = os.path.join(str(tmpdir),'scan.nc')
+  outdir = os.path.join(str(tmpdir),'out')
+  ncname = os.path.join(outdir,'raintype.scan.nc')
+  params = {'outputFormat': 'cf','sparse': True}
+  writeinput(infile,bench.makescene('isolated',(40,50),ncores=5,seed=0),0.)
+  batch.runbatch([infile],outdir,params)
+  os.rename(ncname,os.path.join(outdir,'.raintype.scan.nc.part'))
+  writeinput(infile,bench.makescene('isolated',(40,50),ncores=5,seed=1),600.)
+  batch.runbatch([infile],outdir,params)
+
+  with nc4.Dataset(ncname) as ncid:
+    times = ncid.variables['time'][:].tolist()
+  assert times == [600.]
+  assert net.readraintype(ncname).shape == (1,40,50)
+  assert not os.path.exists(os.path.join(outdir,'.raintype.scan.nc.part'))
+
+def variables(ncname):
+
+  #Values of every variable of ncname.
+  with nc4.Dataset(ncname) as ncid:
+    ncid.set_auto_mask(False)
+    return dict((name,var[:]) for (name,var) in ncid.variables.items())
+
+@pytest.mark.parametrize('params',[{'outputFormat': 'basic'},
+                                   {'outputFormat': 'cf'},
+                                   {'outputFormat': 'cf','sparse': True},
+                                   {'outputFormat': 'cf','timeseries': 'all'}])
+def test_pipeline_matches_runbatch(tmpdir,params):
+
+  files = []
+  for k in range(5):
+    files.append(os.path.join(str(tmpdir),'scan{}.nc'.format(k)))
+    writeinput(files[-1],bench.makescene('squall',(60,70),ncores=8,seed=40+k),600.*k)
+  (outbatch,outpipe) = [os.path.join(str(tmpdir),d) for d in ['batch','pipeline']]
+  batch.runbatch(files,outbatch,params)
+  summary = batch.runpipeline(files,outpipe,params,readers=2,writers=2,queuesize=2)
+
+  assert len(summary['ok']) == 5
+  names = sorted(os.listdir(outbatch))
+  assert sorted(os.listdir(outpipe)) == names
+  assert len(names) == (1 if 'timeseries' in params else 5)
+  for name in names:
+    expected = variables(os.path.join(outbatch,name))
+    found = variables(os.path.join(outpipe,name))
+    assert sorted(found) == sorted(expected)
+    for v in expected:
+      assert np.array_equal(found[v],expected[v]), v
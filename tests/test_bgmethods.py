@@ -0,0 +1,79 @@
+""" The fft, oa and sat background methods agree with the direct convolution
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import rtfunctions as rtf
+from uw_raintype import benchmark as bench
+
+METHODS = ['fft','oa','sat']
+
+def randomZ(shape,seed=0,holes=0.2):
+
+  #Random positive Z field with a fraction holes of NaN's.
+  rng = np.random.RandomState(seed)
+  Z = rng.gamma(2.,100.,shape)
+  Z[rng.uniform(size=shape) < holes] = np.nan
+  return Z
+
+#(shape, backgrndradius, dx, dy). The last two masks are larger than the grid.
+CASES = [((60,60),5,1.,None),
+         ((40,90),5,1.,None),
+         ((90,40),8,1.,2.),
+         ((50,70),11,1.,None),
+         ((6,9),12,1.,None),
+         ((3,30),10,1.,None)]
+
+@pytest.mark.parametrize('method',METHODS)
+@pytest.mark.parametrize('shape,radius,dx,dy',CASES)
+def test_background_matches_direct(method,shape,radius,dx,dy):
+
+  Z = randomZ(shape)
+  bgmask = rtf.makebgmask(radius,dx,dy)
+  direct = rtf.get_background_refl(Z,bgmask,'direct')
+  other = rtf.get_background_refl(Z,bgmask,method)
+
+  assert other.shape == Z.shape
+  assert np.array_equal(np.isnan(other),np.isnan(direct))
+  assert np.allclose(other,direct,rtol=1e-9,atol=0,equal_nan=True)
+
+@pytest.mark.parametrize('method',METHODS)
+def test_convolve_matches_direct_without_holes(method):
+
+  A = np.nan_to_num(randomZ((33,47),seed=1))
+  bgmask = rtf.makebgmask(7,1.)
+  direct = rtf.convolve_bgmask(A,bgmask,'direct')
+
+  assert np.allclose(rtf.convolve_bgmask(A,bgmask,method),direct,rtol=1e-9)
+
+@pytest.mark.parametrize('method',METHODS+['auto'])
+@pytest.mark.parametrize('kind,shape',[('isolated',(150,150)),('squall',(120,200)),
+                                       ('stratiform',(200,130))])
+def test_raintype_matches_direct(method,kind,shape):
+
+  refl = bench.makescene(kind,shape,ncores=30,seed=2)
+  params = dict(bench.BENCH_PARAMS)
+  (direct,types) = rt.raintype(refl=refl,bgmethod='direct',**params)
+  (other,types) = rt.raintype(refl=refl,bgmethod=method,**params)
+
+  assert np.array_equal(other,direct)
+
+def test_default_is_direct_convolve2d():
+
+  #The default background is the convolve2d of the original code, bit for bit.
+  from scipy import signal as sg
+  Z = randomZ((50,70),seed=3)
+  bgmask = rtf.makebgmask(5,1.)
+  filled = np.nan_to_num(Z)
+  bg1 = sg.convolve2d(filled,bgmask,mode='same',boundary='symm',fillvalue=0)
+  bg2 = sg.convolve2d((filled != 0).astype(float),bgmask,mode='same',boundary='symm',fillvalue=0)
+  expected = bg1/bg2
+  expected[filled == 0] = np.nan
+
+  assert np.array_equal(rtf.get_background_refl(Z,bgmask),expected,equal_nan=True)
+
+  refl = bench.makescene('squall',(120,130),ncores=20,seed=4)
+  (default,types) = rt.raintype(refl=refl,**bench.BENCH_PARAMS)
+  (direct,types) = rt.raintype(refl=refl,bgmethod='direct',**bench.BENCH_PARAMS)
+  assert np.array_equal(default,direct)
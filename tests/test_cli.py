@@ -0,0 +1,12 @@
+""" Command-line program uw_raintype
+"""
+
+import pytest
+from uw_raintype import cli
+
+def test_watch_rejects_workers(capsys):
+
+  with pytest.raises(SystemExit) as exc:
+    cli.main(['in/*.nc','--watch','-j','4'])
+  assert exc.value.code == 2
+  assert '--workers' in capsys.readouterr().err
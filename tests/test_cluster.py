@@ -0,0 +1,101 @@
+""" makedBZcluster against the original per-object loop
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import rtfunctions as rtf
+
+#Small size thresholds so that objects of every size class fit on a small grid.
+P = {'weakechothres': 7, 'minsize': 4, 'maxsize': 30, 'startslope': 10,
+     'shallowconvmin': 28, 'truncZconvthres': 38}
+
+def referencecluster(refl,isCore,convsfmat,types,dx,dy):
+
+  #The original loop over the echo objects.
+  from scipy import ndimage as nd
+  (echoes,numechoes) = nd.label(refl >= P['weakechothres'])
+  truncvalue = np.full(refl.shape,float(P['truncZconvthres']))
+  for k in range(1,numechoes+1):
+    obj = (echoes == k)
+    clusterarea = dx*dy*np.count_nonzero(obj)
+    if clusterarea >= P['minsize'] and clusterarea <= P['maxsize']:
+      convsfmat[obj] = types['ISO_CONV_FRINGE']
+    if clusterarea < P['minsize']:
+      isCore[obj] = 0
+      convsfmat[obj] = types['WEAK_ECHO']
+    elif clusterarea < P['startslope']:
+      truncvalue[obj] = P['shallowconvmin']
+    elif clusterarea <= P['maxsize']:
+      truncvalue[obj] = P['shallowconvmin'] + float((clusterarea-P['startslope'])/
+                        (P['maxsize']-P['startslope']))*(P['truncZconvthres']-P['shallowconvmin'])
+    isCore[refl >= truncvalue] = types['ISO_CS_CORE']
+    isCore[refl >= P['truncZconvthres']] = types['CS_CORE']
+  return convsfmat, isCore
+
+def handgrid():
+
+  #One row of objects with areas 1, 4 (= minsize), 10 (= startslope), 20, 30 (= maxsize)
+  #and 31 grid points, separated by empty columns. Each object has one point at its own
+  #truncation threshold and one just below it. Two single points touch diagonally.
+  refl = np.full((8,60),np.nan)
+  objects = {}
+  col = 1
+  for (area,trunc) in [(1,38),(4,28),(10,28),(20,33),(30,38),(31,38)]:
+    rows = min(area,4)
+    width = -(-area//rows)
+    block = np.full(rows*width,20.)
+    block[area:] = np.nan
+    block[area-1] = trunc - 0.01
+    block[0] = trunc
+    refl[1:1+rows,col:col+width] = block.reshape(rows,width)
+    objects[area] = (slice(1,1+rows),slice(col,col+width))
+    col += width+1
+  refl[6,col] = 30.
+  refl[7,col+1] = 30.
+  return refl, objects
+
+def run(refl,dx=1.,dy=1.):
+
+  types = dict(rt.TYPES)
+  isCore = np.ones(refl.shape,dtype=np.uint8)
+  isCore[refl < P['weakechothres']] = 0
+  convsfmat = np.full(refl.shape,10,dtype=np.uint8)
+  got = rtf.makedBZcluster(refl,isCore.copy(),convsfmat.copy(),P['weakechothres'],
+                           P['minsize'],P['maxsize'],P['startslope'],P['shallowconvmin'],
+                           P['truncZconvthres'],types,dx,dy=dy)
+  expected = referencecluster(refl,isCore.astype(int),convsfmat.astype(int),types,dx,dy)
+  return got, expected, types
+
+def test_hand_grid_known_classes():
+
+  (refl,objects) = handgrid()
+  ((convsfmat,isCore),expected,types) = run(refl)
+
+  assert np.array_equal(convsfmat,expected[0])
+  assert np.array_equal(isCore,expected[1])
+  #The single points are WEAK_ECHO; objects from minsize to maxsize are FRINGE; the
+  #31-point object keeps its class.
+  assert np.all(convsfmat[objects[1]][~np.isnan(refl[objects[1]])] == types['WEAK_ECHO'])
+  for area in [4,10,20,30]:
+    assert np.all(convsfmat[objects[area]][~np.isnan(refl[objects[area]])] == types['ISO_CONV_FRINGE'])
+  assert np.all(convsfmat[objects[31]] == 10)
+  #A point at its object's threshold is a core, one just below is not.
+  for (area,code) in [(4,'ISO_CS_CORE'),(10,'ISO_CS_CORE'),(20,'ISO_CS_CORE'),(30,'CS_CORE'),
+                      (31,'CS_CORE')]:
+    core = isCore[objects[area]].ravel()
+    assert core[0] == types[code]
+    assert core[area-1] == 1
+  assert np.count_nonzero(convsfmat == types['WEAK_ECHO']) == 3
+
+@pytest.mark.parametrize('dx,dy',[(1.,1.),(0.5,2.),(2.,0.5),(0.7,0.7)])
+@pytest.mark.parametrize('seed',[0,1,2])
+def test_random_fields_match_loop(dx,dy,seed):
+
+  rng = np.random.RandomState(seed)
+  refl = rng.uniform(-10,50,(40,50))
+  refl[rng.uniform(size=refl.shape) < 0.35] = np.nan
+  ((convsfmat,isCore),expected,types) = run(refl,dx,dy)
+
+  assert np.array_equal(convsfmat,expected[0])
+  assert np.array_equal(isCore,expected[1])
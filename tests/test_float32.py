@@ -0,0 +1,53 @@
+""" RainTypeClassifier(dtype=np.float32) against float64
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import benchmark as bench
+
+def threshold_grid():
+
+  #Three 3x3 objects of 20 dBZ (area 9 km^2, so their threshold is shallowconvmin = 28)
+  #with centers exactly at, just below and just above the threshold, a single point of
+  #30 dBZ (smaller than minsize) and a 50x50 object (area above maxsize) with a point
+  #exactly at truncZconvthres = 38 and one just below.
+  refl = np.full((60,80),-9999.)
+  for (col,center) in [(2,28.),(8,np.nextafter(np.float32(28),0)),(14,28.0001)]:
+    refl[2:5,col:col+3] = 20.
+    refl[3,col+1] = center
+  refl[10,2] = 30.
+  refl[8:58,25:75] = 25.
+  refl[30,40] = 38.
+  refl[30,60] = 37.999
+  return refl
+
+@pytest.mark.parametrize('dtype',[np.float64,np.float32])
+def test_threshold_grid_known_classes(dtype):
+
+  refl = threshold_grid()
+  clf = rt.RainTypeClassifier(refl.shape,dtype=dtype,**bench.BENCH_PARAMS)
+  out = clf.classify(refl)
+  t = clf.types
+
+  assert clf.work['truncvalue'].dtype == dtype
+  assert out[3,3] == t['ISO_CONV_CORE']
+  assert out[3,9] == t['ISO_CONV_FRINGE']
+  assert out[3,15] == t['ISO_CONV_CORE']
+  assert np.all(out[2:5,2:17][out[2:5,2:17] != t['ISO_CONV_CORE']] != t['NO_ECHO'])
+  assert out[10,2] == t['WEAK_ECHO']
+  assert out[30,40] == t['CONVECTIVE']
+  assert out[30,60] == t['STRATIFORM']
+  #MIXED surrounds the convective core, up to dBZformaxconvradius-dependent radius.
+  assert out[30,43] == t['MIXED']
+  assert np.count_nonzero(out == t['CONVECTIVE']) == 1
+  assert np.all(out[refl == -9999] == -9999)
+
+@pytest.mark.parametrize('kind',['isolated','squall','stratiform'])
+def test_float32_matches_float64(kind):
+
+  refl = bench.makescene(kind,(150,150),ncores=30,seed=5)
+  out64 = rt.RainTypeClassifier(refl.shape,**bench.BENCH_PARAMS).classify(refl)
+  out32 = rt.RainTypeClassifier(refl.shape,dtype=np.float32,**bench.BENCH_PARAMS).classify(refl)
+
+  assert np.array_equal(out32,out64)
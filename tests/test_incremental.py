@@ -0,0 +1,47 @@
+""" RainTypeClassifier(incremental=True) gives the same rain types as a full recompute
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import instrument as ins
+from uw_raintype import benchmark as bench
+
+def scans(shape):
+
+  #A scene, the same scene with a new cell in a few rows, and a scene that differs
+  #almost everywhere.
+  first = bench.makescene('squall',shape,ncores=20,seed=13)
+  second = first.copy()
+  second[60:64,20:30] = 48
+  third = bench.makescene('stratiform',shape,ncores=20,seed=14)
+  return [first,second,third,first]
+
+@pytest.mark.parametrize('bgmethod',['direct','sat'])
+@pytest.mark.parametrize('dtype',[np.float64,np.float32])
+def test_incremental_matches_full(bgmethod,dtype):
+
+  shape = (150,110)
+  params = dict(bench.BENCH_PARAMS,bgmethod=bgmethod,dtype=dtype)
+  full = rt.RainTypeClassifier(shape,**params)
+  incremental = rt.RainTypeClassifier(shape,incremental=True,**params)
+  recorder = ins.StageRecorder()
+  for refl in scans(shape):
+    expected = full.classify(refl)
+    assert np.array_equal(incremental.classify(refl,recorder=recorder),expected)
+
+  #Only the rows within backgrndradius of rows 60 to 63 are redone for the second scan;
+  #the third and fourth change more than maxdirty of the rows and are redone in full.
+  rows = [s['counts']['background_rows'] for s in recorder.scans]
+  assert rows == [150,14,150,150]
+
+def test_maxdirty_zero_always_recomputes():
+
+  shape = (120,100)
+  full = rt.RainTypeClassifier(shape,**bench.BENCH_PARAMS)
+  incremental = rt.RainTypeClassifier(shape,incremental=True,maxdirty=0,**bench.BENCH_PARAMS)
+  recorder = ins.StageRecorder()
+  for refl in scans(shape)[:2]:
+    assert np.array_equal(incremental.classify(refl,recorder=recorder),full.classify(refl))
+
+  assert [s['counts']['background_rows'] for s in recorder.scans] == [120,120]
@@ -0,0 +1,102 @@
+""" raintype and get_background_refl leave their inputs alone unless inplace=True
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import rtfunctions as rtf
+from uw_raintype import benchmark as bench
+
+SCENES = [('isolated',(120,120)),('squall',(100,160)),('stratiform',(150,110))]
+
+@pytest.mark.parametrize('kind,shape',SCENES)
+def test_raintype_default_keeps_refl(kind,shape):
+
+  refl = bench.makescene(kind,shape,ncores=20,seed=3)
+  before = refl.copy()
+  rt.raintype(refl=refl,**bench.BENCH_PARAMS)
+
+  assert np.array_equal(refl,before)
+
+def test_background_default_keeps_Z():
+
+  refl = bench.makescene('squall',(80,90),ncores=10,seed=4)
+  Z = rtf.DBZtoZ(np.where(refl == -9999,np.nan,refl))
+  before = Z.copy()
+  rtf.get_background_refl(Z,rtf.makebgmask(5,1.))
+
+  assert np.array_equal(Z,before,equal_nan=True)
+
+def test_raintype_inplace_sets_nan():
+
+  refl = bench.makescene('isolated',(100,100),ncores=20,seed=5)
+  missing = (refl == -9999)
+  before = refl.copy()
+  rt.raintype(refl=refl,inplace=True,**bench.BENCH_PARAMS)
+
+  assert np.all(np.isnan(refl[missing]))
+  assert np.array_equal(refl[~missing],before[~missing])
+
+def test_background_inplace_fills_Z():
+
+  refl = bench.makescene('stratiform',(70,80),ncores=10,seed=6)
+  Z = rtf.DBZtoZ(np.where(refl == -9999,np.nan,refl))
+  isnan = np.isnan(Z)
+  bgmask = rtf.makebgmask(5,1.)
+  expected = rtf.get_background_refl(Z,bgmask)
+  background = rtf.get_background_refl(Z,bgmask,inplace=True)
+
+  #NaN's become 0 and the nonzero linear values 1.
+  assert np.all(Z[isnan] == 0)
+  assert np.all(Z[~isnan] == 1)
+  assert np.array_equal(background,expected,equal_nan=True)
+
+@pytest.mark.parametrize('kind,shape',SCENES)
+def test_inplace_same_rain_type(kind,shape):
+
+  refl = bench.makescene(kind,shape,ncores=20,seed=7)
+  (copied,types) = rt.raintype(refl=refl,**bench.BENCH_PARAMS)
+  (inplace,types) = rt.raintype(refl=refl.copy(),inplace=True,**bench.BENCH_PARAMS)
+
+  assert inplace.dtype == copied.dtype
+  assert np.array_equal(inplace,copied)
+
+def test_integer_refl():
+
+  refl = np.round(bench.makescene('squall',(100,120),ncores=20,seed=8)).astype(np.int16)
+  before = refl.copy()
+  (expected,types) = rt.raintype(refl=refl.astype(float),**bench.BENCH_PARAMS)
+  (copied,types) = rt.raintype(refl=refl,**bench.BENCH_PARAMS)
+  (inplace,types) = rt.raintype(refl=refl,inplace=True,**bench.BENCH_PARAMS)
+
+  #Integer refl is always copied, so it can't hold the NaN's.
+  assert np.array_equal(refl,before)
+  assert np.array_equal(copied,expected)
+  assert np.array_equal(inplace,expected)
+
+def handgrid(dtype):
+
+  #A 3x3 block of 20 dBZ with one missing point, on a grid that is otherwise missing:
+  #one object of 8 km^2 (= minsize), so ISOLATED CONVECTIVE FRINGE without a core.
+  refl = np.full((8,10),-9999,dtype=dtype)
+  refl[2:5,3:6] = 20
+  refl[4,5] = -9999
+  expected = np.full(refl.shape,-9999)
+  expected[2:5,3:6] = rt.TYPES['ISO_CONV_FRINGE']
+  expected[4,5] = -9999
+  return refl, expected
+
+@pytest.mark.parametrize('dtype',[np.float64,np.float32,np.int16])
+@pytest.mark.parametrize('inplace',[False,True])
+def test_hand_grid(dtype,inplace):
+
+  (refl,expected) = handgrid(dtype)
+  before = refl.copy()
+  (rtout,types) = rt.raintype(refl=refl,inplace=inplace,**bench.BENCH_PARAMS)
+
+  assert np.array_equal(rtout,expected)
+  if inplace and dtype != np.int16:
+    assert np.array_equal(np.isnan(refl),before == -9999)
+    assert np.all(refl[before != -9999] == 20)
+  else:
+    assert np.array_equal(refl,before)
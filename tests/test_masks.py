@@ -0,0 +1,103 @@
+""" Masks of rtfunctions: the cache of getmasks, the MIXED-radius stamping and the radar coverage
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import rtfunctions as rtf
+
+def test_getmasks_one_entry_for_square_grid():
+
+  rtf.cachedmasks.cache_clear()
+  a = rtf.getmasks(5,10,1.)
+  b = rtf.getmasks(5,10,1,dy=None)
+  c = rtf.getmasks(5,10,1.,1.)
+
+  assert a is b and b is c
+  assert rtf.cachedmasks.cache_info().currsize == 1
+  assert not a[0].flags.writeable
+
+def referencemixedmask(cores,convclass,maskcell):
+
+  #The original per-core loop of convectivecore: a full-grid array per core, with the
+  #mask of a core near the edge trimmed as chopmask did. Note that chopmask trims
+  #columns from the opposite side of the one that sticks out, so near the left and
+  #right edges the trimmed mask is mirrored in x.
+  (ny,nx) = cores.shape
+  maskind = np.zeros(cores.shape,dtype=int)
+  for (i,j) in zip(*np.nonzero(cores)):
+    mask = maskcell[convclass[i,j]]
+    (n,m) = (mask.shape[0]//2,mask.shape[1]//2)
+    (Ilow,Ihigh,Jlow,Jhigh) = (max(i-n,0),min(i+n,ny-1),max(j-m,0),min(j+m,nx-1))
+    (top,bottom,left,right) = (Ilow-(i-n),(i+n)-Ihigh,Jlow-(j-m),(j+m)-Jhigh)
+    chopped = mask[top:mask.shape[0]-bottom,right:mask.shape[1]-left]
+    dummy = np.zeros(cores.shape,dtype=int)
+    dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = chopped
+    maskind += dummy
+  return maskind != 0
+
+def randomcores(shape,ncores,seed):
+
+  rng = np.random.RandomState(seed)
+  cores = np.zeros(shape,dtype=bool)
+  cores[rng.randint(0,shape[0],ncores),rng.randint(0,shape[1],ncores)] = True
+  #Cores in every corner and on every edge.
+  (ny,nx) = shape
+  for (i,j) in [(0,0),(0,nx-1),(ny-1,0),(ny-1,nx-1),(0,nx//2),(ny//2,0),(ny-1,nx//2)]:
+    cores[i,j] = True
+  convclass = rng.randint(0,5,shape).astype(np.int8)
+  return cores, convclass
+
+#Few cores are stamped one by one; many go through dilatedisk.
+@pytest.mark.parametrize('ncores',[3,40,2000])
+@pytest.mark.parametrize('shape,dx,dy',[((60,60),1.,1.),((45,80),1.,1.),((70,50),0.5,2.),
+                                        ((12,15),1.,1.)])
+def test_makemixedmask_matches_loop(ncores,shape,dx,dy):
+
+  maskcell = rtf.makeconvmask(10,dx,dy)
+  (cores,convclass) = randomcores(shape,ncores,seed=ncores)
+
+  assert np.array_equal(rtf.makemixedmask(cores,convclass,maskcell),
+                        referencemixedmask(cores,convclass,maskcell))
+
+def test_makemixedmask_single_core_known_stamp():
+
+  #One core of the smallest class (radius 6 km at dx = 1 km) in the middle of the top
+  #edge covers the lower half of the disk of points within 6 km.
+  maskcell = rtf.makeconvmask(10,1.)
+  cores = np.zeros((20,20),dtype=bool)
+  cores[0,10] = True
+  out = rtf.makemixedmask(cores,np.zeros((20,20),dtype=np.int8),maskcell)
+  (i,j) = np.mgrid[0:20,0:20]
+
+  assert np.array_equal(out,i**2 + (j-10)**2 <= 36)
+  assert np.count_nonzero(out) == 63
+
+@pytest.mark.parametrize('stamp',[rtf.makeconvmask(8,1.)[2] != 0,
+                                  rtf.makeconvmask(10,0.5,2.)[4] != 0,
+                                  np.array([[1,0,1],[0,1,0],[1,0,1]],dtype=bool)])
+def test_dilatedisk_matches_binary_dilation(stamp):
+
+  from scipy import ndimage as nd
+  (cores,convclass) = randomcores((40,55),30,seed=1)
+  out = np.zeros(cores.shape,dtype=bool)
+  out[5,5] = True
+  expected = out | nd.binary_dilation(cores,structure=stamp)
+
+  assert np.array_equal(rtf.dilatedisk(cores,stamp,out),expected)
+
+def test_radial_distance_mask_is_a_copy():
+
+  #The mask matches the original double loop, and changing it doesn't change the next one.
+  (ny,nx,dx,dy) = (21,30,1.,1.5)
+  expected = np.zeros((ny,nx))
+  for j in range(ny):
+    for i in range(nx):
+      dist = np.hypot((ny//2-0.5-j)*dy,(nx//2-0.5-i)*dx)
+      if 3 < dist < 12:
+        expected[j,i] = 1
+  mask = rtf.radial_distance_mask(3,12,nx,ny,dx,dy)
+  assert np.array_equal(mask,expected)
+  assert mask.dtype == float
+  mask[:] = 7
+
+  assert np.array_equal(rtf.radial_distance_mask(3,12,nx,ny,dx,dy),expected)
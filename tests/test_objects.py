@@ -0,0 +1,48 @@
+""" The object table of raintype(..., return_objects=True)
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import benchmark as bench
+
+@pytest.mark.parametrize('kind',['isolated','squall'])
+def test_core_counts(kind):
+
+  refl = bench.makescene(kind,(150,160),ncores=30,seed=1)
+  (rtout,types,labels,table) = rt.raintype(refl=refl,return_objects=True,**bench.BENCH_PARAMS)
+
+  #Every core stays CONVECTIVE or ISO_CONV_CORE in the final classification.
+  assert table['CS_CORE'].sum() == np.count_nonzero(rtout == types['CONVECTIVE'])
+  assert table['ISO_CS_CORE'].sum() == np.count_nonzero(rtout == types['ISO_CONV_CORE'])
+  assert table['CS_CORE'].sum() + table['ISO_CS_CORE'].sum() > 0
+  for name in ['STRATIFORM','CONVECTIVE','MIXED']:
+    assert table[name].sum() == np.count_nonzero((rtout == types[name]) & (labels > 0))
+
+def test_hand_grid_table():
+
+  #A 3x3 object of 20 dBZ with a 30 dBZ center, a 2x5 object of 15 dBZ and a single
+  #point of 25 dBZ. With minsize 8 km^2 and startslope 50 km^2, the first two are
+  #isolated with threshold shallowconvmin = 28, so only the 30 dBZ center is a core;
+  #the single point is WEAK_ECHO.
+  refl = np.full((12,20),-9999.)
+  refl[1:4,1:4] = 20.
+  refl[2,2] = 30.
+  refl[6:8,4:9] = 15.
+  refl[10,15] = 25.
+  (rtout,types,labels,table) = rt.raintype(refl=refl,return_objects=True,**bench.BENCH_PARAMS)
+
+  assert list(table['id']) == [1,2,3]
+  assert list(table['area']) == [9.,10.,1.]
+  assert [list(table[k]) for k in ['row0','row1','col0','col1']] == [[1,6,10],[4,8,11],
+                                                                     [1,4,15],[4,9,16]]
+  assert list(table['max_dbz']) == [30.,15.,25.]
+  assert list(table['truncvalue']) == [28.,28.,38.]
+  assert list(table['ISO_CONV_FRINGE']) == [8,10,0]
+  assert list(table['ISO_CONV_CORE']) == [1,0,0]
+  assert list(table['ISO_CS_CORE']) == [1,0,0]
+  assert list(table['CS_CORE']) == [0,0,0]
+  assert list(table['WEAK_ECHO']) == [0,0,1]
+  assert list(table['STRATIFORM']) == [0,0,0]
+  assert labels[2,2] == 1 and labels[7,8] == 2 and labels[10,15] == 3
+  assert np.count_nonzero(labels) == 20
@@ -0,0 +1,75 @@
+""" rain_type storage settings of the NetCDF output
+"""
+
+import os
+import netCDF4 as nc4
+import numpy as np
+import pytest
+from uw_raintype import netcdf_io as net
+from uw_raintype import raintype as rt
+from uw_raintype import benchmark as bench
+
+def write(ncname,rtout,storage=None):
+
+  p = bench.BENCH_PARAMS
+  net.writeBasicNetcdf(ncname,rt.TYPES,p['deepcoszero'],p['shallowconvmin'],p['minZdiff'],
+                       p['truncZconvthres'],p['dBZformaxconvradius'],p['weakechothres'],
+                       p['backgrndradius'],p['maxConvRadius'],p['minsize'],p['startslope'],
+                       p['maxsize'],'test','','','','','',1,0,0,rtout,-9999,storage=storage)
+
+def rawraintype(ncname):
+
+  #rain_type exactly as stored, without masking or unpacking.
+  with nc4.Dataset(ncname) as ncid:
+    var = ncid.variables['rain_type']
+    var.set_auto_mask(False)
+    return var[:], var.dtype, var.chunking()
+
+@pytest.mark.parametrize('shape',[(50,70),(300,20),(9,9)])
+@pytest.mark.parametrize('name',sorted(bench.STORAGE_SETTINGS))
+def test_storage_small_grids(tmpdir,shape,name):
+
+  #Chunks larger than the grid (e.g. int8_zlib4_256) are shrunk to fit it.
+  rtout = np.random.RandomState(0).randint(0,7,shape)
+  rtout[:3,:3] = -9999
+  ncname = os.path.join(str(tmpdir),'rt.nc')
+  write(ncname,rtout,bench.STORAGE_SETTINGS[name])
+
+  assert np.array_equal(net.readraintype(ncname,-9999)[0],rtout)
+
+HAND = np.array([[0,1,2],[3,-9999,6]])
+
+def test_int8_hand_values(tmpdir):
+
+  #-9999 does not fit in int8, so missing points are stored as -128, the _FillValue.
+  ncname = os.path.join(str(tmpdir),'rt.nc')
+  write(ncname,HAND,{'chunks': (1,256,256)})
+  (raw,dtype,chunks) = rawraintype(ncname)
+
+  assert dtype == np.int8
+  assert chunks == [1,2,3]
+  assert raw.tolist() == [[[0,1,2],[3,-128,6]]]
+
+def test_packbits_hand_values(tmpdir):
+
+  #Two 4-bit rain types per byte, the first in the high bits; 15 for missing points and
+  #for the padding of the odd last column.
+  ncname = os.path.join(str(tmpdir),'rt.nc')
+  write(ncname,HAND,{'packbits': True})
+  (raw,dtype,chunks) = rawraintype(ncname)
+
+  assert dtype == np.uint8
+  assert raw.tolist() == [[[0x01,0x2F],[0x3F,0x6F]]]
+  assert np.array_equal(net.readraintype(ncname,-9999)[0],HAND)
+
+def test_runs_hand_values():
+
+  #NO_ECHO (0) and WEAK_ECHO (6) are left out; missing points are kept with type fill.
+  grid = np.array([[0,1,1,6,2],[2,2,-9999,0,0],[3,3,3,3,1]])
+  (start,length,types) = net.encoderuns(grid,-9999,[0,6],-1)
+
+  assert start.tolist() == [1,4,7,10,14]
+  assert length.tolist() == [2,3,1,4,1]
+  assert types.tolist() == [1,2,-1,3,1]
+  back = net.expandruns(start,length,types,grid.shape,0)
+  assert back.tolist() == [[0,1,1,0,2],[2,2,-1,0,0],[3,3,3,3,1]]
@@ -0,0 +1,26 @@
+""" raintype_sweep gives the same rain types as raintype for every combination
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import sweep
+from uw_raintype import benchmark as bench
+
+GRID = {'truncZconvthres': [36,42],
+        'weakechothres': [7,15],
+        'backgrndradius': [5,8],
+        'maxConvRadius': [6,10],
+        'minsize': [8,40]}
+
+@pytest.mark.parametrize('kind,shape,dy',[('squall',(90,120),None),('isolated',(100,80),2.)])
+def test_sweep_matches_raintype(kind,shape,dy):
+
+  refl = bench.makescene(kind,shape,ncores=20,seed=12)
+  fixed = dict((k,v) for (k,v) in bench.BENCH_PARAMS.items() if k not in GRID)
+  (out,combos,types) = sweep.raintype_sweep(refl,GRID,refl_dy=dy,**fixed)
+
+  assert out.shape == (32,)+shape
+  for (c,p) in enumerate(combos):
+    (expected,types) = rt.raintype(refl=refl,**p)
+    assert np.array_equal(out[c],expected)
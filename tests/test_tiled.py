@@ -0,0 +1,30 @@
+""" raintype_tiled gives the same rain types as raintype
+"""
+
+import numpy as np
+import pytest
+from uw_raintype import raintype as rt
+from uw_raintype import tiled
+from uw_raintype import benchmark as bench
+
+def splitscene(tilerows):
+
+  #A squall line plus a 45 dBZ core in 30 dBZ rain that the strip boundary at row
+  #tilerows cuts in half, so the object, its core and its MIXED radius span two strips.
+  refl = bench.makescene('squall',(160,120),ncores=20,seed=11)
+  refl[tilerows-25:tilerows+25,40:90] = 30
+  refl[tilerows-4:tilerows+4,60:70] = 45
+  return refl
+
+@pytest.mark.parametrize('nworkers',[1,3])
+@pytest.mark.parametrize('tilerows',[40,80])
+def test_tiled_matches_raintype(nworkers,tilerows):
+
+  refl = splitscene(tilerows)
+  (expected,types) = rt.raintype(refl=refl,**bench.BENCH_PARAMS)
+  (rtout,types) = tiled.raintype_tiled(refl,tilerows=tilerows,nworkers=nworkers,
+                                       **bench.BENCH_PARAMS)
+
+  core = expected[tilerows-4:tilerows+4,60:70]
+  assert np.all(core == rt.TYPES['CONVECTIVE'])
+  assert np.array_equal(rtout,expected)
@@ -0,0 +1,74 @@
+""" Time-series files of TimeSeriesWriter and batch.appendseries, dense and sparse
+"""
+
+import os
+import netCDF4 as nc4
+import numpy as np
+import pytest
+from uw_raintype import batch
+from uw_raintype import raintype as rt
+from uw_raintype import netcdf_io as net
+from uw_raintype import benchmark as bench
+from conftest import writeinput
+
+def inputs(tmpdir,n):
+
+  #n scans, 10 minutes apart.
+  files = []
+  for k in range(n):
+    files.append(os.path.join(str(tmpdir),'scan{}.nc'.format(k)))
+    writeinput(files[-1],bench.makescene('squall',(50,60),ncores=8,seed=20+k),600.*k)
+  return files
+
+def series(ncname):
+
+  with nc4.Dataset(ncname) as ncid:
+    times = ncid.variables['time'][:].tolist()
+    sources = [os.path.basename(f) for f in ncid.variables['source_file'][:]]
+  return times, sources
+
+@pytest.mark.parametrize('sparse',[False,True])
+def test_rerun_appends_only_new_scans(tmpdir,sparse):
+
+  files = inputs(tmpdir,3)
+  single = os.path.join(str(tmpdir),'single')
+  batch.runbatch(files,single,{'outputFormat': 'cf'})
+  expected = [net.readraintype(os.path.join(single,'raintype.scan{}.nc'.format(k)),-9999)[0]
+              for k in range(3)]
+  if sparse:
+    #Sparse files leave out WEAK_ECHO, which is read back as NO_ECHO.
+    for e in expected:
+      e[e == rt.TYPES['WEAK_ECHO']] = rt.TYPES['NO_ECHO']
+
+  #Two scans, then a run that repeats the second and adds the third to the reopened file.
+  outdir = os.path.join(str(tmpdir),'series')
+  params = {'outputFormat': 'cf','timeseries': 'all','sparse': sparse}
+  batch.runbatch(files[:2],outdir,params)
+  summary = batch.runbatch(files[1:],outdir,params)
+  ncname = os.path.join(outdir,'raintype.series.nc')
+
+  assert len(summary['ok']) == 2
+  assert series(ncname) == ([0.,600.,1200.],['scan0.nc','scan1.nc','scan2.nc'])
+  assert np.array_equal(net.readraintype(ncname,-9999),np.stack(expected))
+  for k in range(3):
+    assert np.array_equal(net.readraintype(ncname,-9999,index=k),expected[k])
+
+@pytest.mark.parametrize('sparse',[False,True])
+def test_writer_reopened_for_appending(tmpdir,sparse):
+
+  #TimeSeriesWriter on an existing file picks up its scans, sources and layout.
+  ncname = os.path.join(str(tmpdir),'rt.nc')
+  params = dict(batch.DEFAULT_PARAMS)
+  grids = [np.full((4,5),k) for k in [0,1,2]]
+  grids[1][0,:2] = -9999
+  coords = {'dx': 1, 'dy': 1}
+  with net.TimeSeriesWriter(ncname,rt.TYPES,params,-9999,sparse=sparse) as writer:
+    for k in range(2):
+      writer.append(grids[k],60.*k,'f{}'.format(k),coords)
+  with net.TimeSeriesWriter(ncname,rt.TYPES,params,-9999) as writer:
+    assert writer.sparse == sparse
+    assert writer.sources == {'f0','f1'}
+    writer.append(grids[2],120.,'f2',coords)
+
+  assert series(ncname) == ([0.,60.,120.],['f0','f1','f2'])
+  assert np.array_equal(net.readraintype(ncname,-9999),np.stack(grids))
@@ -0,0 +1,38 @@
+""" Zarr stores of batch.runzarr and zarr_io
+"""
+
+import os
+import numpy as np
+import pytest
+from uw_raintype import batch
+from uw_raintype import netcdf_io as net
+from uw_raintype import benchmark as bench
+from conftest import writeinput
+
+zarr = pytest.importorskip('zarr')
+from uw_raintype import zarr_io as zio
+
+@pytest.mark.parametrize('nworkers,timechunk',[(1,1),(1,2),(2,2)])
+def test_zarr_round_trip(tmpdir,nworkers,timechunk):
+
+  #The store holds the same times and rain types as one NetCDF file per scan.
+  files = []
+  for k in range(3):
+    files.append(os.path.join(str(tmpdir),'scan{}.nc'.format(k)))
+    writeinput(files[-1],bench.makescene('isolated',(40,50),ncores=6,seed=30+k),600.*k)
+  single = os.path.join(str(tmpdir),'single')
+  batch.runbatch(files,single,{'outputFormat': 'cf'})
+  expected = np.stack([net.readraintype(os.path.join(single,'raintype.scan{}.nc'.format(k)),
+                                        -9999)[0] for k in range(3)])
+
+  storename = os.path.join(str(tmpdir),'rt.zarr')
+  summary = batch.runzarr(files,storename,{'outputFormat': 'cf'},nworkers,timechunk)
+  (times,rtout) = zio.readCFzarr(storename,missing_value=-9999)
+
+  assert len(summary['ok']) == 3
+  assert times.tolist() == [0.,600.,1200.]
+  assert np.array_equal(rtout,expected)
+
+  (times,rtout) = zio.readCFzarr(storename,tstart=600.,missing_value=-9999)
+  assert times.tolist() == [600.,1200.]
+  assert np.array_equal(rtout,expected[1:])
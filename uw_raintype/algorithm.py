@@ -2,149 +2,114 @@ from __future__ import division     #For python2 users only.
 
 def convectivecore(background,refl,minZdiff,types,dBZformaxconvradius,
                    maxConvRadius,weakechothres,deepcoszero,minsize,maxsize,
-                   startslope,shallowconvmin,truncZconvthres,dx,maskcell):
+                   startslope,shallowconvmin,truncZconvthres,dx,maskcell,work=None,
+                   recorder=None,echoes=None,clusterarea=None,dy=None,objects=None):
    
   import numpy as np
   from uw_raintype import rtfunctions as rt
+  from uw_raintype import instrument as ins
   from scipy import signal as sg
 
-  #Allocate isCore, a matrix that contains whether a grid point contains a convective core
-  #and convsfmat, what will ultimately be the final rain-type classification.
-  isCore = np.ones(background.shape)
-  convsfmat = 10*np.ones((refl.shape),dtype=np.int)
-
-  #Allocate zDiff, the variable representing the excess over the background dBZ
-  #an echo must achieve to be considered a convective core.
-  zDiff = np.empty(refl.shape)
-  zDiff[:] = np.nan
-
-  #Compute zDiff
-  zDiff = 2.5 + minZdiff * (np.cos((np.pi)*background*0.5/deepcoszero))
-  zDiff[(background < 0)] = minZdiff 
+  #work is an optional dict of scratch arrays that is reused between calls (see
+  #rtfunctions.workarray). With work=None every array is allocated afresh.
+  #recorder is an optional instrument.StageRecorder that times each stage.
+  #echoes and clusterarea optionally give the echo objects and their areas, which are
+  #otherwise found by makedBZcluster (see makedBZcluster). dy is the grid spacing in y
+  #if it differs from dx; maskcell must have been made with the same dx and dy.
+  #objects is an optional dict that makedBZcluster fills with the echo objects; the
+  #final isCore ('isCore') is added to it for objecttable.
 
-  #If reflectivity exceeds background dBZ by zDiff, then echo is convective core.
-  isCore[(refl-background >= zDiff)] = types['CS_CORE'];
-
-  #No chance of weak echoes being convective cores.
-  isCore[(refl < weakechothres)] = 0
+  #Allocate isCore, a matrix that contains whether a grid point contains a convective core
+  #and convsfmat, what will ultimately be the final rain-type classification. Both only
+  #hold small category values, so they are stored as uint8.
+  isCore = rt.workarray(work,'isCore',background.shape,np.uint8)
+  isCore.fill(1)
+  convsfmat = rt.workarray(work,'convsfmat',refl.shape,np.uint8)
+  convsfmat.fill(10)
+  select = rt.workarray(work,'coreselect',refl.shape,bool)
+
+  with ins.stage(recorder,'core_thresholds',refl):
+    #Allocate zDiff, the variable representing the excess over the background dBZ
+    #an echo must achieve to be considered a convective core.
+    zDiff = rt.workarray(work,'zDiff',refl.shape,background.dtype)
+
+    #Compute zDiff = 2.5 + minZdiff * cos(pi*background*0.5/deepcoszero)
+    np.multiply(background,np.pi,out=zDiff)
+    np.multiply(zDiff,0.5,out=zDiff)
+    np.divide(zDiff,deepcoszero,out=zDiff)
+    np.cos(zDiff,out=zDiff)
+    np.multiply(zDiff,minZdiff,out=zDiff)
+    np.add(zDiff,2.5,out=zDiff)
+    zDiff[(background < 0)] = minZdiff 
+
+    #If reflectivity exceeds background dBZ by zDiff, then echo is convective core.
+    excess = rt.workarray(work,'excess',refl.shape,np.result_type(refl,background))
+    np.subtract(refl,background,out=excess)
+    isCore[np.greater_equal(excess,zDiff,out=select)] = types['CS_CORE']
+
+    #No chance of weak echoes being convective cores.
+    isCore[np.less(refl,weakechothres,out=select)] = 0
 
   #Run the shallow, isolated convective core algorithm to detect small echoes that were
   #often identified as STRATIFORM by Steiner et al. (1995)
-  (convsfmat,isCore) = rt.makedBZcluster(refl,isCore,convsfmat,weakechothres,
-                                         minsize,maxsize,startslope,shallowconvmin,
-                                         truncZconvthres,types,dx)
+  with ins.stage(recorder,'makedBZcluster',refl):
+    (convsfmat,isCore) = rt.makedBZcluster(refl,isCore,convsfmat,weakechothres,
+                                           minsize,maxsize,startslope,shallowconvmin,
+                                           truncZconvthres,types,dx,work,recorder,
+                                           echoes,clusterarea,dy,objects)
+    if objects is not None:
+      objects['isCore'] = isCore
  
   #Make initial guesses of classifications. There may be some redundancy in this code,
   #later, but these operations are fast, I think. Better safe than sorry.
-  convsfmat[(isCore == types['CS_CORE'])] = types['CONVECTIVE']
-  convsfmat[(isCore == types['ISO_CS_CORE'])] = types['ISO_CONV_CORE']
-  convsfmat[(isCore == 0)] = types['WEAK_ECHO']
-  convsfmat[(convsfmat == 10)] = types['STRATIFORM']
-  convsfmat[(np.isnan(refl) == True)] = types['NO_ECHO']
-  convsfmat[(refl < weakechothres)] = types['WEAK_ECHO']
+  convsfmat[np.equal(isCore,types['CS_CORE'],out=select)] = types['CONVECTIVE']
+  convsfmat[np.equal(isCore,types['ISO_CS_CORE'],out=select)] = types['ISO_CONV_CORE']
+  convsfmat[np.equal(isCore,0,out=select)] = types['WEAK_ECHO']
+  convsfmat[np.equal(convsfmat,10,out=select)] = types['STRATIFORM']
+  convsfmat[np.isnan(refl,out=select)] = types['NO_ECHO']
+  convsfmat[np.less(refl,weakechothres,out=select)] = types['WEAK_ECHO']
 
   #Now assign MIXED radius to each core. Currently assumes all echoes within 
   #maxConvRadius - 4 km are MIXED classification. Stronger echoes have larger 
   #uncertain radius. Uncertain radii of 6-10 km appear to be supported by algorithm 
   #testing on WRF output as seen in Powell et al. (2016). 
 
-  #Compute what the uncertain radius is as a function of echo intensity.
-  convRadiuskm = np.empty(refl.shape)
-  convRadiuskm[:] = np.nan
-  convRadiuskm[(background <= dBZformaxconvradius - 15 )] = maxConvRadius - 4
-  convRadiuskm[(background > dBZformaxconvradius - 15 )] = maxConvRadius - 3 
-  convRadiuskm[(background > dBZformaxconvradius - 10 )] = maxConvRadius - 2
-  convRadiuskm[(background > dBZformaxconvradius - 5 )] = maxConvRadius - 1
-  convRadiuskm[(background >= dBZformaxconvradius)] = maxConvRadius
-
-  ##Assign MIXED classification to pixels near convective cores.
-
-  #Find 2D indices of convective cores.
-  (I,J) = np.where(isCore==types['CS_CORE'])
-
-  d = list(range(maxConvRadius-4,maxConvRadius+1))
-  n = [np.int16(np.floor(x/dx)) for x in d]
-
-  #Allocate mask
-  maskind = np.zeros((refl.shape),dtype=np.int)
-  for k in range(0,len(I)):
-    #dummy saves that result so far. Initialize as a bunch of zeroes.
-    dummy = np.zeros((refl.shape),dtype=np.int)
- 
-    #Make mask for convective cores close to the edge of the domain
-    nlow = n[np.int16(convRadiuskm[I[k],J[k]]-6)]
-    nhigh = refl.shape[0]-nlow-1      #This assumes domain is a square.
-    Ilow = I[k]-nlow
-    Ihigh = I[k]+nlow
-    Jlow = J[k]-nlow
-    Jhigh = J[k]+nlow
-    
-    #If the data point is close to any edge, then determine how much of the mask to
-    #cut off.
-    if Ilow < 0 or Ihigh > refl.shape[0]-1 or Jlow < 0 or Jhigh > refl.shape[1]-1:
-      if Ilow < 0:
-        Ilow = 0
-      if Jlow < 0:
-        Jlow = 0
-      if Ihigh > refl.shape[0]-1:
-        Ihigh = refl.shape[0]-1
-      if Jhigh > refl.shape[1]-1:
-        Jhigh = refl.shape[1]-1
-      leftchop = abs(I[k]-nlow-Ilow)
-      rightchop = abs(I[k]+nlow-Ihigh)
-      topchop = abs(J[k]-nlow-Jlow)
-      btmchop = abs(J[k]+nlow-Jhigh)
-
-      #Trim the mask. Return trimmed mask as dummy.
-      if convRadiuskm[I[k],J[k]] == maxConvRadius - 4:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1]= rt.chopmask(maskcell[0],topchop,rightchop,
-                                                      btmchop,leftchop)
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius - 3:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = rt.chopmask(maskcell[1],topchop,rightchop,
-                                                       btmchop,leftchop)
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius - 2:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = rt.chopmask(maskcell[2],topchop,rightchop,
-                                                       btmchop,leftchop)
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius - 1:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = rt.chopmask(maskcell[3],topchop,rightchop,
-                                                       btmchop,leftchop)
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = rt.chopmask(maskcell[4],topchop,rightchop,
-                                                       btmchop,leftchop)
-    #If the data point isn't close to an edge, proceed normally, using maskcell as
-    #created above.
-    else:
-      if convRadiuskm[I[k],J[k]] == maxConvRadius - 4:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = maskcell[0]
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius - 3:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = maskcell[1]
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius - 2:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = maskcell[2]
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius - 1:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = maskcell[3]
-      elif convRadiuskm[I[k],J[k]] == maxConvRadius:
-        dummy[Ilow:Ihigh+1,Jlow:Jhigh+1] = maskcell[4]
-    #At each data point, add dummy (which is 1 or 0) to maskind.
-    maskind = np.add(maskind,dummy)
+  with ins.stage(recorder,'mixed_radius',refl):
+    #Compute what the uncertain radius is as a function of echo intensity at each core:
+    #maxConvRadius - 4 where background <= dBZformaxconvradius - 15, then 1 km more for
+    #background above dBZformaxconvradius - 15, - 10 and - 5, and maxConvRadius where
+    #background >= dBZformaxconvradius. convclass is that radius minus (maxConvRadius - 4),
+    #i.e. the index into maskcell (0 ... 4).
+    isConv = np.equal(isCore,types['CS_CORE'],out=select)
+    ins.count(recorder,'core_pixels',np.count_nonzero(isConv))
+    convclass = rt.workarray(work,'convclass',refl.shape,np.int8)
+    convclass.fill(0)
+    bgcore = background[isConv]
+    convclass[isConv] = ((bgcore > dBZformaxconvradius - 15).astype(np.int8) +
+                         (bgcore > dBZformaxconvradius - 10) +
+                         (bgcore > dBZformaxconvradius - 5) +
+                         (bgcore >= dBZformaxconvradius))
+
+    #Stamp the mask belonging to each core's radius onto maskind. Masks of cores close
+    #to the edge of the domain are chopped to fit.
+    maskind = rt.makemixedmask(isConv,convclass,maskcell,
+                               out=rt.workarray(work,'maskind',refl.shape,bool))
 
   #At this point, anything that isn't STRATIFORM is either CONVECTIVE, WEAK ECHO, or
   #ISOLATED CONVECTIVE.  Make sure none of these echoes get classified as MIXED.
-  maskind[convsfmat != types['STRATIFORM']] = 0
+  maskind[np.not_equal(convsfmat,types['STRATIFORM'],out=select)] = False
 
   #Any point that was masked at least once is an echo of uncertain classification.
-  convsfmat[maskind!=0] = types['MIXED']
+  convsfmat[maskind] = types['MIXED']
 
   #Change original convective cores back to convective.
-  convsfmat[isCore == types['CS_CORE']] = types['CONVECTIVE']
-  convsfmat[isCore == types['ISO_CS_CORE']] = types['ISO_CONV_CORE']
+  convsfmat[np.equal(isCore,types['CS_CORE'],out=select)] = types['CONVECTIVE']
+  convsfmat[np.equal(isCore,types['ISO_CS_CORE'],out=select)] = types['ISO_CONV_CORE']
 
   #If there is no data, classify as NO ECHO.
-  convsfmat[np.isnan(refl)==1] = types['NO_ECHO']
+  convsfmat[np.isnan(refl,out=select)] = types['NO_ECHO']
   
   #Classify WEAK_ECHO
-  convsfmat[refl < weakechothres] = types['WEAK_ECHO']
-
-  #Format the output as integers.
-  convsfmat.astype(int)
+  convsfmat[np.less(refl,weakechothres,out=select)] = types['WEAK_ECHO']
 
   return convsfmat
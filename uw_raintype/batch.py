@@ -0,0 +1,1016 @@
+""" Batch driver for rain-type classification of many reflectivity files
+"""
+
+import netCDF4 as nc4
+import numpy as np
+import os
+import time
+import datetime as dt
+import contextlib
+import glob
+import multiprocessing as mp
+from uw_raintype import raintype as rt
+from uw_raintype import netcdf_io as net
+from uw_raintype import instrument as ins
+import logging as log
+
+## Default batch parameters. See runraintype.py for a description of each of these.
+DEFAULT_PARAMS = {
+  ## reflectivity info
+  'refl_name': 'REFL',
+  'refl_level': 5,
+  'refl_missing_val': -9999,
+  'refl_dx': 1,
+  'refl_dy': None,
+  ## radar info - only used if data not contained in input file
+  'radar_lat': 35,
+  'radar_lon': 79,
+  ## preferred netcdf output format - one of 'basic', 'cf' or 'zeb'
+  'outputFormat': 'cf',
+  'var_cf': ['time','x0','y0','lat0','lon0','grid_mapping_0'],
+  'var_zeb': ['base_time','time_offset','lat','lon','alt','x_spacing','y_spacing','z_spacing'],
+  ## rain type input parameters
+  'minZdiff': 20,
+  'deepcoszero': 40,
+  'shallowconvmin': 28,
+  'truncZconvthres': 38,
+  'dBZformaxconvradius': 43,
+  'weakechothres': 7,
+  'backgrndradius': 5,
+  'maxConvRadius': 10,
+  'minsize': 8,
+  'startslope': 50,
+  'maxsize': 2000,
+  ## information about output
+  'institution': 'University of Washington',
+  'source': 'SPolKa radar data',
+  'title': 'Rain type classifications',
+  'references1': 'http://www.atmos.uw.edu/MG/PDFs/JTECH16_Powell-etal_RainCat.pdf',
+  'references2': 'Code used https://github.com/swpowell/raintype_python',
+  'comment': 'Based on 2.5km level of interpolated reflectivity data',
+  ## storage of rain_type in the output files; a dict overriding netcdf_io.STORAGE,
+  ## e.g. {'complevel': 6, 'packbits': True}
+  'storage': None,
+  ## append all scans of each hour ('hourly') or UTC day ('daily'), or all of them ('all'),
+  ## to one time-series file raintype.<YYYYMMDDHH|YYYYMMDD|series>.nc instead of writing
+  ## one file per scan; None writes one file per scan
+  'timeseries': None,
+  ## if True, store only the echo points, as runs of equal rain type (see
+  ## netcdf_io.TimeSeriesWriter); read such files with netcdf_io.readraintype
+  'sparse': False,
+}
+
+#Names of the parameters that are passed on to raintype.raintype.
+ALG_PARAMS = ['minZdiff','deepcoszero','shallowconvmin','truncZconvthres','dBZformaxconvradius',
+              'weakechothres','backgrndradius','maxConvRadius','minsize','startslope','maxsize']
+
+#Parameters of the current worker process, set once by initworker.
+_params = None
+
+def outputname(fname,fileDirOut):
+
+  #Output filename: the input filename prefixed with 'raintype.', in fileDirOut.
+  return os.path.join(fileDirOut,'raintype.'+os.path.basename(fname))
+
+def outputjobs(files,fileDirOut,check=True):
+
+  #Returns the sorted (infile,ncname) pairs of files. Sorted so the order of processing
+  #and of the summary does not depend on the order the directory listing happens to
+  #return. Files listed more than once are only kept once. With check=True, raises a
+  #ValueError if two input files (e.g. with the same name in different directories)
+  #would be written to the same output file, since one would overwrite the other.
+  jobs = [(f,outputname(f,fileDirOut)) for f in sorted(set(files))]
+  if check:
+    owner = {}
+    for (f,ncname) in jobs:
+      if ncname in owner:
+        raise ValueError('{} and {} would both be written to {}'.format(owner[ncname],f,ncname))
+      owner[ncname] = f
+  return jobs
+
+def readfile(infile,params):
+
+  #Reads reflectivity and whatever the output format needs from infile. Returns a
+  #dict with 'refl', 'dx', 'missing_value', 'outputFormat' (set to 'basic' if the
+  #input file does not contain the fields required for params['outputFormat']) and
+  #the coordinate variables for that format.
+  refl_name = params['refl_name']
+  var_cf = params['var_cf']
+  var_zeb = params['var_zeb']
+  scan = {'outputFormat': params['outputFormat']}
+
+  #Open input file
+  ncid = nc4.Dataset(infile,'r')
+
+  try:
+    #If check to make sure all vars necessary for output format are present in input file
+    if scan['outputFormat'] == 'zeb':
+      if not all(x in ncid.variables for x in var_zeb):
+        scan['outputFormat'] = 'basic'
+    elif scan['outputFormat'] == 'cf':
+      if not all(x in ncid.variables for x in var_cf):
+        scan['outputFormat'] = 'basic'
+
+    #Make sure refl_name exists.
+    if refl_name not in ncid.variables:
+      raise ValueError('Name of reflectivity variable is incorrect. See user input.')
+
+    #If variables required by zebra netcdf files are present, read them
+    if scan['outputFormat'] == 'zeb':
+      for (key,name) in zip(['bt','toff','lat','lon','alt','dx','dy','dz'],var_zeb):
+        scan[key] = ncid.variables[name][:]
+      scan['missing_value'] = ncid.variables[refl_name].missing_value
+    #If variables required for cf-compliancy are present, read them
+    elif scan['outputFormat'] == 'cf':
+      scan['dx'] = params['refl_dx']
+      scan['dy'] = params['refl_dy']
+      scan['missing_value'] = params['refl_missing_val']
+      for (key,name) in zip(['tim','x','y','lat','lon','gm'],var_cf):
+        scan[key] = ncid.variables[name][:]
+      scan['lat_origin'] = ncid.variables[var_cf[5]].latitude_of_projection_origin
+      scan['lon_origin'] = ncid.variables[var_cf[5]].longitude_of_projection_origin
+    else:
+      scan['dx'] = params['refl_dx']
+      scan['dy'] = params['refl_dy']
+      scan['missing_value'] = params['refl_missing_val']
+
+    #Read in reflectivity
+    scan['refl'] = np.array(np.squeeze(ncid.variables[refl_name][:,params['refl_level']-1,:,:]))
+
+  finally:
+    #Close input file
+    ncid.close()
+
+  return scan
+
+def classifyscan(scan,params,recorder=None):
+
+  #Determine raintype for a scan returned by readfile.
+  algparams = dict((k,params[k]) for k in ALG_PARAMS)
+  return rt.raintype(refl=scan['refl'], refl_missing_val=scan['missing_value'],
+                     refl_dx=scan['dx'], refl_dy=scan['dy'], recorder=recorder, **algparams)
+
+def writefile(ncname,scan,rtout,types,params):
+
+  #Writes rtout to ncname with the netcdf_io writer for scan['outputFormat'], or as a
+  #sparse file if params['sparse'] is set. The file is written under a temporary name
+  #in the same directory and renamed when complete, so readers never see a partially
+  #written file. A .part file left behind by a killed run is removed first, since the
+  #sparse TimeSeriesWriter would otherwise append this scan to it.
+  meta = [params[k] for k in ['title','institution','source','references1','references2','comment']]
+  header = [types,params['deepcoszero'],params['shallowconvmin'],params['minZdiff'],
+            params['truncZconvthres'],params['dBZformaxconvradius'],params['weakechothres'],
+            params['backgrndradius'],params['maxConvRadius'],params['minsize'],
+            params['startslope'],params['maxsize']] + meta
+
+  tmpname = os.path.join(os.path.dirname(ncname),'.'+os.path.basename(ncname)+'.part')
+  try:
+    try:
+      os.remove(tmpname)
+    except FileNotFoundError:
+      pass
+    if params['sparse']:
+      with net.TimeSeriesWriter(tmpname,types,params,scan['missing_value'],params['storage'],
+                                sparse=True) as writer:
+        writer.append(rtout,scantime(scan),'',seriescoords(scan,params))
+    elif scan['outputFormat'] == 'zeb':
+      coords = [scan[k] for k in ['bt','toff','lat','lon','alt','dx','dy','dz']]
+      net.writeZebNetcdf(tmpname,*(header+coords+[rtout,scan['missing_value']]),
+                         storage=params['storage'])
+    elif scan['outputFormat'] == 'cf':
+      coords = [scan[k] for k in ['tim','x','y','lat','lon','gm','lat_origin','lon_origin']]
+      net.writeCFnetcdf(tmpname,*(header+coords+[rtout,scan['missing_value']]),
+                        storage=params['storage'])
+    else:
+      coords = [scan['dx'],params['radar_lat'],params['radar_lon']]
+      net.writeBasicNetcdf(tmpname,*(header+coords+[rtout,scan['missing_value']]),dy=scan['dy'],
+                           storage=params['storage'])
+    os.replace(tmpname,ncname)
+  finally:
+    if os.path.exists(tmpname):
+      os.remove(tmpname)
+
+def classifyfile(infile,ncname,params,recorder=None):
+
+  #Reads reflectivity from infile, classifies it and writes the result to ncname.
+  #recorder is an optional instrument.StageRecorder that times each stage, including
+  #NetCDF input and output.
+  with ins.scan(recorder,infile):
+    with ins.stage(recorder,'netcdf_input'):
+      scan = readfile(infile,params)
+    (rtout,types) = classifyscan(scan,params,recorder)
+    if rtout is not None:
+      with ins.stage(recorder,'netcdf_output',rtout):
+        writefile(ncname,scan,rtout,types,params)
+
+def scantime(scan):
+
+  #Time of scan in seconds since 1970-01-01, or None if the input file has none.
+  if scan['outputFormat'] == 'cf':
+    return float(np.ravel(scan['tim'])[0])
+  elif scan['outputFormat'] == 'zeb':
+    return float(np.ravel(scan['bt'])[0] + np.ravel(scan['toff'])[0])
+  return None
+
+def seriesname(timeval,fileDirOut,period):
+
+  #Name of the time-series file that a scan at timeval goes into. Scans without a time
+  #all go into raintype.series.nc.
+  if period == 'all' or timeval is None:
+    stamp = 'series'
+  elif period == 'hourly':
+    stamp = dt.datetime.fromtimestamp(timeval,dt.timezone.utc).strftime('%Y%m%d%H')
+  elif period == 'daily':
+    stamp = dt.datetime.fromtimestamp(timeval,dt.timezone.utc).strftime('%Y%m%d')
+  else:
+    raise ValueError('timeseries must be None, hourly, daily or all, not {}'.format(period))
+  return os.path.join(fileDirOut,'raintype.{}.nc'.format(stamp))
+
+def seriescoords(scan,params):
+
+  #Coordinates for the first scan of a time-series file (see netcdf_io.TimeSeriesWriter).
+  if scan['outputFormat'] == 'cf':
+    return dict((k,scan[k]) for k in ['x','y','lat','lon','lat_origin','lon_origin'])
+  elif scan['outputFormat'] == 'zeb':
+    return {'dx': float(np.ravel(scan['dx'])[0]), 'dy': float(np.ravel(scan['dy'])[0]),
+            'radar_lat': float(np.ravel(scan['lat'])[0]), 'radar_lon': float(np.ravel(scan['lon'])[0])}
+  return {'dx': scan['dx'], 'dy': scan['dy'], 'radar_lat': params['radar_lat'],
+          'radar_lon': params['radar_lon']}
+
+def initworker(params):
+
+  #Runs once in each worker process so params are only sent once per worker.
+  global _params
+  _params = params
+  log.basicConfig(format='%(levelname)s:%(message)s',level=log.INFO)
+
+def runfile(job):
+
+  #Classifies one (infile,ncname) pair with the worker's params. Any error is caught
+  #and reported so one bad file does not stop the rest of the batch.
+  (infile,ncname) = job
+  start = time.time()
+  try:
+    classifyfile(infile,ncname,_params)
+    log.info( "file = {} done".format(infile) )
+    return (infile,ncname,None,time.time()-start)
+  except Exception as err:
+    log.error( "file = {} failed: {!r}".format(infile,err) )
+    return (infile,ncname,repr(err),time.time()-start)
+
+def runseriesfile(infile):
+
+  #Reads and classifies infile with the worker's params for a time-series file. Returns
+  #(infile,error,seconds,scan) where scan has the classification in 'rain_type', but not
+  #the reflectivity, so it can be sent back to the process that writes the file.
+  start = time.time()
+  try:
+    scan = readfile(infile,_params)
+    (scan['rain_type'],types) = classifyscan(scan,_params)
+    del scan['refl']
+    return (infile,None,time.time()-start,scan)
+  except Exception as err:
+    log.error( "file = {} failed: {!r}".format(infile,err) )
+    return (infile,repr(err),time.time()-start,None)
+
+def appendseries(results,fileDirOut,params,writers=None,lock=None):
+
+  #Appends each scan of results, an iterable of runseriesfile results in time order, to
+  #its time-series file as the results arrive. Only one file is kept open: it is closed
+  #when a scan for another file arrives, and reopened for appending if needed later. A
+  #scan whose input file is already in its time-series file (e.g. when a batch is run
+  #again) is not appended twice. writers is a dict of open netcdf_io.TimeSeriesWriter's
+  #to keep between calls; if it is not given, the file is closed at the end. lock, if
+  #given, is held while the files are written (see runpipeline). Returns a list of
+  #(infile,outfile,error,seconds).
+  closeall = writers is None
+  if writers is None:
+    writers = {}
+  if lock is None:
+    lock = contextlib.nullcontext()
+  done = []
+  try:
+    for (infile,err,seconds,scan) in results:
+      if err is not None:
+        done.append((infile,None,err,seconds))
+        continue
+      start = time.time()
+      try:
+        timeval = scantime(scan)
+        ncname = seriesname(timeval,fileDirOut,params['timeseries'])
+        with lock:
+          if ncname not in writers:
+            for name in list(writers):
+              writers.pop(name).close()
+            writers[ncname] = net.TimeSeriesWriter(ncname,rt.TYPES,params,scan['missing_value'],
+                                                   params['storage'],sparse=params['sparse'])
+          writer = writers[ncname]
+          if infile in writer.sources:
+            log.info( "file = {} already in {}".format(infile,ncname) )
+          else:
+            writer.append(scan['rain_type'],timeval,infile,seriescoords(scan,params))
+            log.info( "file = {} done".format(infile) )
+        done.append((infile,ncname,None,seconds+time.time()-start))
+      except Exception as err:
+        log.error( "file = {} failed: {!r}".format(infile,err) )
+        done.append((infile,None,repr(err),seconds+time.time()-start))
+  finally:
+    if closeall:
+      with lock:
+        for writer in writers.values():
+          writer.close()
+
+  return done
+
+def runbatch(files,fileDirOut,params=None,nworkers=1):
+
+  """
+  Description: Classifies each of files and writes the results to fileDirOut as
+  raintype.<input filename>, spreading the files over nworkers processes. Each worker
+  keeps its own cache of masks (see rtfunctions.getmasks), so they are only built
+  once per worker. Errors in one file are logged and reported in the summary instead
+  of stopping the batch. If params['timeseries'] is set, the scans are instead appended,
+  in the order of their filenames, to hourly, daily or single time-series files (see
+  DEFAULT_PARAMS). The workers only classify; this process writes as their results
+  arrive. Raises a ValueError before starting if two of files (e.g. with the same name
+  in different directories) would be written to the same output file.
+
+  Inputs:
+  files = list of input NetCDF files
+  fileDirOut = directory for output files; created if it does not exist
+  params = dict of parameters overriding DEFAULT_PARAMS
+  nworkers = number of worker processes; 1 runs everything in this process
+
+  Outputs:
+  summary = dict with 'ok' (list of (infile,outfile)), 'failed' (list of (infile,error)),
+     'seconds' (total wall time) and 'file_seconds' (dict of per-file times)
+  """
+
+  log.basicConfig(format='%(levelname)s:%(message)s',level=log.INFO)
+
+  allparams = dict(DEFAULT_PARAMS)
+  if params is not None:
+    allparams.update(params)
+
+  #If output dir does not exist, create it
+  if not os.path.exists(fileDirOut):
+    os.makedirs(fileDirOut)
+
+  #Time-series files are named by time, so only one file per scan needs unique names.
+  jobs = outputjobs(files,fileDirOut,check=allparams['timeseries'] is None)
+
+  start = time.time()
+  if allparams['timeseries'] is not None:
+    infiles = [f for (f,o) in jobs]
+    if nworkers is None or nworkers > 1:
+      pool = mp.Pool(nworkers,initializer=initworker,initargs=(allparams,))
+      try:
+        results = appendseries(pool.imap(runseriesfile,infiles),fileDirOut,allparams)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      initworker(allparams)
+      results = appendseries((runseriesfile(f) for f in infiles),fileDirOut,allparams)
+  elif nworkers is None or nworkers > 1:
+    pool = mp.Pool(nworkers,initializer=initworker,initargs=(allparams,))
+    try:
+      results = pool.map(runfile,jobs,chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    initworker(allparams)
+    results = [runfile(job) for job in jobs]
+
+  summary = {'ok': [(f,o) for (f,o,err,t) in results if err is None],
+             'failed': [(f,err) for (f,o,err,t) in results if err is not None],
+             'seconds': time.time()-start,
+             'file_seconds': dict((f,t) for (f,o,err,t) in results)}
+
+  log.info( "Processed {} files in {:.1f} s: {} succeeded, {} failed".format(
+            len(jobs),summary['seconds'],len(summary['ok']),len(summary['failed'])) )
+  for (f,err) in summary['failed']:
+    log.info( "  failed: {} ({})".format(f,err) )
+
+  return summary
+
+def runpipeline(files,fileDirOut,params=None,readers=2,writers=1,queuesize=4):
+
+  """
+  Description: Classifies each of files like runbatch, but in one process with reading,
+  classification and writing overlapped: reader threads read the upcoming files while
+  the current one is classified, and writer threads write finished classifications.
+  The stages are connected by queues holding at most queuesize scans each, so a slow
+  stage holds the others back instead of letting scans pile up in memory: at most
+  about 2*queuesize + readers + writers + 1 scans are held at once. The netCDF4 and
+  HDF5 libraries are not thread-safe, so all reads and writes take turns on one lock
+  and only classification runs alongside them: a run takes about as long as the
+  longer of classification and reading plus writing, not the sum of all three. If
+  params['timeseries'] is set, one writer appends the scans in the order of their
+  filenames (see runbatch). As in runbatch, files that would be written to the same
+  output file are an error.
+
+  Inputs:
+  files = list of input NetCDF files
+  fileDirOut = directory for output files; created if it does not exist
+  params = dict of parameters overriding DEFAULT_PARAMS
+  readers = number of reader threads
+  writers = number of writer threads
+  queuesize = maximum number of scans waiting between two stages
+
+  Outputs:
+  summary = dict as returned by runbatch, plus 'stage_seconds', the total time spent
+     reading, classifying and writing
+  """
+
+  import threading
+  import queue
+
+  log.basicConfig(format='%(levelname)s:%(message)s',level=log.INFO)
+
+  allparams = dict(DEFAULT_PARAMS)
+  if params is not None:
+    allparams.update(params)
+  initworker(allparams)
+
+  if not os.path.exists(fileDirOut):
+    os.makedirs(fileDirOut)
+  if allparams['timeseries'] is not None:
+    writers = 1
+
+  jobs = queue.Queue()
+  for (i,(f,ncname)) in enumerate(outputjobs(files,fileDirOut,allparams['timeseries'] is None)):
+    jobs.put((i,f,ncname))
+  readq = queue.Queue(maxsize=queuesize)
+  writeq = queue.Queue(maxsize=queuesize)
+  #netCDF4/HDF5 are not thread-safe, so reading and writing share one lock.
+  iolock = threading.Lock()
+  stop = threading.Event()
+  results = []
+  stage = {'read': 0., 'compute': 0., 'write': 0.}
+  stagelock = threading.Lock()
+
+  def addtime(name,seconds):
+    with stagelock:
+      stage[name] += seconds
+
+  def reader():
+    #Each item is (index,infile,ncname,scan,error,seconds); None marks the end.
+    try:
+      while not stop.is_set():
+        try:
+          (i,infile,ncname) = jobs.get_nowait()
+        except queue.Empty:
+          break
+        start = time.time()
+        try:
+          with iolock:
+            scan = readfile(infile,allparams)
+          item = [i,infile,ncname,scan,None]
+        except Exception as err:
+          log.error( "file = {} failed: {!r}".format(infile,err) )
+          item = [i,infile,ncname,None,repr(err)]
+        addtime('read',time.time()-start)
+        readq.put(item+[time.time()-start])
+    finally:
+      readq.put(None)
+
+  def writer():
+    while True:
+      item = writeq.get()
+      if item is None:
+        break
+      (i,infile,ncname,scan,err,seconds) = item
+      if err is None:
+        start = time.time()
+        try:
+          with iolock:
+            writefile(ncname,scan,scan['rain_type'],rt.TYPES,allparams)
+          log.info( "file = {} done".format(infile) )
+        except Exception as e:
+          err = repr(e)
+          log.error( "file = {} failed: {!r}".format(infile,e) )
+        addtime('write',time.time()-start)
+        seconds += time.time()-start
+      results.append((infile,ncname if err is None else None,err,seconds))
+
+  def seriesitems():
+    #Yields the scans from writeq as runseriesfile results, in the order of the files.
+    pending = {}
+    nexti = 0
+    while True:
+      item = writeq.get()
+      if item is not None:
+        pending[item[0]] = item
+      while nexti in pending:
+        (i,infile,ncname,scan,err,seconds) = pending.pop(nexti)
+        nexti += 1
+        yield (infile,err,seconds,scan)
+      if item is None:
+        break
+
+  def serieswriter():
+    start = time.time()
+    done = appendseries(seriesitems(),fileDirOut,allparams,lock=iolock)
+    results.extend(done)
+    addtime('write',time.time()-start)
+
+  start = time.time()
+  threads = [threading.Thread(target=reader) for k in range(0,readers)]
+  if allparams['timeseries'] is None:
+    threads += [threading.Thread(target=writer) for k in range(0,writers)]
+  else:
+    threads.append(threading.Thread(target=serieswriter))
+  for t in threads:
+    t.daemon = True
+    t.start()
+
+  #Classify in this thread as the scans arrive.
+  finished = 0
+  try:
+    while finished < readers:
+      item = readq.get()
+      if item is None:
+        finished += 1
+        continue
+      (i,infile,ncname,scan,err,seconds) = item
+      if err is None:
+        t0 = time.time()
+        try:
+          (scan['rain_type'],types) = classifyscan(scan,allparams)
+          del scan['refl']
+        except Exception as e:
+          err = repr(e)
+          log.error( "file = {} failed: {!r}".format(infile,e) )
+        addtime('compute',time.time()-t0)
+        seconds += time.time()-t0
+      writeq.put((i,infile,ncname,scan,err,seconds))
+  finally:
+    #If classification stopped early, let the readers finish their current file.
+    stop.set()
+    while finished < readers:
+      if readq.get() is None:
+        finished += 1
+    for k in range(0,writers):
+      writeq.put(None)
+    for t in threads:
+      t.join()
+
+  summary = {'ok': sorted((f,o) for (f,o,err,t) in results if err is None),
+             'failed': sorted((f,err) for (f,o,err,t) in results if err is not None),
+             'seconds': time.time()-start,
+             'file_seconds': dict((f,t) for (f,o,err,t) in results),
+             'stage_seconds': stage}
+
+  log.info( "Processed {} files in {:.1f} s (reading {:.1f} s, classifying {:.1f} s, "
+            "writing {:.1f} s): {} succeeded, {} failed".format(
+            len(results),summary['seconds'],stage['read'],stage['compute'],stage['write'],
+            len(summary['ok']),len(summary['failed'])) )
+  for (f,err) in summary['failed']:
+    log.info( "  failed: {} ({})".format(f,err) )
+
+  return summary
+
+def runzarrblock(job):
+
+  #Reads and classifies the files of one time chunk of a Zarr store with the worker's
+  #params and writes them to the store in one piece. Files that fail stay missing.
+  #Returns a list of (infile,time,error,seconds).
+  from uw_raintype import zarr_io as zio
+  (storename,index,infiles) = job
+  results = []
+  block = None
+  for (k,infile) in enumerate(infiles):
+    start = time.time()
+    try:
+      scan = readfile(infile,_params)
+      (rtout,types) = classifyscan(scan,_params)
+      if block is None:
+        block = np.full((len(infiles),)+rtout.shape,scan['missing_value'],dtype=rtout.dtype)
+        missing_value = scan['missing_value']
+      block[k] = np.where(rtout == scan['missing_value'],missing_value,rtout)
+      results.append([infile,scantime(scan),None,time.time()-start])
+      log.info( "file = {} done".format(infile) )
+    except Exception as err:
+      log.error( "file = {} failed: {!r}".format(infile,err) )
+      results.append([infile,None,repr(err),time.time()-start])
+
+  if block is not None:
+    start = time.time()
+    try:
+      zio.writeCFzarr(storename,index,block,missing_value)
+    except Exception as err:
+      log.error( "files {} to {} failed: {!r}".format(infiles[0],infiles[-1],err) )
+      for r in results:
+        if r[2] is None:
+          r[1:3] = [None,repr(err)]
+    results[-1][3] += time.time()-start
+  return [tuple(r) for r in results]
+
+def runzarr(files,storename,params=None,nworkers=1,timechunk=1):
+
+  """
+  Description: Classifies each of files and writes the results to one Zarr store with the
+  schema of writeCFnetcdf (see zarr_io), one time per file in the order of their
+  filenames. The first file that can be read sets the grid and coordinates. Workers
+  write their own chunks of the store directly, so output is not funneled through one
+  process; once all are done, the times and input filenames are written and the
+  metadata is consolidated. The times of files that fail are NaN and their
+  classifications are missing.
+
+  Inputs:
+  files = list of input NetCDF files
+  storename = directory of the Zarr store; replaced if it exists
+  params = dict of parameters overriding DEFAULT_PARAMS
+  nworkers = number of worker processes; 1 runs everything in this process
+  timechunk = number of times in each chunk of the store (and in each worker job)
+
+  Outputs:
+  summary = dict as returned by runbatch, with storename as the output of each file
+  """
+
+  from uw_raintype import zarr_io as zio
+
+  log.basicConfig(format='%(levelname)s:%(message)s',level=log.INFO)
+
+  allparams = dict(DEFAULT_PARAMS)
+  if params is not None:
+    allparams.update(params)
+  files = sorted(files)
+
+  start = time.time()
+  initworker(allparams)
+  for f in files:
+    try:
+      scan = readfile(f,allparams)
+      break
+    except Exception:
+      continue
+  else:
+    raise ValueError('None of the input files could be read')
+  if scan['outputFormat'] == 'cf':
+    coords = seriescoords(scan,allparams)
+  else:
+    coords = {'dx': allparams['refl_dx'], 'dy': allparams['refl_dy'],
+              'radar_lat': allparams['radar_lat'], 'radar_lon': allparams['radar_lon']}
+  zio.createCFzarr(storename,rt.TYPES,allparams,len(files),scan['refl'].shape,coords,
+                   scan['missing_value'],allparams['storage'],timechunk)
+
+  jobs = [(storename,i,files[i:i+timechunk]) for i in range(0,len(files),timechunk)]
+  if nworkers is None or nworkers > 1:
+    pool = mp.Pool(nworkers,initializer=initworker,initargs=(allparams,))
+    try:
+      results = [r for rs in pool.map(runzarrblock,jobs,chunksize=1) for r in rs]
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [r for job in jobs for r in runzarrblock(job)]
+
+  zio.finishCFzarr(storename,[np.nan if t is None else t for (f,t,err,s) in results],files)
+
+  summary = {'ok': [(f,storename) for (f,t,err,s) in results if err is None],
+             'failed': [(f,err) for (f,t,err,s) in results if err is not None],
+             'seconds': time.time()-start,
+             'file_seconds': dict((f,s) for (f,t,err,s) in results)}
+
+  log.info( "Processed {} files in {:.1f} s: {} succeeded, {} failed".format(
+            len(files),summary['seconds'],len(summary['ok']),len(summary['failed'])) )
+  for (f,err) in summary['failed']:
+    log.info( "  failed: {} ({})".format(f,err) )
+
+  return summary
+
+def watch(patterns,fileDirOut,params=None,interval=0.1,settle=0.5,maxpolls=None,
+          callback=None):
+
+  """
+  Description: Watches for new input files and classifies each one as soon as it has
+  finished being written. Runs in this process, so imports and masks stay loaded
+  between files. A file counts as finished once its size and modification time have
+  not changed for settle seconds. Output files are written atomically (see writefile).
+  Files whose output already exists in fileDirOut are skipped. A file that fails is
+  tried again if it changes afterwards. A file with the same name as one already seen
+  in another directory fails instead of overwriting its output. If params['timeseries']
+  is set, each scan is appended to its time-series file instead (see runbatch), which
+  is synced to disk after every poll that added scans and closed when watching stops.
+
+  Inputs:
+  patterns = glob pattern or list of glob patterns for the input files
+  fileDirOut = directory for output files; created if it does not exist
+  params = dict of parameters overriding DEFAULT_PARAMS
+  interval (s) = time between polls of the input patterns
+  settle (s) = how long a file must be unchanged before it is classified
+  maxpolls = stop after this many polls (default: run until interrupted)
+  callback = optional function called with (infile,outfile,error,seconds) for each file
+
+  Outputs:
+  summary = dict as returned by runbatch for the files processed
+  """
+
+  log.basicConfig(format='%(levelname)s:%(message)s',level=log.INFO)
+
+  allparams = dict(DEFAULT_PARAMS)
+  if params is not None:
+    allparams.update(params)
+  initworker(allparams)
+
+  if not os.path.exists(fileDirOut):
+    os.makedirs(fileDirOut)
+  if isinstance(patterns,str):
+    patterns = [patterns]
+
+  results = []
+  writers = {}    #open time-series file, if params['timeseries'] is set
+  pending = {}    #file -> ((size,mtime),time first seen with that size and mtime)
+  failed = {}     #file -> (size,mtime) when it failed
+  done = set()    #files already classified, plus our own outputs
+  owners = {}     #output file -> input file it is written from
+  start = time.time()
+  polls = 0
+  try:
+    while maxpolls is None or polls < maxpolls:
+      now = time.time()
+      for f in sorted(set(f for p in patterns for f in glob.glob(p))):
+        if f in done:
+          continue
+        ncname = outputname(f,fileDirOut)
+        if allparams['timeseries'] is None and owners.setdefault(ncname,f) != f:
+          #Another input file with the same name already writes this output.
+          err = 'same output file {} as {}'.format(ncname,owners[ncname])
+          log.error( "file = {} failed: {}".format(f,err) )
+          results.append((f,None,err,0.))
+          done.add(f)
+          if callback is not None:
+            callback(*results[-1])
+          continue
+        if allparams['timeseries'] is None and os.path.exists(ncname):
+          done.update([f,ncname])
+          continue
+        try:
+          st = os.stat(f)
+        except OSError:
+          continue
+        sig = (st.st_size,st.st_mtime)
+        if sig[0] == 0 or failed.get(f) == sig:
+          continue
+        if f not in pending or pending[f][0] != sig:
+          pending[f] = (sig,now)
+          continue
+        if now - pending[f][1] < settle:
+          continue
+
+        if allparams['timeseries'] is None:
+          result = runfile((f,ncname))
+        else:
+          result = appendseries([runseriesfile(f)],fileDirOut,allparams,writers)[0]
+        results.append(result)
+        del pending[f]
+        if result[2] is None:
+          done.update([f,result[1]])
+          failed.pop(f,None)
+        else:
+          failed[f] = sig
+        if callback is not None:
+          callback(*result)
+
+      for writer in writers.values():
+        if writer.unsynced:
+          writer.sync()
+      polls += 1
+      if maxpolls is None or polls < maxpolls:
+        time.sleep(interval)
+  except KeyboardInterrupt:
+    log.info( "Stopped watching." )
+  finally:
+    for writer in writers.values():
+      writer.close()
+
+  return {'ok': [(f,o) for (f,o,err,t) in results if err is None],
+          'failed': [(f,err) for (f,o,err,t) in results if err is not None],
+          'seconds': time.time()-start,
+          'file_seconds': dict((f,t) for (f,o,err,t) in results)}
+
+def sharearray(shape,dtype):
+
+  #Allocates an array in a new multiprocessing.shared_memory block that worker
+  #processes can map without copying it. Returns (array, block); the caller calls
+  #block.close() and block.unlink() when the array is no longer needed.
+  from multiprocessing import shared_memory
+  dtype = np.dtype(dtype)
+  size = int(np.prod(shape))*dtype.itemsize
+  block = shared_memory.SharedMemory(create=True,size=max(1,size))
+  return np.ndarray(shape,dtype=dtype,buffer=block.buf), block
+
+def readshared(infile,params=None):
+
+  #Reads the whole reflectivity variable (time,z,y,x) of infile into a new shared
+  #memory block, one time at a time so that no second full-size copy is made.
+  #Returns (refl, block) as sharearray does.
+  allparams = dict(DEFAULT_PARAMS)
+  if params is not None:
+    allparams.update(params)
+
+  ncid = nc4.Dataset(infile,'r')
+  try:
+    if allparams['refl_name'] not in ncid.variables:
+      raise ValueError('Name of reflectivity variable is incorrect. See user input.')
+    var = ncid.variables[allparams['refl_name']]
+    var.set_auto_mask(False)
+    (refl,block) = sharearray(var.shape,var.dtype)
+    try:
+      for t in range(0,var.shape[0]):
+        refl[t] = var[t]
+    except Exception:
+      block.close()
+      block.unlink()
+      raise
+  finally:
+    ncid.close()
+
+  return refl, block
+
+def describearray(arr,mode):
+
+  #Returns a picklable description that lets a worker map the memory of arr, or None
+  #if arr is neither an np.memmap of a whole file region nor in a shared memory block.
+  #arr is an array, or an (array, block) pair from sharearray or readshared.
+  import mmap
+  if isinstance(arr,tuple):
+    (arr,block) = arr
+    return ('shm',block.name,arr.shape,arr.dtype.str)
+  if (isinstance(arr,np.memmap) and isinstance(arr.base,mmap.mmap) and
+      arr.flags['C_CONTIGUOUS']):
+    return ('memmap',arr.filename,arr.shape,arr.dtype.str,arr.offset,mode)
+  return None
+
+def attacharray(desc):
+
+  #Maps the array described by describearray in this process. Returns (array, block),
+  #where block is the shared memory block to close afterwards (None for a memmap).
+  if desc[0] == 'shm':
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(name=desc[1])
+    return np.ndarray(desc[2],dtype=desc[3],buffer=block.buf), block
+  (kind,filename,shape,dtype,offset,mode) = desc
+  return np.memmap(filename,dtype=dtype,mode=mode,offset=offset,shape=shape), None
+
+class SharedArrays(object):
+
+  """
+  Description: The shared memory blocks made for the workers of one run, e.g. of 
+  runvolume or tiled.raintype_tiled. Arrays that workers can already map are described
+  as they are; anything else gets a new block, which is closed and unlinked when the
+  with block ends, even if a worker failed.
+
+  Usage:
+  with SharedArrays() as shared:
+    reflspec = shared.describe('refl',refl,'r')
+    outspec = shared.describe('out',out,'r+',shape,dtype)
+    ...run the workers...
+    result = shared.result('out',outarr)
+
+  Attributes:
+  arrays = dict of name -> array of the blocks made by describe
+  """
+
+  def __init__(self):
+
+    self.arrays = {}
+    self.blocks = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,*exc):
+    self.close()
+
+  def describe(self,name,arr,mode,shape=None,dtype=None):
+
+    #Returns a description of arr that workers can map (see describearray). If arr is
+    #None or can't be mapped, a new shared block of shape and dtype (by default those of
+    #arr) is described instead and kept as arrays[name]; arr is copied into it if mode
+    #is 'r'.
+    if arr is not None:
+      spec = describearray(arr,mode)
+      if spec is not None:
+        return spec
+      data = arr[0] if isinstance(arr,tuple) else arr
+      shape = data.shape if shape is None else shape
+      dtype = data.dtype if dtype is None else dtype
+    (self.arrays[name],block) = sharearray(shape,dtype)
+    self.blocks.append(block)
+    if arr is not None and mode == 'r':
+      np.copyto(self.arrays[name],data)
+    return describearray((self.arrays[name],block),mode)
+
+  def result(self,name,outarr=None):
+
+    #Returns the output array called name: outarr itself if the workers wrote to it
+    #directly, otherwise the shared block copied into outarr or, without outarr, into
+    #a new array that outlives the block.
+    if name not in self.arrays:
+      return outarr
+    if outarr is not None:
+      np.copyto(outarr,self.arrays[name])
+      return outarr
+    return self.arrays[name].copy()
+
+  def close(self):
+
+    #The arrays must be released before their blocks can be closed.
+    self.arrays.clear()
+    for block in self.blocks:
+      block.close()
+      block.unlink()
+    self.blocks = []
+
+#Classifier and mapped arrays of the current worker process, set once by initvolumeworker.
+_volume = None
+
+def initvolumeworker(params,reflspec,outspec):
+
+  #Runs once in each worker of runvolume: maps the shared input and output arrays and
+  #sets up one classifier, whose scratch arrays are reused for every slab.
+  global _volume
+  (refl,inblock) = attacharray(reflspec)
+  (out,outblock) = attacharray(outspec)
+  algparams = dict((k,params[k]) for k in ALG_PARAMS)
+  clf = rt.RainTypeClassifier(refl.shape[2:],refl_missing_val=params['refl_missing_val'],
+                              refl_dx=params['refl_dx'],refl_dy=params['refl_dy'],**algparams)
+  _volume = {'refl': refl, 'out': out, 'clf': clf, 'blocks': [inblock,outblock]}
+
+def runslab(job):
+
+  #Classifies slab (t,z) of the shared input into slab (it,iz) of the shared output.
+  (it,t,iz,z) = job
+  _volume['clf'].classify(_volume['refl'][t,z],out=_volume['out'][it,iz])
+  return job
+
+def runvolume(refl,params=None,nworkers=1,levels=None,times=None,out=None):
+
+  """
+  Description: Classifies the requested (time,level) slabs of one large (time,z,y,x)
+  reflectivity array, e.g. a mosaic or a multi-time file, spread over nworkers
+  processes, without sending each worker its own copy of the data. Workers map refl
+  and the output instead: an np.memmap (e.g. np.load(fname,mmap_mode='r') of an 
+  uncompressed .npy file) or an array in a shared memory block (see sharearray and 
+  readshared) is used as is, and any other array is copied once into shared memory.
+  Each worker classifies its slabs with one RainTypeClassifier, so the memory of a 
+  worker stays about the same however many workers run.
+
+  Inputs:
+  refl = Reflectivity with shape (time,z,y,x): an array, an np.memmap, or an
+     (array, block) pair as returned by sharearray or readshared
+  params = dict of parameters overriding DEFAULT_PARAMS (refl_missing_val, refl_dx, refl_dy and
+     the rain type input parameters are used)
+  nworkers = number of worker processes; 1 runs everything in this process
+  levels, times = 0-based indices of the levels and times to classify (default all)
+  out = optional output array with shape (len(times),len(levels),y,x) and an integer 
+     type that holds refl_missing_val: an np.memmap opened with mode 'r+' or 'w+', an
+     (array, block) pair from sharearray, or any other array (filled at the end)
+
+  Outputs:
+  rain_type = rain type classification (out, or its array, if it was given)
+  types = dict of rain types and their values
+  """
+
+  allparams = dict(DEFAULT_PARAMS)
+  if params is not None:
+    allparams.update(params)
+
+  arr = refl[0] if isinstance(refl,tuple) else refl
+  if arr.ndim != 4:
+    raise ValueError('refl must have shape (time,z,y,x), not {}'.format(arr.shape))
+  times = list(range(arr.shape[0])) if times is None else list(times)
+  levels = list(range(arr.shape[1])) if levels is None else list(levels)
+  outarr = out[0] if isinstance(out,tuple) else out
+  algparams = dict((k,allparams[k]) for k in ALG_PARAMS)
+  clf = rt.RainTypeClassifier(arr.shape[2:],refl_missing_val=allparams['refl_missing_val'],
+                              refl_dx=allparams['refl_dx'],refl_dy=allparams['refl_dy'],
+                              **algparams)
+
+  if not (nworkers is None or nworkers > 1):
+    return clf.classify_volume(arr,levels,times,outarr), clf.types
+
+  #Describe the input and output arrays so the workers can map them, first copying
+  #them into shared memory if they are not already shared.
+  with SharedArrays() as shared:
+    reflspec = shared.describe('refl',refl,'r')
+    shape = (len(times),len(levels))+arr.shape[2:]
+    dtype = clf.outdtype if outarr is None else outarr.dtype
+    outspec = shared.describe('out',out,'r+',shape,dtype)
+
+    jobs = [(it,t,iz,z) for (it,t) in enumerate(times) for (iz,z) in enumerate(levels)]
+    chunksize = max(1,len(jobs)//(4*(nworkers or mp.cpu_count())))
+    pool = mp.Pool(nworkers,initializer=initvolumeworker,initargs=(allparams,reflspec,outspec))
+    try:
+      pool.map(runslab,jobs,chunksize=chunksize)
+    finally:
+      pool.close()
+      pool.join()
+
+    result = shared.result('out',outarr)
+
+  return result, clf.types
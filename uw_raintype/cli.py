@@ -0,0 +1,121 @@
+""" Command-line interface for rain-type classification of many files
+
+Example:
+
+>> uw_raintype 'data/spolka.*.nc' -o out/ -j 8 -c params.toml
+
+or, to keep classifying new files as they arrive,
+
+>> uw_raintype 'incoming/*.nc' -o out/ -c params.toml --watch
+
+The parameter file (TOML, or YAML if PyYAML is installed) may use the variable names
+of Table 1 in Powell et al. (2016) or the names used in runraintype.py, e.g.
+
+  Z_th = 38
+  Z_conv = 43
+  R_bg = 5
+  refl_level = 5
+  outputFormat = 'cf'
+
+Anything not given keeps its value from batch.DEFAULT_PARAMS. If Z_th is given but
+Z_conv is not, Z_conv is set to Z_th + 5 as in runraintype.py.
+"""
+
+import argparse
+import glob
+import os
+import sys
+from uw_raintype import batch
+
+#Variable names in Table 1 of Powell et al. (2016) and the corresponding names in this code.
+POWELL_NAMES = {'a':'minZdiff', 'b':'deepcoszero', 'Z_shallow':'shallowconvmin',
+                'Z_th':'truncZconvthres', 'Z_conv':'dBZformaxconvradius',
+                'Z_weak':'weakechothres', 'R_bg':'backgrndradius', 'R_conv':'maxConvRadius',
+                'A_low':'minsize', 'A_med':'startslope', 'A_high':'maxsize'}
+
+def readparamfile(fname):
+
+  #Reads a TOML (.toml) or YAML (.yaml/.yml) parameter file into a dict.
+  ext = os.path.splitext(fname)[1].lower()
+  if ext == '.toml':
+    try:
+      import tomllib
+    except ImportError:
+      import tomli as tomllib
+    with open(fname,'rb') as f:
+      return tomllib.load(f)
+  elif ext in ('.yaml','.yml'):
+    try:
+      import yaml
+    except ImportError:
+      raise ImportError('PyYAML is required to read {}'.format(fname))
+    with open(fname,'r') as f:
+      return yaml.safe_load(f) or {}
+  else:
+    raise ValueError('Parameter file must be .toml, .yaml or .yml: {}'.format(fname))
+
+def loadparams(fname=None):
+
+  #Returns the full batch parameter dict: DEFAULT_PARAMS updated with the contents of
+  #the parameter file fname (if any), with Powell et al. names translated.
+  params = dict(batch.DEFAULT_PARAMS)
+  if fname is None:
+    return params
+
+  given = {}
+  for (key,value) in readparamfile(fname).items():
+    name = POWELL_NAMES.get(key,key)
+    if name not in params:
+      raise ValueError('Unknown parameter {} in {}'.format(key,fname))
+    given[name] = value
+
+  if 'truncZconvthres' in given and 'dBZformaxconvradius' not in given:
+    given['dBZformaxconvradius'] = given['truncZconvthres'] + 5
+  params.update(given)
+
+  return params
+
+def main(argv=None):
+
+  parser = argparse.ArgumentParser(
+    description='Rain-type classification of gridded radar reflectivity (Powell et al. 2016).')
+  parser.add_argument('inputs',nargs='+',
+                      help='input NetCDF files or glob patterns (quote patterns)')
+  parser.add_argument('-o','--output-dir',default='.',
+                      help='directory for raintype.<input filename> output files')
+  parser.add_argument('-j','--workers',type=int,default=1,
+                      help='number of worker processes (default 1; not with --watch)')
+  parser.add_argument('-c','--config',default=None,
+                      help='TOML or YAML parameter file')
+  parser.add_argument('-w','--watch',action='store_true',
+                      help='keep running and classify new files matching the inputs as they arrive')
+  parser.add_argument('--interval',type=float,default=0.1,
+                      help='seconds between polls in watch mode (default 0.1)')
+  parser.add_argument('--settle',type=float,default=0.5,
+                      help='seconds a file must be unchanged before it is classified in watch mode '
+                           '(default 0.5)')
+  args = parser.parse_args(argv)
+  if args.watch and args.workers != 1:
+    parser.error('--watch classifies one file at a time in this process; -j/--workers '
+                 'cannot be used with it')
+
+  #Parse the parameters once; they are sent to each worker only once.
+  params = loadparams(args.config)
+
+  if args.watch:
+    summary = batch.watch(args.inputs,args.output_dir,params,interval=args.interval,
+                          settle=args.settle)
+    return 1 if summary['failed'] else 0
+
+  files = []
+  for pattern in args.inputs:
+    matches = glob.glob(pattern)
+    files.extend(matches if matches else [pattern])
+  files = sorted(set(files))
+
+  summary = batch.runbatch(files,args.output_dir,params,nworkers=args.workers)
+
+  return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
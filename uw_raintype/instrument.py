@@ -0,0 +1,156 @@
+""" Optional per-stage timing and memory instrumentation
+
+Usage:
+
+  from uw_raintype import instrument
+  rec = instrument.StageRecorder(memory=True)
+  (rtout,types) = raintype.raintype(refl=refl, ..., recorder=rec)
+  rec.records()        #list of dicts, one per stage and per count
+  rec.prometheus()     #Prometheus text exposition format
+
+When no recorder is given (recorder=None, the default) the stage and count helpers
+below do nothing, so instrumentation costs close to nothing when it is switched off.
+"""
+
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class NullContext(object):
+
+  #Context manager that does nothing; used for every stage when recorder is None.
+  def __enter__(self):
+    return None
+  def __exit__(self, *exc):
+    return False
+
+NULL = NullContext()
+
+def stage(recorder,name,*arrays):
+
+  #Times the enclosed block as stage name if recorder is not None. arrays are the
+  #main arrays the stage works on; their shapes and sizes are recorded.
+  if recorder is None:
+    return NULL
+  return recorder.stage(name,*arrays)
+
+def count(recorder,name,value):
+
+  #Records a per-scan count (e.g. number of echo objects) if recorder is not None.
+  if recorder is not None:
+    recorder.count(name,value)
+
+def scan(recorder,label=None):
+
+  #Groups the stages and counts of one scan if recorder is not None. Nested calls
+  #belong to the outermost scan.
+  if recorder is None:
+    return NULL
+  return recorder.scan(label)
+
+class StageRecorder(object):
+
+  """
+  Description: Collects wall time, peak memory and array sizes for each stage of the
+  classification, and per-scan counts, for any number of scans.
+
+  Inputs:
+  memory = if True, measure the peak memory allocated during each stage with
+     tracemalloc (started if it is not already running). This slows the code down,
+     so it is off by default.
+
+  Attributes:
+  scans = list of dicts with 'label', 'stages' (list of dicts with 'stage', 'seconds',
+     'peak_bytes', 'array_bytes', 'shape') and 'counts' (dict of name -> value)
+  """
+
+  def __init__(self, memory=False):
+    self.memory = memory
+    self.scans = []
+    self._depth = 0
+    if memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  @contextmanager
+  def scan(self, label=None):
+    if self._depth == 0:
+      self.scans.append({'label': label, 'stages': [], 'counts': {}})
+    self._depth += 1
+    try:
+      yield self.scans[-1]
+    finally:
+      self._depth -= 1
+
+  def _current(self):
+    if self._depth == 0 or not self.scans:
+      self.scans.append({'label': None, 'stages': [], 'counts': {}})
+    return self.scans[-1]
+
+  @contextmanager
+  def stage(self, name, *arrays):
+    record = {'stage': name, 'seconds': None, 'peak_bytes': None,
+              'array_bytes': int(sum(getattr(a,'nbytes',0) for a in arrays)),
+              'shape': list(arrays[0].shape) if arrays and hasattr(arrays[0],'shape') else None}
+    self._current()['stages'].append(record)
+    if self.memory:
+      base = tracemalloc.get_traced_memory()[0]
+      tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+      yield record
+    finally:
+      record['seconds'] = time.perf_counter() - start
+      if self.memory:
+        record['peak_bytes'] = max(0,tracemalloc.get_traced_memory()[1] - base)
+
+  def count(self, name, value):
+    self._current()['counts'][name] = int(value)
+
+  def records(self):
+
+    #Flat list of structured records: one per stage and one per count of each scan.
+    out = []
+    for (i,s) in enumerate(self.scans):
+      for st in s['stages']:
+        rec = {'scan': i, 'label': s['label'], 'type': 'stage'}
+        rec.update(st)
+        out.append(rec)
+      for (name,value) in sorted(s['counts'].items()):
+        out.append({'scan': i, 'label': s['label'], 'type': 'count', 'name': name,
+                    'value': value})
+    return out
+
+  def prometheus(self, prefix='uw_raintype'):
+
+    #Totals over all scans in the Prometheus text exposition format.
+    seconds = {}
+    calls = {}
+    peak = {}
+    counts = {}
+    for s in self.scans:
+      for st in s['stages']:
+        name = st['stage']
+        seconds[name] = seconds.get(name,0.) + (st['seconds'] or 0.)
+        calls[name] = calls.get(name,0) + 1
+        if st['peak_bytes'] is not None:
+          peak[name] = max(peak.get(name,0),st['peak_bytes'])
+      for (name,value) in s['counts'].items():
+        counts[name] = counts.get(name,0) + value
+
+    lines = ['# HELP {}_stage_seconds Wall time spent in each classification stage.'.format(prefix),
+             '# TYPE {}_stage_seconds summary'.format(prefix)]
+    for name in sorted(seconds):
+      lines.append('{}_stage_seconds_sum{{stage="{}"}} {:.9g}'.format(prefix,name,seconds[name]))
+      lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix,name,calls[name]))
+    if peak:
+      lines += ['# HELP {}_stage_peak_bytes Largest peak memory allocated in a stage.'.format(prefix),
+                '# TYPE {}_stage_peak_bytes gauge'.format(prefix)]
+      for name in sorted(peak):
+        lines.append('{}_stage_peak_bytes{{stage="{}"}} {}'.format(prefix,name,peak[name]))
+    for name in sorted(counts):
+      lines += ['# TYPE {}_{}_total counter'.format(prefix,name),
+                '{}_{}_total {}'.format(prefix,name,counts[name])]
+    lines += ['# TYPE {}_scans_total counter'.format(prefix),
+              '{}_scans_total {}'.format(prefix,len(self.scans))]
+
+    return '\n'.join(lines) + '\n'
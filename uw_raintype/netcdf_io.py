@@ -1,12 +1,187 @@
+import os
 import netCDF4 as nc4
 import numpy as np
 import time as tm
 import datetime as dt
 
+# Default storage of the rain_type variable. Rain types fit in one byte, and zlib level 4
+# on 1-byte data gives files less than half the size of the old int64 output, written and
+# read two to three times faster (see benchmark.benchstorage). shuffle has no effect on
+# 1-byte data. chunks = None stores each time (and level) in one chunk of up to
+# 1024 x 1024 points. compression may be any filter netCDF4 supports (e.g. 'zstd').
+# With packbits = True, two grid points are packed into each byte (4 bits each, with
+# 15 for missing); use readraintype to unpack.
+STORAGE = {'dtype': 'int8', 'chunks': None, 'complevel': 4, 'shuffle': False,
+           'compression': 'zlib', 'packbits': False}
+
+# Value of a 4-bit packed rain type at missing points.
+PACKED_MISSING = 15
+
+def storageoptions(storage=None):
+
+    # Returns STORAGE updated with the dict storage.
+    options = dict(STORAGE)
+    if storage is not None:
+        for key in storage:
+            if key not in options:
+                raise ValueError('Unknown storage option {}'.format(key))
+        options.update(storage)
+    return options
+
+def storagefill(dtype,missing_value):
+
+    # Value stored at missing points in rain_type of type dtype: missing_value if it fits,
+    # otherwise the most negative value of dtype (or its maximum for unsigned types).
+    info = np.iinfo(dtype)
+    if info.min <= missing_value <= info.max:
+        return missing_value
+    return info.min if info.min < 0 else info.max
+
+def createraintypevar(ncid,dims,shape,missing_value,storage=None):
+
+    # Creates the rain_type variable with dimensions dims (the last two are y and x) in
+    # ncid, stored as given by storage (see STORAGE). shape is the (y,x) shape of the
+    # rain type field. If missing_value does not fit in the storage type, missing points
+    # are stored as its most negative value (or its maximum for unsigned types), which
+    # becomes the _FillValue.
+    options = storageoptions(storage)
+    dims = tuple(dims)
+    nx = shape[1]
+    if options['packbits']:
+        ncid.createDimension('x_packed',(nx+1)//2)
+        dims = dims[:-1] + ('x_packed',)
+        dtype = np.dtype(np.uint8)
+        fill = False
+    else:
+        dtype = np.dtype(options['dtype'])
+        fill = storagefill(dtype,missing_value)
+
+    chunks = options['chunks']
+    if chunks is None:
+        chunks = (1,)*(len(dims)-2) + (1024,1024)
+    # Chunks may not be larger than a fixed-size dimension, so small grids get smaller chunks.
+    sizes = [None if ncid.dimensions[d].isunlimited() else len(ncid.dimensions[d]) for d in dims]
+    chunks = tuple(int(c) if n is None else max(1,min(int(c),n)) for (c,n) in zip(chunks,sizes))
+
+    if options['complevel'] > 0:
+        if options['compression'] == 'zlib':
+            filters = {'zlib': True}
+        else:
+            filters = {'compression': options['compression']}
+        filters.update(complevel=options['complevel'],shuffle=options['shuffle'])
+    else:
+        filters = {}
+    rt = ncid.createVariable('rain_type',dtype,dims,chunksizes=chunks,fill_value=fill,**filters)
+
+    if options['packbits']:
+        rt.packing = 'two 4-bit rain types per byte along x, first in the high bits'
+        rt.packed_missing = PACKED_MISSING
+        rt.x_size = nx
+    return rt
+
+def encoderaintype(raintype,missing_value,rt):
+
+    # Returns raintype (y,x) converted for storage in the rain_type variable rt made by
+    # createraintypevar. Raises a ValueError if a rain type cannot be stored exactly.
+    raintype = np.asarray(raintype)
+    missing = (raintype == missing_value)
+    if 'packing' in rt.ncattrs():
+        if np.any(((raintype < 0) | (raintype >= PACKED_MISSING)) & ~missing):
+            raise ValueError('Rain types must be between 0 and {} for packbits'.format(PACKED_MISSING-1))
+        codes = np.full((raintype.shape[0],2*((raintype.shape[1]+1)//2)),PACKED_MISSING,dtype=np.uint8)
+        codes[:,:raintype.shape[1]] = np.where(missing,PACKED_MISSING,raintype)
+        return (codes[:,0::2] << 4) | codes[:,1::2]
+
+    info = np.iinfo(rt.dtype)
+    if np.any(((raintype < info.min) | (raintype > info.max)) & ~missing):
+        raise ValueError('Rain types do not fit in {}'.format(rt.dtype))
+    return np.where(missing,rt._FillValue,raintype).astype(rt.dtype)
+
+def encoderuns(raintype,missing_value,omit,fill):
+
+    # Returns (start,length,type) of the runs of equal rain type in raintype (y,x), in
+    # row-major order, leaving out the points whose rain type is in omit. Missing points
+    # are kept, with type fill.
+    flat = np.ravel(raintype)
+    keep = ~np.isin(flat,omit)
+    index = np.flatnonzero(keep)
+    codes = np.where(flat[index] == missing_value,fill,flat[index])
+    if len(index) == 0:
+        return (np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64),codes)
+    newrun = np.ones(len(index),dtype=bool)
+    newrun[1:] = (np.diff(index) != 1) | (codes[1:] != codes[:-1])
+    first = np.flatnonzero(newrun)
+    length = np.diff(np.append(first,len(index)))
+    return (index[first],length,codes[first])
+
+def expandruns(start,length,types,shape,background):
+
+    # Returns the (y,x) grid with background everywhere except in the runs given by
+    # start, length and types (as returned by encoderuns).
+    out = np.full(int(np.prod(shape)),background,dtype=types.dtype)
+    start = np.asarray(start,dtype=np.int64)
+    length = np.asarray(length,dtype=np.int64)
+    if len(start):
+        offset = np.cumsum(length) - length
+        index = np.arange(int(np.sum(length))) + np.repeat(start-offset,length)
+        out[index] = np.repeat(types,length)
+    return out.reshape(shape)
+
+def readraintype(ncname,missing_value=None,index=None):
+
+    # Reads the rain_type variable of ncname, as written by any of the writers here,
+    # unpacking or expanding it if needed. index selects times (an int or a slice); by
+    # default all are read. Returns a masked array that is masked at missing points,
+    # or, if missing_value is given, an ndarray with missing_value at missing points.
+    # For sparse files, only the runs of the selected times are read.
+    ncid = nc4.Dataset(ncname,'r')
+    try:
+        if 'run_count' in ncid.variables:
+            rt = ncid.variables['run_type']
+            rt.set_auto_mask(False)
+            count = ncid.variables['run_count'][:]
+            offset = np.append(0,np.cumsum(count))
+            times = np.arange(len(count))
+            selected = times if index is None else np.atleast_1d(times[index])
+            shape = (len(ncid.dimensions['y']),len(ncid.dimensions['x']))
+            data = np.empty((len(selected),)+shape,dtype=rt.dtype)
+            for (k,t) in enumerate(selected):
+                runs = slice(offset[t],offset[t+1])
+                data[k] = expandruns(ncid.variables['run_start'][runs],
+                                     ncid.variables['run_length'][runs],rt[runs],shape,
+                                     rt.background_value)
+            if index is not None and np.ndim(times[index]) == 0:
+                data = data[0]
+            missing = (data == rt._FillValue)
+        else:
+            rt = ncid.variables['rain_type']
+            rt.set_auto_mask(False)
+            data = rt[:] if index is None else rt[index]
+            if 'packing' in rt.ncattrs():
+                unpacked = np.empty(data.shape[:-1]+(2*data.shape[-1],),dtype=np.int8)
+                unpacked[...,0::2] = data >> 4
+                unpacked[...,1::2] = data & 15
+                data = unpacked[...,:rt.x_size]
+                missing = (data == rt.packed_missing)
+            elif '_FillValue' in rt.ncattrs():
+                missing = (data == rt._FillValue)
+            else:
+                missing = np.zeros(data.shape,dtype=bool)
+    finally:
+        ncid.close()
+
+    if missing_value is None:
+        return np.ma.masked_array(data,mask=missing)
+    if not np.can_cast(np.min_scalar_type(missing_value),data.dtype):
+        data = data.astype(np.result_type(data.dtype,np.min_scalar_type(missing_value)))
+    data[missing] = missing_value
+    return data
+
 def writeBasicNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthres,
                      dBZformaxconvradius,weakechothres,backgrndradius,maxConvRadius,
                      minsize,startslope,maxsize,title,institution,source,references1,
-                     references2,comment,dx,radar_lat,radar_lon,raintype,missing_value):
+                     references2,comment,dx,radar_lat,radar_lon,raintype,missing_value,
+                     dy=None,storage=None):
 
     # get current time
     currentTime = tm.strftime("%m/%d/%Y %H:%M:%S");
@@ -16,8 +191,8 @@ def writeBasicNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconv
 
     # create dimensions
     time = ncid.createDimension('time',None) # None implies UNLIMITED
-    y = ncid.createDimension('y',raintype.shape[1])
-    x = ncid.createDimension('x',raintype.shape[0])
+    y = ncid.createDimension('y',raintype.shape[0])
+    x = ncid.createDimension('x',raintype.shape[1])
 
     # create variables
     xspVar = ncid.createVariable('x_spacing',float,zlib=True )
@@ -33,7 +208,7 @@ def writeBasicNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconv
     alVar = ncid.createVariable('rt_A_low',float,zlib=True )
     amVar = ncid.createVariable('rt_A_med',float,zlib=True )
     ahVar = ncid.createVariable('rt_A_high',float,zlib=True )
-    rt = ncid.createVariable('rain_type',int,('time','y','x'),zlib=True,fill_value=missing_value )
+    rt = createraintypevar(ncid,('time','y','x'),raintype.shape,missing_value,storage)
 
     # create variable attributes
 
@@ -127,7 +302,7 @@ def writeBasicNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconv
 
     # write variables to file
     xspVar[:] = dx
-    yspVar[:] = dx
+    yspVar[:] = dx if dy is None else dy
     zthVar[:] = truncZconvthres
     rbgVar[:] = backgrndradius
     aVar[:] = minZdiff
@@ -139,7 +314,7 @@ def writeBasicNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconv
     alVar[:] = minsize
     amVar[:] = startslope
     ahVar[:] = maxsize
-    rt[0,:,:] = raintype
+    rt[0,:,:] = encoderaintype(raintype,missing_value,rt)
 
     # close file
     ncid.close()
@@ -148,7 +323,7 @@ def writeCFnetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthr
                   dBZformaxconvradius,weakechothres,backgrndradius,maxConvRadius,
                   minsize,startslope,maxsize,title,institution,source,references1,
                   references2,comment,timeVal,xVal,yVal,latVal,lonVal,gmVal,
-                  lat_origin,lon_origin,raintype,missing_value):
+                  lat_origin,lon_origin,raintype,missing_value,storage=None):
 
     # get current time
     currentTime = tm.strftime("%m/%d/%Y %H:%M:%S");
@@ -162,8 +337,8 @@ def writeCFnetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthr
 
     # create dimensions
     time = ncid.createDimension('time',None) # None implies UNLIMITED
-    y = ncid.createDimension('y',raintype.shape[1])
-    x = ncid.createDimension('x',raintype.shape[0])
+    y = ncid.createDimension('y',raintype.shape[0])
+    x = ncid.createDimension('x',raintype.shape[1])
 
     # create variables
     timeVar = ncid.createVariable('time',np.float64,('time'),zlib=True )
@@ -184,7 +359,7 @@ def writeCFnetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthr
     alVar = ncid.createVariable('rt_A_low',float)
     amVar = ncid.createVariable('rt_A_med',float)
     ahVar = ncid.createVariable('rt_A_high',float)
-    rt = ncid.createVariable('rain_type',int,('time','y','x'),zlib=True,fill_value=missing_value )
+    rt = createraintypevar(ncid,('time','y','x'),raintype.shape,missing_value,storage)
 
     # create variable attributes
     timeVar.standard_name = 'time'
@@ -323,7 +498,7 @@ def writeCFnetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthr
     alVar[:] = minsize
     amVar[:] = startslope
     ahVar[:] = maxsize
-    rt[0,:,:] = raintype
+    rt[0,:,:] = encoderaintype(raintype,missing_value,rt)
 
     # close file
     ncid.close()
@@ -332,7 +507,7 @@ def writeZebNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvth
                    dBZformaxconvradius,weakechothres,backgrndradius,maxConvRadius,
                    minsize,startslope,maxsize,title,institution,source,references1,
                    references2,comment,btVal,toVal,latVal,lonVal,altVal,
-                   xspVal,yspVal,zspVal,rtVal,missing_value):
+                   xspVal,yspVal,zspVal,rtVal,missing_value,storage=None):
 
     # get current time
     currentTime = tm.strftime("%m/%d/%Y %H:%M:%S");
@@ -343,8 +518,8 @@ def writeZebNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvth
     # create dimensions
     time = ncid.createDimension('time',None) # None implies UNLIMITED
     z = ncid.createDimension('z',1)
-    y = ncid.createDimension('y',rtVal.shape[1])
-    x = ncid.createDimension('x',rtVal.shape[0])
+    y = ncid.createDimension('y',rtVal.shape[0])
+    x = ncid.createDimension('x',rtVal.shape[1])
 
     # create variables
     bt = ncid.createVariable('base_time',np.float64 )
@@ -366,7 +541,7 @@ def writeZebNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvth
     alVar = ncid.createVariable('rt_A_low',float)
     amVar = ncid.createVariable('rt_A_med',float)
     ahVar = ncid.createVariable('rt_A_high',float)
-    rt = ncid.createVariable('rain_type',float,('time','z','y','x',),fill_value=missing_value )
+    rt = createraintypevar(ncid,('time','z','y','x'),rtVal.shape,missing_value,storage)
 
     # create variable attributes
     bt.units = 'seconds since 1970-01-01 00:00:00 +0000'
@@ -481,7 +656,247 @@ def writeZebNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvth
     alVar[:] = minsize
     amVar[:] = startslope
     ahVar[:] = maxsize
-    rt[0,0,:,:] = rtVal
+    rt[0,0,:,:] = encoderaintype(rtVal,missing_value,rt)
 
     #close file
     ncid.close()
+
+# Parameter variables of the output files: (variable, parameter name, units, long_name, comment).
+PARAM_VARS = [
+    ('rt_Z_th','truncZconvthres','dBZ','trunc_Z_conv_thres','reflectivity threshold at or above which echos are classified as convective'),
+    ('rt_R_bg','backgrndradius','km','backgrnd_radius','radius within which background reflectivity is computed'),
+    ('rt_a','minZdiff','dBZ','min_Z_diff','factor for comparing echo to background reflectivity; see equation (1) in journal article referenced in "references1" general attribute'),
+    ('rt_b','deepcoszero','dBZ','deep_cos_zero','see equation (1) in journal article referenced in  "references1" general attribute'),
+    ('rt_R_conv','maxConvRadius','km','max_conv_radius','maximum radius around convective core for possible uncertain classification'),
+    ('rt_Z_conv','dBZformaxconvradius','dBZ','dbz_for_max_conv_radius','minimum dBZ required for max_conv_radius to apply'),
+    ('rt_Z_weak','weakechothres','dBZ','weak_echo_thres','minimum dBZ for classification as not weak echo'),
+    ('rt_Z_shallow','shallowconvmin','dBZ','shallow_conv_min','minimum dBZ for classification as convective for objects with area less than A-med'),
+    ('rt_A_low','minsize','km^2','min_size','minimum areal coverage a contiguous echo can cover and still receive an ISO_CONV classification'),
+    ('rt_A_med','startslope','km^2','start_slope','any contiguous echo object with areal coverage greater than this but less than A_high gets a new Z_th that is linearly interpolated between Z_shallow and Z_th depending on where area is between A_med and A_high'),
+    ('rt_A_high','maxsize','km^2','max_size','any contiguous echo object greater than this size gets a convective threshold of truncZconvthres'),
+]
+
+class TimeSeriesWriter(object):
+
+    """
+    Description: Writes many rain type classifications on the same grid into one NetCDF
+    file, appending each one along the unlimited time dimension. The parameter and
+    coordinate variables and the attributes are written once, with the first scan. If
+    ncname already exists, scans are appended to it; its grid and parameters must match.
+    The file is synced to disk every syncevery scans and at least every syncseconds
+    seconds, so after a crash at most the scans since the last sync are lost. Use it as a
+    context manager, or call close() when done.
+
+    Inputs:
+    ncname = output file
+    types = dict of rain types and their values
+    params = dict with the algorithm parameters and the title, institution, source,
+       references1, references2 and comment attributes (see batch.DEFAULT_PARAMS)
+    missing_value = missing value of the rain type classifications
+    storage = storage of rain_type (see STORAGE)
+    syncevery, syncseconds = how often the file is synced to disk
+    sparse = if True, store only the echo points: instead of rain_type (time,y,x), the
+       file has the runs of equal rain type along the rows (in row-major order) of the
+       points whose rain type is not in omit, as a contiguous ragged array: run_count
+       (time) runs per scan, and run_start (flat index y*nx+x), run_length and run_type
+       for each run. Storage then grows with echo coverage rather than the size of the
+       grid. Use readraintype to expand them to the full grid; omitted points become
+       NO_ECHO. Missing points are stored as runs too. Ignored for an existing file,
+       which keeps its layout.
+    omit = names of the rain types left out of sparse files
+
+    Example:
+
+    >> with TimeSeriesWriter('raintype.20111101.nc',types,params,-9999) as ts:
+    >>   for (rtout,timeval,fname) in scans:
+    >>     ts.append(rtout,timeval,fname,coords={'dx': 1, 'dy': 1})
+    """
+
+    def __init__(self,ncname,types,params,missing_value,storage=None,syncevery=20,
+                 syncseconds=30.,sparse=False,omit=('NO_ECHO','WEAK_ECHO')):
+        self.ncname = ncname
+        self.sparse = sparse
+        self.omit = omit
+        self.nruns = 0
+        self.types = types
+        self.params = params
+        self.missing_value = missing_value
+        self.storage = storage
+        self.syncevery = syncevery
+        self.syncseconds = syncseconds
+        self.ncid = None
+        self.ntimes = 0
+        self.sources = set()
+        self.unsynced = 0
+        self.lastsync = tm.time()
+
+        # An existing file is opened for appending; a new one is created with the first scan.
+        if os.path.exists(ncname):
+            self.ncid = nc4.Dataset(ncname,'a')
+            for (name,key,units,long_name,comment) in PARAM_VARS:
+                if float(self.ncid.variables[name][:]) != float(params[key]):
+                    self.ncid.close()
+                    raise ValueError('{} in {} differs from {}'.format(name,ncname,key))
+            self.ntimes = len(self.ncid.dimensions['time'])
+            self.sources = set(self.ncid.variables['source_file'][:])
+            self.sparse = ('run_count' in self.ncid.variables)
+            if self.sparse:
+                self.nruns = len(self.ncid.dimensions['run'])
+                self.omit = self.ncid.variables['run_type'].omitted_types.split()
+
+    def create(self,shape,coords):
+
+        # Creates the file with the dimensions, coordinates and parameters.
+        currentTime = tm.strftime("%m/%d/%Y %H:%M:%S")
+        ncid = nc4.Dataset(self.ncname,'w',format='NETCDF4')
+        ncid.createDimension('time',None) # None implies UNLIMITED
+        ncid.createDimension('y',shape[0])
+        ncid.createDimension('x',shape[1])
+
+        timeVar = ncid.createVariable('time',np.float64,('time',),fill_value=np.nan)
+        timeVar.standard_name = 'time'
+        timeVar.long_name = 'Data time'
+        timeVar.units = 'seconds since 1970-01-01T00:00:00Z'
+        timeVar.calendar = 'standard'
+        timeVar.axis = 'T'
+        srcVar = ncid.createVariable('source_file',str,('time',))
+        srcVar.long_name = 'input file of each scan'
+
+        if 'lat' in coords:
+            # CF coordinates, as in writeCFnetcdf
+            xVar = ncid.createVariable('x',float,('x'),zlib=True )
+            yVar = ncid.createVariable('y',float,('y'),zlib=True )
+            latVar = ncid.createVariable('lat',float,('y','x'),zlib=True )
+            lonVar = ncid.createVariable('lon',float,('y','x'),zlib=True )
+            gmVar = ncid.createVariable('grid_mapping',int)
+            xVar.standard_name = 'projection_x_coordinate'
+            xVar.long_name = 'x distance on the projection plane from the origin'
+            xVar.units = 'km'
+            xVar.axis = 'X'
+            yVar.standard_name = 'projection_y_coordinate'
+            yVar.long_name = 'y distance on the projection plane from the origin'
+            yVar.units = 'km'
+            yVar.axis = 'Y'
+            latVar.standard_name = 'latitude'
+            latVar.units = 'degrees_north'
+            lonVar.standard_name = 'longitude'
+            lonVar.units = 'degrees_east'
+            gmVar.grid_mapping_name = 'azimuthal_equidistant'
+            gmVar.longitude_of_projection_origin = coords['lon_origin']
+            gmVar.latitude_of_projection_origin = coords['lat_origin']
+            gmVar.false_easting = 0
+            gmVar.false_northing = 0
+            xVar[:] = coords['x']
+            yVar[:] = coords['y']
+            latVar[:] = coords['lat']
+            lonVar[:] = coords['lon']
+        else:
+            xspVar = ncid.createVariable('x_spacing',float)
+            yspVar = ncid.createVariable('y_spacing',float)
+            xspVar.units = 'km'
+            yspVar.units = 'km'
+            xspVar[:] = coords['dx']
+            yspVar[:] = coords['dx'] if coords.get('dy') is None else coords['dy']
+            ncid.radar_lat = coords.get('radar_lat',self.params.get('radar_lat'))
+            ncid.radar_lon = coords.get('radar_lon',self.params.get('radar_lon'))
+
+        for (name,key,units,long_name,comment) in PARAM_VARS:
+            var = ncid.createVariable(name,float)
+            var.units = units
+            var.long_name = long_name
+            var.comment = comment
+            var[:] = self.params[key]
+
+        if self.sparse:
+            options = storageoptions(self.storage)
+            filters = {'zlib': True,'complevel': options['complevel']} if options['complevel'] > 0 else {}
+            dtype = np.dtype(options['dtype'])
+            ncid.createDimension('run',None)
+            countVar = ncid.createVariable('run_count',np.int32,('time',),**filters)
+            countVar.long_name = 'number of runs of each scan'
+            countVar.sample_dimension = 'run'
+            startVar = ncid.createVariable('run_start',np.uint32 if shape[0]*shape[1] < 2**32 else np.uint64,
+                                           ('run',),chunksizes=(65536,),**filters)
+            startVar.long_name = 'flat index (y*nx + x) of the first point of each run'
+            lengthVar = ncid.createVariable('run_length',np.uint32,('run',),chunksizes=(65536,),**filters)
+            lengthVar.long_name = 'number of points in each run'
+            rt = ncid.createVariable('run_type',dtype,('run',),chunksizes=(65536,),
+                                     fill_value=storagefill(dtype,self.missing_value),**filters)
+            rt.omitted_types = ' '.join(self.omit)
+            rt.background_value = self.types['NO_ECHO']
+        else:
+            rt = createraintypevar(ncid,('time','y','x'),shape,self.missing_value,self.storage)
+        rt.units = 'none'
+        rt.long_name = 'rain_type_classification'
+        if 'lat' in coords:
+            rt.coordinates = 'lon lat'
+            rt.grid_mapping = 'grid_mapping'
+        for name in ['NO_ECHO','STRATIFORM','CONVECTIVE','MIXED','ISO_CONV_CORE','ISO_CONV_FRINGE','WEAK_ECHO']:
+            rt.setncattr(name,self.types[name])
+        rt.ancillary_variables = ' '.join(name for (name,key,units,long_name,comment) in PARAM_VARS)
+
+        if 'lat' in coords:
+            ncid.Conventions = "CF-1.0"
+        for name in ['title','institution','source','references1','references2','comment']:
+            ncid.setncattr(name,self.params[name])
+        ncid.history = 'File created ' + currentTime
+        self.ncid = ncid
+
+    def append(self,raintype,timeval=None,source='',coords=None):
+
+        # Appends raintype (y,x) with time timeval (seconds since 1970-01-01, or None if
+        # unknown) and the name of its input file. coords is only used for the first scan of
+        # a new file: a dict with x, y, lat, lon, lat_origin and lon_origin (CF layout), or
+        # with dx and optionally dy, radar_lat and radar_lon.
+        if self.ncid is None:
+            self.create(raintype.shape,coords if coords is not None else {'dx': np.nan})
+        if (len(self.ncid.dimensions['y']),len(self.ncid.dimensions['x'])) != raintype.shape:
+            raise ValueError('Grid of {} differs from the shape {} of the scan'.format(
+                             self.ncname,raintype.shape))
+
+        n = self.ntimes
+        if self.sparse:
+            rt = self.ncid.variables['run_type']
+            (start,length,codes) = encoderuns(raintype,self.missing_value,
+                                              [self.types[name] for name in self.omit],rt._FillValue)
+            info = np.iinfo(rt.dtype)
+            if np.any((codes < info.min) | (codes > info.max)):
+                raise ValueError('Rain types do not fit in {}'.format(rt.dtype))
+            runs = slice(self.nruns,self.nruns+len(start))
+            if len(start):
+                self.ncid.variables['run_start'][runs] = start
+                self.ncid.variables['run_length'][runs] = length
+                rt[runs] = codes.astype(rt.dtype)
+            self.ncid.variables['run_count'][n] = len(start)
+            self.nruns += len(start)
+        else:
+            rt = self.ncid.variables['rain_type']
+            rt[n,:,:] = encoderaintype(raintype,self.missing_value,rt)
+        self.ncid.variables['time'][n] = np.nan if timeval is None else timeval
+        self.ncid.variables['source_file'][n] = source
+        self.ntimes += 1
+        self.sources.add(source)
+
+        self.unsynced += 1
+        if self.unsynced >= self.syncevery or tm.time() - self.lastsync >= self.syncseconds:
+            self.sync()
+
+    def sync(self):
+
+        # Writes everything appended so far to disk.
+        if self.ncid is not None:
+            self.ncid.sync()
+        self.unsynced = 0
+        self.lastsync = tm.time()
+
+    def close(self):
+
+        if self.ncid is not None:
+            self.ncid.close()
+            self.ncid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
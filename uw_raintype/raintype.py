@@ -11,17 +11,38 @@ rev 3 5/2/2016 - added missing value mask to match input reflectivity file
 
 from __future__ import division  #For python2 only. Alternatively, run interpreter with -Q flag. 
 import numpy as np
-import os
 from uw_raintype import algorithm as alg
 from uw_raintype import rtfunctions as rtf
+from uw_raintype import instrument as ins
 import math
 #from uw_raintype import netcdf_io as net
 import logging as log
 
-def raintype(fname, fileDir, refl=None, refl_missing_val=-9999, refl_dx=1, minZdiff=20, 
+## *****************  BEGIN OUTPUT CONSTANTS *****************
+
+# Output constants: Do not change these without a good reason!
+TYPES = {'NO_ECHO':0,'STRATIFORM':1,'CONVECTIVE':2,'MIXED':3,'ISO_CONV_CORE':4,
+         'ISO_CONV_FRINGE':5,'WEAK_ECHO':6,'CS_CORE':8,'ISO_CS_CORE':9}
+#Many users may want to set ISO_CONV_CORE and ISO_CONV_FRINGE to the same value because the core and
+#fringe categories are closely related. Or such users can leave this code as-is and process the output
+#as if the two categories were the same category.
+
+## ***************** END OUTPUT CONSTANTS   ******************
+
+def outputdtype(refl_missing_val):
+
+  #Smallest signed integer type that holds the rain types and refl_missing_val (int16
+  #for -9999).
+  missing = refl_missing_val
+  if float(missing).is_integer():
+    missing = int(missing)
+  return np.promote_types(np.int8,np.min_scalar_type(missing))
+
+def raintype(fname=None, fileDir=None, refl=None, refl_missing_val=-9999, refl_dx=1, minZdiff=20, 
              deepcoszero=40, shallowconvmin=28, truncZconvthres=43, dBZformaxconvradius=46, 
              weakechothres=7, backgrndradius=5, maxConvRadius=10, minsize=8, startslope=50, 
-             maxsize=2000):
+             maxsize=2000, bgmethod='direct', recorder=None, inplace=False, out=None, 
+             refl_dy=None, return_objects=False):
     #Values above are default values for S-band over tropical marine region. Code will use 
     #what is designated in runraintype.py first and will use these only if no value(s) is/are given.
 
@@ -53,9 +74,11 @@ def raintype(fname, fileDir, refl=None, refl_missing_val=-9999, refl_dx=1, minZd
   maxsize                             A_high
 
   Inputs:
+  fname, fileDir = name and directory of the file refl was read from; optional and only kept 
+     for backward compatibility
   refl = Reflectivity
   refl_missing_val = missing value in reflectivity data
-  refl_dx (km) = horizontal spacing of grid
+  refl_dx (km) = horizontal spacing of grid (in x, along the columns of refl)
   minZdiff = factor for comparing echo to background reflectivity; see equation (1) in journal 
      article referenced above
   deepcoszero = see equation (1) in journal article referenced above
@@ -80,26 +103,34 @@ def raintype(fname, fileDir, refl=None, refl_missing_val=-9999, refl_dx=1, minZd
      truncZconvthres depending on where between startslope and maxsize its area is (See makedBZcluster)
   maxsize (km^2) = any contiguous echo object greater than this size gets a convective threshold of 
      truncZconvthres (See makedBZcluster)
+  bgmethod = how the background reflectivity convolution is computed: 'direct' (default; the 
+     convolve2d of the original code), 'fft', 'oa', 'sat' or 'auto' to pick the fastest by grid
+     and mask size (See rtfunctions.convolve_bgmask). The other methods agree with 'direct' to
+     a relative tolerance of about 1e-9, so a point lying exactly on a threshold may differ.
+  recorder = optional instrument.StageRecorder that records the wall time, peak memory and
+     array sizes of each stage and the numbers of echo objects and core pixels
+  inplace = if False (default), refl is not modified; missing values are set to NaN in an 
+     internal copy. If True, they are set to NaN in refl itself, which saves one full-grid 
+     copy when the caller doesn't need refl afterwards. Integer refl is always copied.
+     refl may be any array that maps memory without copying it, e.g. an np.memmap or an
+     array in a multiprocessing.shared_memory block.
+  out = optional preallocated integer array (e.g. a view of a shared-memory or memory-mapped 
+     output array) with the shape of refl that the classification is written to
+  refl_dy (km) = grid spacing in y (along the rows of refl) if it differs from refl_dx. The
+     grid may have any number of rows and columns.
+  return_objects = if True, also return the echo objects found by the clustering step, so
+     that e.g. storm tracking does not have to label the field again
 
   Outputs:
-  rain_type = rain type classification
+  rain_type = rain type classification (out if it was given)
   types = dict of rain types and their values
+  labels, objects = only if return_objects is True: the number of the echo object each 
+     grid point belongs to (0 for none) and a table with one row per object (see 
+     rtfunctions.objecttable for its columns)
   
   """
   
-  global bgmask
-  global maskcell
-
-  ## *****************  BEGIN OUTPUT CONSTANTS *****************
-  
-  # Output constants: Do not change these without a good reason!
-  types = {'NO_ECHO':0,'STRATIFORM':1,'CONVECTIVE':2,'MIXED':3,'ISO_CONV_CORE':4,
-           'ISO_CONV_FRINGE':5,'WEAK_ECHO':6,'CS_CORE':8,'ISO_CS_CORE':9}
-  #Many users may want to set ISO_CONV_CORE and ISO_CONV_FRINGE to the same value because the core and
-  #fringe categories are closely related. Or such users can leave this code as-is and process the output
-  #as if the two categories were the same category.
-  
-  ## ***************** END OUTPUT CONSTANTS   ******************
+  types = dict(TYPES)
 
   log.basicConfig(format='%(levelname)s:%(message)s',level=log.INFO)
 
@@ -109,33 +140,234 @@ def raintype(fname, fileDir, refl=None, refl_missing_val=-9999, refl_dx=1, minZd
     rtout = None
     return rtout, types
   
-  #Create missing value mask and turn refl missing values into NaN's
-  mask = np.zeros(refl.shape)
-  mask[(refl == refl_missing_val)] = 1
-  mask[(np.isnan(refl))] = 1
-  refl[(mask == 1)] = np.nan
-
-  #Convert dBZ to Z
-  Z = rtf.DBZtoZ(refl)
+  with ins.scan(recorder,fname):
+    #Create missing value mask and turn refl missing values into NaN's, in a copy of
+    #refl unless inplace is True
+    with ins.stage(recorder,'missing_mask',refl):
+      refl = np.asarray(refl)
+      mask = np.isnan(refl)
+      mask |= (refl == refl_missing_val)
+      if not np.issubdtype(refl.dtype,np.floating):
+        refl = refl.astype(float)
+      elif not inplace:
+        refl = refl.copy()
+      refl[mask] = np.nan
 
-  #If this is the first file in a batch, create a background reflectivity mask and
-  #a mask for identifying regions around convective cores.
-  if fname == os.listdir(fileDir)[0]:
-    bgmask = rtf.makebgmask(backgrndradius,refl_dx)
-    maskcell = rtf.makeconvmask(maxConvRadius,refl_dx) 
+    #Convert dBZ to Z
+    with ins.stage(recorder,'DBZtoZ',refl):
+      Z = rtf.DBZtoZ(refl)
 
-  #Now determine the background reflectivity at each grid point.
-  background = rtf.get_background_refl(Z,bgmask)
+    #Get the background reflectivity mask and the masks for identifying regions around 
+    #convective cores. These are only built the first time a combination of radii and
+    #grid spacing is used in this process.
+    (bgmask,maskcell) = rtf.getmasks(backgrndradius,maxConvRadius,float(refl_dx),
+                                     None if refl_dy is None else float(refl_dy))
 
-  #Convert Z to dBZ
-  background = rtf.ZtoDBZ(background)
+    #Now determine the background reflectivity at each grid point and convert it to dBZ.
+    #Z is not needed afterwards, so it is used as the scratch array.
+    with ins.stage(recorder,'get_background_refl',Z):
+      background = rtf.get_background_refl(Z,bgmask,bgmethod,inplace=True)
+      background = rtf.ZtoDBZ(background)
 
-  #Run convectivecore.
-  rtout = alg.convectivecore(background,refl,minZdiff,types,dBZformaxconvradius,
-                             maxConvRadius,weakechothres,deepcoszero,minsize,maxsize,
-                             startslope,shallowconvmin,truncZconvthres,refl_dx,maskcell)
+    #Run convectivecore.
+    objects = {} if return_objects else None
+    rtout = alg.convectivecore(background,refl,minZdiff,types,dBZformaxconvradius,
+                               maxConvRadius,weakechothres,deepcoszero,minsize,maxsize,
+                               startslope,shallowconvmin,truncZconvthres,refl_dx,maskcell,
+                               recorder=recorder,dy=refl_dy,objects=objects)
+    if return_objects:
+      table = rtf.objecttable(objects,refl,rtout,types)
 
-  #Apply missing value mask to raintype array
-  rtout[mask == 1] = refl_missing_val
+    #Apply missing value mask to raintype array. convectivecore returns uint8 categories;
+    #the output stays a platform int array as before so it can hold refl_missing_val.
+    if out is None:
+      rtout = rtout.astype(int)
+    else:
+      out[...] = rtout
+      rtout = out
+    rtout[mask] = refl_missing_val
 
+  if return_objects:
+    return rtout, types, objects['echoes'], table
   return rtout, types
+
+
+class RainTypeClassifier(object):
+
+  """
+  Description: Same classification as raintype, but configured once for a fixed grid
+  shape so that repeated scans (e.g. a real-time feed) reuse the same scratch arrays
+  instead of allocating about ten full-grid arrays per scan. The input refl is not
+  modified.
+
+  Usage:
+  clf = RainTypeClassifier(refl.shape, refl_dx=dx, truncZconvthres=38, ...)
+  for refl in scans:
+    rtout = clf.classify(refl)
+  rtvol = clf.classify_volume(refl4d)   #refl4d has shape (time,z,y,x)
+
+  Inputs:
+  shape = (ny,nx) shape of the reflectivity grids that will be classified
+  dtype = floating point type used for reflectivity, Z, background and the per-point 
+     thresholds; np.float32 halves the memory of those arrays. The thresholds are compared
+     in dtype, so a point whose reflectivity or excess over the background lies within
+     float32 rounding (about 1e-6 relative) of a threshold may be classified differently
+     than with np.float64. Thresholds that are exact in float32 (e.g. whole dBZ) and values
+     further from them give identical classifications.
+  incremental = if True, the background reflectivity of each scan is only recomputed in 
+     the rows near points whose reflectivity changed since the previous scan, which is 
+     exact for the 'direct' and 'sat' background methods (see 
+     rtfunctions.update_background_refl). Useful for rapid updates in which most of the 
+     domain stays the same. This keeps two more grids in memory.
+  maxdirty = fraction of the rows above which the whole background is recomputed in 
+     incremental mode
+  All other inputs are the same as for raintype (see raintype for descriptions).
+
+  Attributes:
+  types = dict of rain types and their values
+  outdtype = dtype of the returned classification: the smallest signed integer type 
+     that holds the categories and refl_missing_val (int16 for -9999)
+  """
+
+  def __init__(self, shape, refl_missing_val=-9999, refl_dx=1, minZdiff=20, deepcoszero=40,
+               shallowconvmin=28, truncZconvthres=43, dBZformaxconvradius=46, weakechothres=7,
+               backgrndradius=5, maxConvRadius=10, minsize=8, startslope=50, maxsize=2000,
+               bgmethod='direct', dtype=np.float64, refl_dy=None, incremental=False,
+               maxdirty=0.25):
+
+    self.shape = tuple(shape)
+    self.dtype = np.dtype(dtype)
+    self.types = dict(TYPES)
+    self.refl_missing_val = refl_missing_val
+    self.refl_dx = refl_dx
+    self.refl_dy = refl_dy
+    self.minZdiff = minZdiff
+    self.deepcoszero = deepcoszero
+    self.shallowconvmin = shallowconvmin
+    self.truncZconvthres = truncZconvthres
+    self.dBZformaxconvradius = dBZformaxconvradius
+    self.weakechothres = weakechothres
+    self.backgrndradius = backgrndradius
+    self.maxConvRadius = maxConvRadius
+    self.minsize = minsize
+    self.startslope = startslope
+    self.maxsize = maxsize
+    self.bgmethod = bgmethod
+    self.incremental = incremental
+    self.maxdirty = maxdirty
+    self.bgstate = {}
+
+    (self.bgmask,self.maskcell) = rtf.getmasks(backgrndradius,maxConvRadius,float(refl_dx),
+                                               None if refl_dy is None else float(refl_dy))
+    if bgmethod == 'auto':
+      self.bgmethod = rtf.choose_bg_method(self.shape,self.bgmask)
+    if self.dtype != self.bgmask.dtype:
+      self.bgmask = self.bgmask.astype(self.dtype)
+
+    self.outdtype = outputdtype(refl_missing_val)
+
+    #Scratch arrays. The ones used here are allocated now; those used inside 
+    #convectivecore and makedBZcluster are added on the first scan.
+    self.work = {}
+    for (name,dtype) in [('mask',bool),('refl',self.dtype),('Z',self.dtype),
+                         ('background',self.dtype)]:
+      rtf.workarray(self.work,name,self.shape,dtype)
+
+  def classify(self, refl, out=None, recorder=None, return_objects=False):
+
+    #Returns the rain type classification of refl. If out is given, the result is
+    #written to it and out is returned. recorder is an optional
+    #instrument.StageRecorder (see raintype). With return_objects=True, returns
+    #(classification, labels, objects) as described for raintype.
+    refl = np.asarray(refl)
+    if refl.shape != self.shape:
+      raise ValueError('refl has shape {} but the classifier was set up for {}'.format(
+                       refl.shape,self.shape))
+    work = self.work
+
+    with ins.scan(recorder):
+      #Create missing value mask and copy refl with missing values turned into NaN's
+      with ins.stage(recorder,'missing_mask',refl):
+        mask = work['mask']
+        np.isnan(refl,out=mask)
+        mask |= (refl == self.refl_missing_val)
+        reflnan = work['refl']
+        np.copyto(reflnan,refl)
+        reflnan[mask] = np.nan
+
+      #Convert dBZ to Z, get the background reflectivity and convert it back to dBZ
+      with ins.stage(recorder,'DBZtoZ',refl):
+        Z = rtf.DBZtoZ(reflnan,out=work['Z'])
+      with ins.stage(recorder,'get_background_refl',Z):
+        if self.incremental:
+          background = rtf.update_background_refl(Z,self.bgmask,self.bgmethod,self.bgstate,
+                                                  self.maxdirty,work['background'],recorder)
+        else:
+          background = rtf.get_background_refl(Z,self.bgmask,self.bgmethod,
+                                               out=work['background'],inplace=True)
+        rtf.ZtoDBZ(background,out=background)
+
+      #Run convectivecore.
+      objects = {} if return_objects else None
+      rtout = alg.convectivecore(background,reflnan,self.minZdiff,self.types,
+                                 self.dBZformaxconvradius,self.maxConvRadius,
+                                 self.weakechothres,self.deepcoszero,self.minsize,
+                                 self.maxsize,self.startslope,self.shallowconvmin,
+                                 self.truncZconvthres,self.refl_dx,self.maskcell,work,
+                                 recorder,dy=self.refl_dy,objects=objects)
+
+      #Apply missing value mask to raintype array
+      if out is None:
+        out = np.empty(self.shape,dtype=self.outdtype)
+      out[...] = rtout
+      out[mask] = self.refl_missing_val
+
+    if return_objects:
+      #The labels are in a work array that the next scan overwrites, so return a copy.
+      return out, objects['echoes'].copy(), rtf.objecttable(objects,reflnan,rtout,self.types)
+    return out
+
+  def classify_volume(self, refl, levels=None, times=None, out=None):
+
+    #Classifies every requested (time,level) slab of a (time,z,y,x) reflectivity
+    #array, e.g. the full REFL variable of an input file, with the same masks and
+    #work arrays. levels and times are 0-based indices (all of them by default).
+    #Returns (or fills out with) an array of shape (len(times),len(levels),y,x).
+    refl = np.asarray(refl)
+    if refl.ndim != 4 or refl.shape[2:] != self.shape:
+      raise ValueError('refl has shape {} but (time,z)+{} was expected'.format(
+                       refl.shape,self.shape))
+    times = list(range(refl.shape[0])) if times is None else list(times)
+    levels = list(range(refl.shape[1])) if levels is None else list(levels)
+
+    if out is None:
+      out = np.empty((len(times),len(levels))+self.shape,dtype=self.outdtype)
+    for (it,t) in enumerate(times):
+      for (iz,z) in enumerate(levels):
+        self.classify(refl[t,z],out=out[it,iz])
+
+    return out
+
+def raintype_volume(refl, levels=None, times=None, **kwargs):
+
+  """
+  Description: Rain type classification of several levels and/or times of a
+  (time,z,y,x) reflectivity array in one call, so that a file only has to be read
+  once and the masks and work arrays are set up once for all slabs.
+
+  Inputs:
+  refl = Reflectivity with shape (time,z,y,x)
+  levels, times = 0-based indices of the levels and times to classify (default all)
+  All other inputs are keyword arguments as for raintype (see raintype).
+
+  Outputs:
+  rain_type = rain type classification with shape (len(times),len(levels),y,x)
+  types = dict of rain types and their values
+  """
+
+  refl = np.asarray(refl)
+  if refl.ndim != 4:
+    raise ValueError('refl must have shape (time,z,y,x), not {}'.format(refl.shape))
+  clf = RainTypeClassifier(refl.shape[2:],**kwargs)
+
+  return clf.classify_volume(refl,levels,times), clf.types
@@ -1,84 +1,250 @@
 from __future__ import division     #For python2 users only.
 import numpy as np
 import math
+from functools import lru_cache
+from uw_raintype import instrument as ins
 
-def ZtoDBZ(z):
-  return 10*np.log10(z)
+def ZtoDBZ(z,out=None):
+  out = np.log10(z,out=out)
+  return np.multiply(out,10,out=out)
 
-def DBZtoZ(dbz):
-  return 10**(0.1*dbz)
+def DBZtoZ(dbz,out=None):
+  out = np.multiply(dbz,0.1,out=out)
+  return np.power(10,out,out=out)
 
-def makebgmask(backgrndradius,dx):
+def workarray(work,name,shape,dtype):
 
-  global bgmask
+  #Returns the scratch array called name from the dict work so that repeated calls
+  #can reuse it. The array is (re)allocated if it is missing or has the wrong shape
+  #or dtype. Its contents are undefined. If work is None, a new array is returned.
+  if work is None:
+    return np.empty(shape,dtype=dtype)
+  arr = work.get(name)
+  if arr is None or arr.shape != tuple(shape) or arr.dtype != np.dtype(dtype):
+    arr = np.empty(shape,dtype=dtype)
+    work[name] = arr
+  return arr
 
-  bgrange = int(max(1,np.ceil(backgrndradius/dx)))
+def makebgmask(backgrndradius,dx,dy=None):
 
-  bgmask = np.zeros((2*bgrange+1, 2*bgrange+1), dtype='float')
-  for i in range(-bgrange,bgrange+1):
-    for j in range(-bgrange,bgrange+1):
-      if ( (i*dx)**2 + (j*dx)**2 ) <= backgrndradius**2:
-        bgmask[i+bgrange,j+bgrange] = 1
+  #Disk of radius backgrndradius (km) on a grid with spacing dx in x (columns) and dy
+  #in y (rows; same as dx if not given), normalized to sum to 1.
+  if dy is None:
+    dy = dx
+  bgrangey = int(max(1,np.ceil(backgrndradius/dy)))
+  bgrangex = int(max(1,np.ceil(backgrndradius/dx)))
 
-  bgmask = bgmask/(sum(sum(bgmask)))
+  i = np.arange(-bgrangey,bgrangey+1)[:,None]
+  j = np.arange(-bgrangex,bgrangex+1)[None,:]
+  bgmask = (((i*dy)**2 + (j*dx)**2) <= backgrndradius**2).astype('float')
 
-  return bgmask
+  bgmask = bgmask/bgmask.sum()
 
-def makeconvmask(maxConvRadius,dx):
+  return bgmask
 
-  global maskcell
+def makeconvmask(maxConvRadius,dx,dy=None):
 
   #Create a mask, maskcell. Different indices for maskcell are for masks of different
-  #sizes.
+  #sizes. dx and dy are the grid spacings in x (columns) and y (rows); dy defaults to dx.
+  if dy is None:
+    dy = dx
   d = list(range(maxConvRadius-4,maxConvRadius+1))
   #The 4 in above line assumes minimum radius in section above is 6 km.
-  n = [int(np.floor(x/dx)) for x in d]
-  a = [2*x+1 for x in n]
-  maskcell = [np.zeros([x,x]) for x in a]
+  maskcell = []
   for k in range(0,len(d)):
-    mask = np.zeros([int(2*n[k]+1),int(2*n[k]+1)])
-    for i in range(-n[k],n[k]+1):
-      for j in range(-n[k],n[k]+1):
-        if ( (i*dx)**2 + (j*dx)**2 ) <= d[k]**2:
-          mask[i+n[k],j+n[k]] = 1
-    maskcell[k] = mask
+    ny = int(np.floor(d[k]/dy))
+    nx = int(np.floor(d[k]/dx))
+    i = np.arange(-ny,ny+1)[:,None]
+    j = np.arange(-nx,nx+1)[None,:]
+    maskcell.append((((i*dy)**2 + (j*dx)**2) <= d[k]**2).astype('float'))
 
   return maskcell
 
-def get_background_refl(Z,bgmask):
+def getmasks(backgrndradius,maxConvRadius,dx,dy=None):
+
+  #Returns (bgmask,maskcell) for the given radii and grid spacings, building them only
+  #the first time a combination is seen in this process. The masks are shared between
+  #callers, so they are made read-only. dy=None and dy=dx share one cache entry.
+  dx = float(dx)
+  dy = dx if dy is None else float(dy)
+  return cachedmasks(backgrndradius,maxConvRadius,dx,dy)
+
+@lru_cache(maxsize=16)
+def cachedmasks(backgrndradius,maxConvRadius,dx,dy):
+
+  #getmasks with the grid spacings normalized, so equal masks have one cache key.
+  bgmask = makebgmask(backgrndradius,dx,dy)
+  bgmask.flags.writeable = False
+  maskcell = makeconvmask(maxConvRadius,dx,dy)
+  for mask in maskcell:
+    mask.flags.writeable = False
+
+  return (bgmask,tuple(maskcell))
+
+def choose_bg_method(shape,bgmask):
+
+  #Picks the cheapest way to convolve a grid of the given shape with bgmask. Direct
+  #convolution costs O(N^2 R^2), which only pays off for very small kernels or grids.
+  #Disk-shaped kernels of moderate size are summed row by row from a cumulative sum
+  #(O(N^2 R)); anything larger goes through the FFT (O(N^2 log N)).
+  if bgmask.size <= 25 or np.prod(shape) <= 4*bgmask.size:
+    return 'direct'
+  elif bgmask.shape[0] <= 21 and isdiskmask(bgmask):
+    return 'sat'
+  else:
+    return 'fft'
+
+def isdiskmask(bgmask):
+
+  #True if every row of bgmask is a single run of one constant value and the mask is
+  #symmetric, so it can be applied with row-wise summed-area sums.
+  if not np.array_equal(bgmask,bgmask[::-1,::-1]):
+    return False
+  for row in bgmask:
+    nz = np.nonzero(row)[0]
+    if len(nz) > 0 and (nz[-1]-nz[0]+1 != len(nz) or np.any(row[nz] != row[nz[0]])):
+      return False
+  return True
+
+def convolve_bgmask(A,bgmask,method='direct'):
 
   from scipy import signal as sg
 
-  #Create background variable.
-  background = np.zeros(Z.shape)
-  Z[np.isnan(Z)] = 0
+  #Convolves A with bgmask, returning an array the size of A with the edges handled
+  #by symmetric reflection (same as convolve2d with mode='same', boundary='symm').
+  #method is one of 'direct', 'fft', 'oa' (overlap-add), 'sat' (summed-area, for
+  #disk-shaped masks such as those from makebgmask) or 'auto'. 'direct' is the default
+  #because it is the original convolve2d; the others agree with it to about 1e-9.
+  if method == 'auto':
+    method = choose_bg_method(A.shape,bgmask)
+
+  if method == 'direct':
+    return sg.convolve2d(A,bgmask,mode='same',boundary='symm',fillvalue=0)
+
+  (ry,rx) = (bgmask.shape[0]//2,bgmask.shape[1]//2)
+  padded = np.pad(A,((ry,ry),(rx,rx)),mode='symmetric')
+
+  if method == 'fft':
+    return sg.fftconvolve(padded,bgmask,mode='valid')
+  elif method == 'oa':
+    return sg.oaconvolve(padded,bgmask,mode='valid')
+  elif method == 'sat':
+    if not isdiskmask(bgmask):
+      raise ValueError('The sat method requires a symmetric, disk-shaped mask.')
+    #Each row of the mask is a run of constant weight, so its contribution is a box sum
+    #along x, which is the difference of two entries of the cumulative sum.
+    csum = np.zeros((padded.shape[0],padded.shape[1]+1))
+    np.cumsum(padded,axis=1,out=csum[:,1:])
+    (ny,nx) = A.shape
+    out = np.zeros(A.shape,dtype=np.result_type(A,bgmask))
+    for i in range(0,bgmask.shape[0]):
+      nz = np.nonzero(bgmask[i])[0]
+      if len(nz) == 0:
+        continue
+      rows = csum[i:i+ny]
+      out += bgmask[i,nz[0]]*(rows[:,nz[-1]+1:nz[-1]+1+nx] - rows[:,nz[0]:nz[0]+nx])
+    return out
+  else:
+    raise ValueError('Unknown background convolution method: {}'.format(method))
+
+def get_background_refl(Z,bgmask,method='direct',out=None,work=None,inplace=False):
+
+  #Returns the background reflectivity (in Z units) of Z. Z is not modified: NaN's
+  #are set to 0 and then the nonzero values to 1 in a single scratch array (taken
+  #from the work dict if given). With inplace=True that is done in Z itself, which
+  #saves the copy when the caller doesn't need Z afterwards.
+
+  #Create background variable (or use out).
+  if out is None:
+    out = np.zeros(Z.shape)
+  background = out
+  if inplace:
+    filled = Z
+  else:
+    filled = workarray(work,'bgfilled',Z.shape,Z.dtype)
+    np.copyto(filled,Z)
+  filled[np.isnan(filled)] = 0
 
   #First convolve the mask with the reflectivity data. The result will be
   #a matrix that reports background reflectivity even where there is zero
-  #reflectivity.
-  bg1 = sg.convolve2d(Z,bgmask,mode='same',boundary='symm',fillvalue=0)
-  Z[Z != 0] = 1
+  #reflectivity. See convolve_bgmask for the choices of method.
+  bg1 = convolve_bgmask(filled,bgmask,method)
+  filled[filled != 0] = 1
   #Next, convolve the mask with ones and zeros, where the ones are where
   #reflectivity is nonzero.
-  bg2 = sg.convolve2d(Z,bgmask,mode='same',boundary='symm',fillvalue=0)
+  bg2 = convolve_bgmask(filled,bgmask,method)
   #Normalize to determine the actual background reflectivity.
-  background = bg1/bg2
+  np.divide(bg1,bg2,out=background)
   #Make sure non-existent values in background are NaN
-  background[Z==0] = np.nan
+  background[filled==0] = np.nan
 
   return background
 
+def update_background_refl(Z,bgmask,method,state,maxdirty=0.25,out=None,recorder=None):
+
+  #Incremental get_background_refl for consecutive scans on the same grid. state is a
+  #dict the caller keeps between scans (start with {}); it holds the zero-filled Z and
+  #the background of the previous scan. Only the rows within the mask radius of a
+  #changed grid point are recomputed, in full-width bands with a halo of the mask
+  #radius, so the result is exactly that of a full recompute with the 'direct' and
+  #'sat' methods. Everything is recomputed for the first scan, when more than the
+  #fraction maxdirty of the rows would be recomputed, and always for 'fft' and 'oa',
+  #whose rounding depends on the whole grid. Z is not modified.
+  if method == 'auto':
+    method = choose_bg_method(Z.shape,bgmask)
+  if out is None:
+    out = np.zeros(Z.shape)
+  (ny,ry) = (Z.shape[0],bgmask.shape[0]//2)
+  key = (Z.shape,Z.dtype.str,method,bgmask.shape,bgmask.tobytes())
+
+  #The zero-filled Z of this scan goes into the buffer of the scan before last.
+  prev = state.get('filled')
+  filled = state.get('spare')
+  if filled is None or filled.shape != Z.shape or filled.dtype != Z.dtype:
+    filled = np.empty(Z.shape,dtype=Z.dtype)
+  np.copyto(filled,Z)
+  filled[np.isnan(filled)] = 0
+
+  runs = None
+  if state.get('key') == key and method in ('direct','sat'):
+    #Rows that need a new background: those within ry rows of a changed point.
+    csum = np.concatenate([[0],np.cumsum(np.any(filled != prev,axis=1))])
+    row = np.arange(ny)
+    dirty = csum[np.minimum(row+ry+1,ny)] > csum[np.maximum(row-ry,0)]
+    if np.count_nonzero(dirty) <= maxdirty*ny:
+      edges = np.flatnonzero(np.diff(np.concatenate([[0],dirty.astype(np.int8),[0]])))
+      runs = list(zip(edges[0::2],edges[1::2]))
+
+  background = state.get('background')
+  if runs is None:
+    if background is None or background.shape != Z.shape or background.dtype != out.dtype:
+      background = np.empty(Z.shape,dtype=out.dtype)
+    get_background_refl(filled,bgmask,method,out=background,work=state)
+    nrows = ny
+  else:
+    for (a,b) in runs:
+      (w0,w1) = (max(0,a-ry),min(ny,b+ry))
+      background[a:b] = get_background_refl(filled[w0:w1],bgmask,method)[a-w0:b-w0]
+    nrows = sum(b-a for (a,b) in runs)
+  ins.count(recorder,'background_rows',nrows)
+
+  state.update({'key': key, 'filled': filled, 'spare': prev, 'background': background})
+  np.copyto(out,background)
+
+  return out
+
 def chopmask(inmask,topchop,rightchop,btmchop,leftchop):
   from copy import copy
 
   #Simply trims inmask so it fits data on edge of domain. Returns newmask. 
+  #inmask may have different numbers of rows and columns.
   newmask = copy(inmask)
-  masksize = inmask.shape[1]
+  (masksizey,masksizex) = inmask.shape
 
   if topchop != 0:
-      newmask = newmask[:,0:masksize-topchop] 
+      newmask = newmask[:,0:masksizex-topchop] 
   if rightchop != 0:
-      newmask = newmask[0:masksize-rightchop,:]
+      newmask = newmask[0:masksizey-rightchop,:]
   if btmchop != 0:
       newmask = newmask[:,btmchop:]
   if leftchop != 0:
@@ -86,103 +252,258 @@ def chopmask(inmask,topchop,rightchop,btmchop,leftchop):
 
   return newmask
 
-#The following 2 functions are to speed up makedBZcluster. From https://stackoverflow.com/questions/33281957/faster-alternative-to-numpy-where
+def dilatedisk(seeds,stamp,out):
 
-def compute_M(data):
-  from scipy.sparse import csr_matrix
-  import numpy as np
-  cols = np.arange(data.size)
-  return csr_matrix((cols, (data.ravel(), cols)),
-                    shape=(data.max() + 1, data.size))
+  from scipy import ndimage as nd
 
-def get_indices_sparse(data):
-  import numpy as np
-  M = compute_M(data)
-  return [np.unravel_index(row.data, data.shape) for row in M]
+  #ORs stamp, centered on every True point of seeds, into out: the same as
+  #out |= binary_dilation(seeds,structure=stamp). For masks whose rows are each a single
+  #run centered on the middle column (such as those from makeconvmask), the seeds in
+  #each run are counted from a cumulative sum along x, which costs a few passes over
+  #the grid per row of the mask instead of one per mask point.
+  (n,m) = (stamp.shape[0]//2,stamp.shape[1]//2)
+  halfwidth = []
+  for row in stamp:
+    nz = np.nonzero(row)[0]
+    if len(nz) > 0 and (nz[-1]-nz[0]+1 != len(nz) or nz[0]+nz[-1] != 2*m):
+      out |= nd.binary_dilation(seeds,structure=stamp)
+      return out
+    halfwidth.append(None if len(nz) == 0 else m-nz[0])
+
+  (ny,nx) = seeds.shape
+  csum = np.zeros((ny,nx+1),dtype=np.int32)
+  np.cumsum(seeds,axis=1,out=csum[:,1:])
+  col = np.arange(nx)
+  box = {}
+  for (i,h) in enumerate(halfwidth):
+    if h is None:
+      continue
+    #box[h] is True where row y has a seed within h columns.
+    if h not in box:
+      box[h] = csum[:,np.minimum(col+h+1,nx)] > csum[:,np.maximum(col-h,0)]
+    dr = i-n
+    if dr >= 0:
+      out[dr:] |= box[h][:ny-dr]
+    else:
+      out[:ny+dr] |= box[h][-dr:]
+
+  return out
+
+def makemixedmask(cores,convclass,maskcell,out=None):
+
+  #Marks every grid point that falls inside the MIXED-radius mask of at least one
+  #convective core. cores is True at core pixels and convclass holds the index into
+  #maskcell (0 for the smallest radius, 4 for maxConvRadius) for each pixel.
+  #Replaces stamping a full-domain array for every core, which scaled with
+  #cores x grid size. The masks may be rectangular (different dx and dy). The result is
+  #written to out if given.
+  if out is None:
+    out = np.zeros(cores.shape,dtype=bool)
+  maskind = out
+  maskind.fill(False)
+  (ny,nx) = cores.shape
+  (I,J) = np.nonzero(cores)
+  K = convclass[I,J]
+
+  for k in range(0,len(maskcell)):
+    Ik = I[K == k]
+    Jk = J[K == k]
+    if len(Ik) == 0:
+      continue
+    (n,m) = (maskcell[k].shape[0]//2,maskcell[k].shape[1]//2)
+    stamp = maskcell[k] != 0
+
+    #Cores whose mask fits inside the domain. If there are many of them, one binary
+    #dilation of the core field is cheapest; otherwise stamp each mask in place.
+    inside = (Ik >= n) & (Ik <= ny-1-n) & (Jk >= m) & (Jk <= nx-1-m)
+    if np.count_nonzero(inside)*stamp.size > cores.size:
+      seeds = np.zeros(cores.shape,dtype=bool)
+      seeds[Ik[inside],Jk[inside]] = True
+      dilatedisk(seeds,stamp,maskind)
+    else:
+      for (i,j) in zip(Ik[inside],Jk[inside]):
+        maskind[i-n:i+n+1,j-m:j+m+1] |= stamp
+
+    #Cores close to the edge of the domain get their mask trimmed by chopmask, exactly
+    #as in the original per-core loop.
+    for (i,j) in zip(Ik[~inside],Jk[~inside]):
+      Ilow = max(i-n,0)
+      Ihigh = min(i+n,ny-1)
+      Jlow = max(j-m,0)
+      Jhigh = min(j+m,nx-1)
+      leftchop = abs(i-n-Ilow)
+      rightchop = abs(i+n-Ihigh)
+      topchop = abs(j-m-Jlow)
+      btmchop = abs(j+m-Jhigh)
+      maskind[Ilow:Ihigh+1,Jlow:Jhigh+1] |= chopmask(stamp,topchop,rightchop,
+                                                     btmchop,leftchop)
+
+  return maskind
 
 def makedBZcluster(refl,isCore,convsfmat,weakechothres,minsize,maxsize,startslope,
-                   shallowconvmin,truncZconvthres,types,dx):
+                   shallowconvmin,truncZconvthres,types,dx,work=None,recorder=None,
+                   echoes=None,clusterarea=None,dy=None,objects=None):
 
   from scipy import ndimage as nd
 
-  #Allocate matrix indicating whether rain is occurring.
-  rain = np.zeros((refl.shape),dtype=int)
-
-  #If echo is strong enough, rain = 1.
-  rain[refl>=weakechothres] = 1
-
-  #Create truncvalue, which has same shape as reflectivity data. It indicates the 
-  #reflectivity over which an echo is automatically classified as some sort of 
-  #ISOLATED CONVECTIVE echo. See details below.
-  truncvalue = np.ones((refl.shape),dtype=np.float64)*truncZconvthres
-
-  #This is a blob detector. Detects contiguous areas of raining pixels. Diagonally
-  #touching pixels that share a corner don't count. Edges must touch.
-  #echoes contains the blob objects, numechoes is just a count of them.
-  (echoes,numechoes) = nd.label(rain)
-
-  #Get 2D indices of echo objects.
-  K = get_indices_sparse(echoes)
-  K = K[1:] #Exclude echoes==0.
-
-  for i in np.arange(len(K)):
-     
-    I = K[i][0]
-    J = K[i][1]
- 
-    #Compute the total areal coverage of the echo object.
-    clusterarea = (dx**2)*len(I)    #In km^2
-
-    #Any echo object with a size between minsize and maxsize is considered 
-    #ISOLATED CONVECTION. First, make all of it FRINGE.
-    if clusterarea >= minsize and clusterarea <= maxsize:
-      convsfmat[I,J] = types['ISO_CONV_FRINGE'] 
-
-    #Very small echo objects are dismissed as WEAK ECHO.  
-    if clusterarea < minsize:
-      isCore[I,J] = 0
-      convsfmat[I,J] = types['WEAK_ECHO']
-    #Echo objects with size between minsize and startslope get a small truncvalue
-    #equal to shallowconvmin.
-    elif clusterarea >= minsize and clusterarea < startslope:
-      truncvalue[I,J] = shallowconvmin
-    #Echo objects with size between startslope and maxsize get a truncvalue that 
-    #is linearly interpolated between shallowconvmin and truncZconvthres depending
-    #on the size relative to startslope and maxsize.
-    elif clusterarea >= startslope and clusterarea <= maxsize:
-      truncvalue[I,J] = shallowconvmin + float((clusterarea-startslope)/(maxsize-startslope))*(truncZconvthres-shallowconvmin)
-
-    #Evaluate isCore with size of echo object accounted for.
-    #First, if reflectivity exceeds truncvalue, classify it as ISOLATED CONVECTIVE CORE.
-    isCore[refl >= truncvalue] = types['ISO_CS_CORE']
-
-    #But if reflectivity exceeds original reflectivity threshold, classify as CONVECTIVE core.
-    isCore[refl >= truncZconvthres] = types['CS_CORE']
+  #echoes and clusterarea can be given instead of being computed here, e.g. for a tile
+  #of a larger grid whose echo objects continue beyond the tile (see tiled.py). echoes
+  #then holds an object number for each grid point (0 for no echo) and clusterarea
+  #the total area (km^2) of each object. dy is the grid spacing in y if it differs from dx.
+  #If objects is a dict, the object labels ('echoes'), the area of each object
+  #('clusterarea') and its truncvalue ('truncvalue') are put in it (see objecttable).
+  if dy is None:
+    dy = dx
+  if echoes is None:
+    #Allocate matrix indicating whether rain is occurring. If echo is strong enough, 
+    #rain = True. Scratch arrays come from work if given (see workarray).
+    rain = workarray(work,'rain',refl.shape,bool)
+    np.greater_equal(refl,weakechothres,out=rain)
+
+    #This is a blob detector. Detects contiguous areas of raining pixels. Diagonally
+    #touching pixels that share a corner don't count. Edges must touch.
+    #echoes contains the blob objects, numechoes is just a count of them.
+    echoes = workarray(work,'echoes',refl.shape,np.int32)
+    numechoes = nd.label(rain,output=echoes)
+    ins.count(recorder,'echo_objects',numechoes)
+
+    #Nothing to do if there are no echo objects.
+    if numechoes == 0:
+      if objects is not None:
+        objects.update({'echoes': echoes, 'clusterarea': np.zeros(1),
+                        'truncvalue': np.full(1,float(truncZconvthres))})
+      return (convsfmat,isCore)
+
+    #Compute the total areal coverage of each echo object (in km^2). Index 0 is the
+    #area without echo and is left alone by all the lookup tables below.
+    clusterarea = (dx*dy)*np.bincount(echoes.ravel())
+  elif len(clusterarea) <= 1:
+    if objects is not None:
+      objects.update({'echoes': echoes, 'clusterarea': clusterarea,
+                      'truncvalue': np.full(1,float(truncZconvthres))})
+    return (convsfmat,isCore)
+  isobject = np.arange(len(clusterarea)) > 0
+
+  #Any echo object with a size between minsize and maxsize is considered 
+  #ISOLATED CONVECTION. First, make all of it FRINGE.
+  isfringe = isobject & (clusterarea >= minsize) & (clusterarea <= maxsize)
+
+  #Very small echo objects are dismissed as WEAK ECHO.  
+  isweak = isobject & (clusterarea < minsize)
+
+  #Echo objects with size between minsize and startslope get a small truncvalue
+  #equal to shallowconvmin. Echo objects with size between startslope and maxsize 
+  #get a truncvalue that is linearly interpolated between shallowconvmin and 
+  #truncZconvthres depending on the size relative to startslope and maxsize.
+  objtrunc = np.ones(clusterarea.shape,dtype=np.float64)*truncZconvthres
+  isshallow = isobject & (clusterarea >= minsize) & (clusterarea < startslope)
+  isslope = isobject & (clusterarea >= startslope) & (clusterarea <= maxsize)
+  objtrunc[isshallow] = shallowconvmin
+  objtrunc[isslope] = shallowconvmin + ((clusterarea[isslope]-startslope)/(maxsize-startslope))*(truncZconvthres-shallowconvmin)
+  if objects is not None:
+    objects.update({'echoes': echoes, 'clusterarea': clusterarea, 'truncvalue': objtrunc})
+
+  #Map the per-object values back onto the grid. truncvalue, which has same shape as 
+  #reflectivity data, indicates the reflectivity over which an echo is automatically 
+  #classified as some sort of ISOLATED CONVECTIVE echo.
+  select = workarray(work,'select',refl.shape,bool)
+  convsfmat[np.take(isfringe,echoes,out=select)] = types['ISO_CONV_FRINGE']
+  np.take(isweak,echoes,out=select)
+  isCore[select] = 0
+  convsfmat[select] = types['WEAK_ECHO']
+  #truncvalue is built in the dtype of refl, so float32 scans don't need a float64 grid.
+  tdtype = refl.dtype if np.issubdtype(refl.dtype,np.floating) else np.float64
+  truncvalue = workarray(work,'truncvalue',refl.shape,tdtype)
+  np.take(objtrunc.astype(tdtype),echoes,out=truncvalue)
+
+  #Evaluate isCore with size of echo object accounted for.
+  #First, if reflectivity exceeds truncvalue, classify it as ISOLATED CONVECTIVE CORE.
+  isCore[np.greater_equal(refl,truncvalue,out=select)] = types['ISO_CS_CORE']
+
+  #But if reflectivity exceeds original reflectivity threshold, classify as CONVECTIVE core.
+  isCore[np.greater_equal(refl,truncZconvthres,out=select)] = types['CS_CORE']
 
   return (convsfmat,isCore)
 
 
+def objecttable(objects,refl,convsfmat,types):
+
+  from scipy import ndimage as nd
+
+  #Returns a table (numpy structured array) with one row per echo object found by
+  #makedBZcluster, from the objects dict it filled in and the final classification
+  #convsfmat. Columns: 'id' (the object's number in objects['echoes']), 'area' (km^2),
+  #bounding box 'row0', 'row1', 'col0', 'col1' (row1 and col1 one past the last row
+  #and column, as in a slice), 'max_dbz', 'truncvalue' (see makedBZcluster) and the
+  #number of grid points of the object in each rain type, one column per name in types.
+  #CS_CORE and ISO_CS_CORE never appear in convsfmat, so those columns count the core
+  #points of objects['isCore'] (set by convectivecore) instead, or are 0 without it.
+  echoes = objects['echoes']
+  n = len(objects['clusterarea'])-1
+  names = sorted(types,key=types.get)
+  table = np.zeros(n,dtype=[('id',np.int32),('area',np.float64),('row0',np.int32),
+                            ('row1',np.int32),('col0',np.int32),('col1',np.int32),
+                            ('max_dbz',np.float64),('truncvalue',np.float64)] +
+                           [(name,np.int32) for name in names])
+  if n == 0:
+    return table
+
+  ids = np.arange(1,n+1)
+  table['id'] = ids
+  table['area'] = objects['clusterarea'][1:]
+  table['truncvalue'] = objects['truncvalue'][1:]
+  bbox = nd.find_objects(echoes,max_label=n)
+  for (k,name) in enumerate(['row','col']):
+    table[name+'0'] = [b[k].start for b in bbox]
+    table[name+'1'] = [b[k].stop for b in bbox]
+  table['max_dbz'] = nd.maximum(refl,labels=echoes,index=ids)
+
+  #Count every (object, rain type) pair in one pass.
+  ncode = max(types.values())+1
+  labels = echoes.ravel().astype(np.int64)*ncode
+  counts = np.bincount(labels + convsfmat.ravel(),minlength=(n+1)*ncode).reshape(n+1,ncode)
+  if 'isCore' in objects:
+    cores = np.bincount(labels + objects['isCore'].ravel(),
+                        minlength=(n+1)*ncode).reshape(n+1,ncode)
+  for name in names:
+    if name in ('CS_CORE','ISO_CS_CORE'):
+      table[name] = cores[1:,types[name]] if 'isCore' in objects else 0
+    else:
+      table[name] = counts[1:,types[name]]
+
+  return table
+
+@lru_cache(maxsize=2)
+def coveragecore(min_radius, max_radius, xdim, ydim, x_spacing, y_spacing):
+
+    #Boolean coverage mask behind radial_distance_mask. Only the last two grids are
+    #kept, at one byte per grid point.
+    center_y = int(math.floor(ydim/2.)) - 0.5
+    center_x = int(math.floor(xdim/2.)) - 0.5
+
+    y_range_sq = ((center_y-np.arange(ydim))*y_spacing)**2
+    x_range_sq = ((center_x-np.arange(xdim))*x_spacing)**2
+    dist = np.sqrt(y_range_sq[:,None] + x_range_sq[None,:])
+    core = (dist < max_radius) & (dist > min_radius)
+    core.flags.writeable = False
+
+    return core
+
 def radial_distance_mask(min_radius, max_radius, xdim, ydim, x_spacing, y_spacing):
 
     """
-    Description: Creates a radar coverage mask for a square grid
+    Description: Creates a radar coverage mask for a grid of ydim rows and xdim columns. 
+    A boolean copy of the mask is cached for the last two combinations of inputs seen in 
+    this process; each call returns a new float array that the caller may change.
 
     Inputs:
+    min_radius, max_radius (km) = points strictly between these distances from the
+       center of the grid are inside the coverage
+    xdim, ydim = number of grid points in x and y
+    x_spacing, y_spacing (km) = grid spacing in x and y
 
     Outputs:
+    mask = 1 inside the coverage, 0 elsewhere
 
     """
-    mask = np.zeros(shape=(ydim,xdim))
-
-    center_y = int(math.floor(ydim/2.)) - 0.5
-    center_x = int(math.floor(xdim/2.)) - 0.5
-      
-    for j in range(0,ydim):
-        for i in range(0,xdim):
-            y_range_sq = math.pow( ((center_y-j)*y_spacing), 2 )
-            x_range_sq = math.pow( ((center_x-i)*x_spacing), 2 )
-            dist = math.sqrt(x_range_sq+y_range_sq)
-            if dist < max_radius and dist > min_radius:
-                mask[j,i] = 1
-
-    return mask
+    return coveragecore(min_radius, max_radius, xdim, ydim, x_spacing, y_spacing).astype(float)
@@ -2,13 +2,8 @@
 """
 
 from __future__ import division  #For python2 only. Alternatively, run interpreter with -Q flag. 
-import netCDF4 as nc4
-import numpy as np
 import os
-from uw_raintype import raintype as rt
-from uw_raintype import netcdf_io as net
-from uw_raintype import rtfunctions as rtf
-import logging as log  
+from uw_raintype import batch
 
 """
 This code assumes that the input reflectivity file contains 'refl' in its name.
@@ -37,6 +32,7 @@ The variables listed in the left column immediately below are those in the user-
   refl = Reflectivity
   refl_missing_val = missing value in reflectivity data
   refl_dx (km) = horizontal spacing of grid
+  refl_dy (km) = grid spacing in y if different from refl_dx
   minZdiff = factor for comparing echo to background reflectivity; see equation (1) in journal 
      article referenced above
   deepcoszero = see equation (1) in journal article referenced above
@@ -70,6 +66,7 @@ refl_name = 'REFL';
 refl_level = 5;
 refl_missing_val = -9999;   #Missing value of reflectivity field.  Only used if not in input file
 refl_dx = 1;       #Grid spacing of Cartesian reflectivity data.  Only used if not in input file
+refl_dy = None;    #Grid spacing in y if different from refl_dx (None means same as refl_dx)
 
 ## radar info - only use this if data not contained in input file
 radar_lat = 35;
@@ -88,6 +85,18 @@ outputFormat = 'cf'
 var_cf = ['time','x0','y0','lat0','lon0','grid_mapping_0']
 var_zeb = ['base_time','time_offset','lat','lon','alt','x_spacing','y_spacing','z_spacing']
 
+## to append the scans to one file per hour or UTC day instead of writing one file per scan,
+## set this to 'hourly' or 'daily' ('all' puts every scan into one file)
+timeseries = None
+
+## storage of rain_type in the output files; None keeps the defaults of netcdf_io.STORAGE
+## (compressed 1-byte integers), or give a dict overriding them, e.g. {'complevel': 6}
+storage = None
+
+## set this to True to store only the echo points (runs of equal rain type along the rows)
+## instead of the full grid; read such files with netcdf_io.readraintype
+sparse = False
+
 ## rain type input parameters
 minZdiff = 20; 
 deepcoszero = 40;
@@ -105,6 +114,13 @@ maxsize = 2000;           #(in km^2)
 fileDir = '../example/'
 fileDirOut = './'
 
+## Number of files to process at once (number of worker processes).
+nworkers = 1
+
+## With nworkers = 1, set this to True to read the next files and write the finished ones
+## while the current file is classified (see batch.runpipeline).
+pipeline = False
+
 ## Information about output
 institution = 'University of Washington';
 source = 'SPolKa radar data';
@@ -115,105 +131,23 @@ comment = 'Based on 2.5km level of interpolated reflectivity data';
 
 ## *****************  END USER INPUT PARAMETERS *****************
 
-log.basicConfig(format='%(levelname)s:%(message)s',level=log.INFO)
-
-for fname in os.listdir(fileDir):
-  if fname.endswith('nc'):
-
-    log.info( "file = {}".format(fname) )
-  
-    #Filename for output
-    ncname = str(fileDirOut+'/raintype.'+fname)
-    
-    #If output dir does not exist, create it
-    dir = os.path.dirname(ncname)
-    if not os.path.exists(dir):
-      os.makedirs(dir)
-
-    #Open input file
-    ncid = nc4.Dataset(str(fileDir+'/'+fname),'r')
-
-    #If check to make sure all vars necessary for output format are present in input file
-    if outputFormat == 'zeb':
-      for x in var_zeb:
-        try:
-          ncid.variables[x]
-        except:
-          outputFormat = 'basic'
-          break
-    elif outputFormat == 'cf':  
-      for x in var_cf:
-        try:
-          ncid.variables[x]
-        except:
-          outputFormat = 'basic'
-          break
-      
-    #log.info( "outputFormat = {}".format(outputFormat) )
-    
-    #Make sure refl_name exists.
-    try:
-      ncid.variables[refl_name]
-    except:
-      raise SystemExit('Name of reflectivity variable is incorrect. See user input.')
-   
-    #If variables required by zebra netcdf files are present, read them
-    if outputFormat == 'zeb':
-      bt = ncid.variables[var_zeb[0]][:]
-      toff = ncid.variables[var_zeb[1]][:]
-      lat = ncid.variables[var_zeb[2]][:]
-      lon = ncid.variables[var_zeb[3]][:]
-      alt = ncid.variables[var_zeb[4]][:]
-      dx = ncid.variables[var_zeb[5]][:]
-      dy = ncid.variables[var_zeb[6]][:]
-      dz = ncid.variables[var_zeb[7]][:]
-      missing_value = ncid.variables[refl_name].missing_value
-    #If variables required for cf-compliancy are present, read them
-    elif outputFormat == 'cf':
-      dx = refl_dx
-      missing_value = refl_missing_val
-      tim = ncid.variables[var_cf[0]][:]
-      x = ncid.variables[var_cf[1]][:]
-      y = ncid.variables[var_cf[2]][:]
-      lat = ncid.variables[var_cf[3]][:]
-      lon = ncid.variables[var_cf[4]][:]
-      gm = ncid.variables[var_cf[5]][:]
-      #gmAtts = ncid.variables[var_cf[5]]
-      lat_origin = ncid.variables[var_cf[5]].latitude_of_projection_origin
-      lon_origin = ncid.variables[var_cf[5]].longitude_of_projection_origin
-    else:
-      dx = refl_dx
-      missing_value = refl_missing_val
-
-    #Read in reflectivity
-    refl = np.array(np.squeeze(ncid.variables[refl_name][:,refl_level-1,:,:]))
-
-    #Close input file
-    ncid.close()
-
-    #Determine raintype
-    (rtout,types) = rt.raintype(fname, fileDir, refl, refl_missing_val=missing_value, 
-                                refl_dx=dx, minZdiff=minZdiff, deepcoszero=deepcoszero,
-                                shallowconvmin=shallowconvmin,truncZconvthres=truncZconvthres,
-                                dBZformaxconvradius=dBZformaxconvradius,
-                                weakechothres=weakechothres, backgrndradius=backgrndradius,
-                                maxConvRadius=maxConvRadius,minsize=minsize,
-                                startslope=startslope, maxsize=maxsize)
-
-    #Output result
-    if rtout is not None:
-      if outputFormat == 'zeb':
-        net.writeZebNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthres,
-                           dBZformaxconvradius,weakechothres,backgrndradius,maxConvRadius,
-                           minsize,startslope,maxsize,title,institution,source,references1,references2,
-                           comment,bt,toff,lat,lon,alt,dx,dy,dz,rtout,missing_value)
-      elif outputFormat == 'cf':
-        net.writeCFnetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthres,
-                          dBZformaxconvradius,weakechothres,backgrndradius,maxConvRadius,
-                          minsize,startslope,maxsize,title,institution,source,references1,references2,
-                          comment,tim,x,y,lat,lon,gm,lat_origin,lon_origin,rtout,missing_value)
-      else:
-        net.writeBasicNetcdf(ncname,types,deepcoszero,shallowconvmin,minZdiff,truncZconvthres,
-                             dBZformaxconvradius,weakechothres,backgrndradius,maxConvRadius,
-                             minsize,startslope,maxsize,title,institution,source,references1,references2,
-                             comment,dx,radar_lat,radar_lon,rtout,missing_value)
+if __name__ == '__main__':
+
+  params = {'refl_name':refl_name, 'refl_level':refl_level, 'refl_missing_val':refl_missing_val,
+            'refl_dx':refl_dx, 'refl_dy':refl_dy, 'radar_lat':radar_lat, 'radar_lon':radar_lon,
+            'outputFormat':outputFormat, 'var_cf':var_cf, 'var_zeb':var_zeb,
+            'timeseries':timeseries, 'storage':storage, 'sparse':sparse,
+            'minZdiff':minZdiff, 'deepcoszero':deepcoszero, 'shallowconvmin':shallowconvmin,
+            'truncZconvthres':truncZconvthres, 'dBZformaxconvradius':dBZformaxconvradius,
+            'weakechothres':weakechothres, 'backgrndradius':backgrndradius,
+            'maxConvRadius':maxConvRadius, 'minsize':minsize, 'startslope':startslope,
+            'maxsize':maxsize, 'institution':institution, 'source':source, 'title':title,
+            'references1':references1, 'references2':references2, 'comment':comment}
+
+  files = [os.path.join(fileDir,fname) for fname in os.listdir(fileDir) if fname.endswith('nc')]
+
+  #Classify every file, nworkers at a time. Files that fail are listed in the summary.
+  if pipeline and nworkers == 1:
+    summary = batch.runpipeline(files,fileDirOut,params)
+  else:
+    summary = batch.runbatch(files,fileDirOut,params,nworkers=nworkers)
@@ -0,0 +1,129 @@
+""" Parameter sweeps of the rain-type classification
+
+Example (tuning a new radar):
+
+>> (rtout,combos,types) = sweep.raintype_sweep(refl, {'truncZconvthres': [36,38,40,42],
+                                                     'shallowconvmin': [26,28,30],
+                                                     'minZdiff': [15,20]}, refl_dx=0.5)
+
+rtout[i] is the classification with the parameters in combos[i]. Each intermediate is
+computed once for every distinct value of the parameters it depends on (see DEPENDS);
+only the threshold stages of convectivecore run for every combination.
+"""
+
+import inspect
+import itertools
+import numpy as np
+from uw_raintype import raintype as rt
+from uw_raintype import rtfunctions as rtf
+from uw_raintype import algorithm as alg
+
+#Parameters each shared intermediate depends on. The masks, which depend on
+#backgrndradius, maxConvRadius and the grid spacing, are cached by rtfunctions.getmasks.
+#Everything else only affects the threshold stages that run for every combination.
+DEPENDS = {'background': ['backgrndradius','refl_dx','refl_dy','bgmethod'],
+           'echoes': ['weakechothres','refl_dx','refl_dy']}
+
+#Parameters that may be swept: those of raintype that affect the classification.
+SWEEP_PARAMS = ['refl_dx','refl_dy','minZdiff','deepcoszero','shallowconvmin','truncZconvthres',
+                'dBZformaxconvradius','weakechothres','backgrndradius','maxConvRadius','minsize',
+                'startslope','maxsize','bgmethod']
+
+def combinations(grid,fixed=None):
+
+  #Returns a list of dicts with the full set of parameters for every combination of the
+  #values in grid (the last parameter in grid varies fastest), starting from the
+  #defaults of raintype updated with fixed.
+  params = dict((k,v.default) for (k,v) in inspect.signature(rt.raintype).parameters.items()
+                if k in SWEEP_PARAMS or k == 'refl_missing_val')
+  if fixed is not None:
+    for k in fixed:
+      if k not in params:
+        raise ValueError('Unknown parameter {}'.format(k))
+    params.update(fixed)
+  for k in grid:
+    if k not in SWEEP_PARAMS:
+      raise ValueError('Parameter {} cannot be swept'.format(k))
+
+  names = list(grid)
+  combos = []
+  for values in itertools.product(*[list(grid[k]) for k in names]):
+    p = dict(params)
+    p.update(zip(names,values))
+    combos.append(p)
+
+  return combos
+
+def raintype_sweep(refl, grid, **kwargs):
+
+  """
+  Description: Rain type classification of refl for every combination of the parameter
+  values in grid. The missing value mask, Z, the background reflectivity for each
+  backgrndradius, the echo objects and their areas for each weakechothres, and the
+  masks for each maxConvRadius are computed once and reused, so each combination
+  costs only the threshold stages of convectivecore. The results are identical to
+  calling raintype with each set of parameters.
+
+  Inputs:
+  refl = Reflectivity (y,x); not modified
+  grid = dict of parameter name -> list of values, e.g. {'truncZconvthres': [38,40]}; any
+     parameter in SWEEP_PARAMS may be swept
+  All other inputs are keyword arguments as for raintype and are used for every combination.
+
+  Outputs:
+  rain_type = stacked classifications with shape (number of combinations,y,x), in the
+     smallest signed integer type that holds refl_missing_val; reshape to
+     [len(v) for v in grid.values()] + [y,x] for one axis per parameter
+  combos = list of dicts with the parameters of each classification
+  types = dict of rain types and their values
+  """
+
+  from scipy import ndimage as nd
+
+  combos = combinations(grid,kwargs)
+  types = dict(rt.TYPES)
+  missing = combos[0]['refl_missing_val']
+
+  #Missing value mask, refl with missing values as NaN's, and Z; these depend on no
+  #swept parameter.
+  refl = np.asarray(refl)
+  mask = np.isnan(refl)
+  mask |= (refl == missing)
+  reflnan = refl.astype(refl.dtype if np.issubdtype(refl.dtype,np.floating) else float)
+  reflnan[mask] = np.nan
+  Z = rtf.DBZtoZ(reflnan)
+
+  cache = dict((name,{}) for name in DEPENDS)
+  work = {}
+  out = np.empty((len(combos),)+refl.shape,dtype=rt.outputdtype(missing))
+
+  for (c,p) in enumerate(combos):
+    dx = p['refl_dx']
+    dy = p['refl_dy']
+    keys = dict((name,tuple(p[k] for k in DEPENDS[name])) for name in DEPENDS)
+
+    (bgmask,maskcell) = rtf.getmasks(p['backgrndradius'],p['maxConvRadius'],float(dx),
+                                     None if dy is None else float(dy))
+
+    if keys['background'] not in cache['background']:
+      background = rtf.get_background_refl(Z,bgmask,p['bgmethod'],work=work)
+      cache['background'][keys['background']] = rtf.ZtoDBZ(background)
+    background = cache['background'][keys['background']]
+
+    #Echo objects and their areas, as computed in makedBZcluster.
+    if keys['echoes'] not in cache['echoes']:
+      echoes = np.empty(refl.shape,dtype=np.int32)
+      nd.label(np.greater_equal(reflnan,p['weakechothres']),output=echoes)
+      clusterarea = (dx*(dx if dy is None else dy))*np.bincount(echoes.ravel())
+      cache['echoes'][keys['echoes']] = (echoes,clusterarea)
+    (echoes,clusterarea) = cache['echoes'][keys['echoes']]
+
+    rtout = alg.convectivecore(background,reflnan,p['minZdiff'],types,p['dBZformaxconvradius'],
+                               p['maxConvRadius'],p['weakechothres'],p['deepcoszero'],
+                               p['minsize'],p['maxsize'],p['startslope'],p['shallowconvmin'],
+                               p['truncZconvthres'],dx,maskcell,work,echoes=echoes,
+                               clusterarea=clusterarea,dy=dy)
+    out[c] = rtout
+    out[c][mask] = missing
+
+  return out, combos, types
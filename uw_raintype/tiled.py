@@ -0,0 +1,256 @@
+""" Tiled rain-type classification of grids too large to classify in one piece
+
+Example (a 7000x3500 national composite at 1 km, 8 processes):
+
+>> (rtout,types) = tiled.raintype_tiled(refl, tilerows=500, nworkers=8, refl_dx=1, ...)
+
+The grid is split into strips of tilerows rows that span its full width. Each strip
+is classified together with a halo of rows on either side: maxConvRadius wide so
+that every convective core whose MIXED radius reaches into the strip is seen, plus
+backgrndradius so that the background reflectivity of those rows is exact. Echo
+objects are labeled strip by strip and merged across strip boundaries before any
+classification, so the size thresholds of makedBZcluster use the area of each whole
+object. Only the strips plus their halos, one 4-byte object label per grid point and
+the output are in memory at a time.
+
+The result is identical to raintype.raintype when the background is convolved with
+the 'direct' or 'sat' method ('auto' picks one of them for backgrndradius/refl_dx up
+to 10 grid points). The 'fft' and 'oa' methods sum in a different order on a strip
+than on the whole grid, so the background can differ in the last bits, which changes
+a point's category only if it lies exactly on a threshold.
+"""
+
+import numpy as np
+import multiprocessing as mp
+from uw_raintype import raintype as rt
+from uw_raintype import rtfunctions as rtf
+from uw_raintype import algorithm as alg
+from uw_raintype import batch
+
+#State of the current worker process (or of the calling process if there is only
+#one worker), set by inittileworker.
+_tile = None
+
+def stripbounds(ny,tilerows):
+
+  #Returns a list of (first row, last row + 1) of each strip.
+  tilerows = max(1,int(tilerows))
+  return [(r0,min(ny,r0+tilerows)) for r0 in range(0,ny,tilerows)]
+
+def inittileworker(p,specs,tables=None):
+
+  #Maps the shared input, label and output arrays and keeps the parameters, masks and
+  #object tables of this worker in _tile.
+  global _tile
+  _tile = {'p': p, 'work': {}, 'blocks': []}
+  for (name,spec) in specs.items():
+    (_tile[name],block) = batch.attacharray(spec)
+    _tile['blocks'].append(block)
+  if tables is not None:
+    _tile.update(tables)
+
+def labelstrip(st,k):
+
+  #Labels the echo objects of strip k in the strip's rows of st['labels'] (numbered
+  #from 1 within the strip). Returns the number of grid points in each object, with
+  #the number of points without echo first.
+  from scipy import ndimage as nd
+  p = st['p']
+  (r0,r1) = p['bounds'][k]
+  refl = np.asarray(st['refl'][r0:r1])
+  rain = np.greater_equal(refl,p['weakechothres'])
+  rain &= (refl != p['refl_missing_val'])
+  labels = st['labels'][r0:r1]
+  nlabels = nd.label(rain,output=labels)
+
+  return np.bincount(labels.ravel(),minlength=nlabels+1)
+
+def globalechoes(st,w0,w1):
+
+  #Returns the merged object numbers of rows w0 to w1-1 (see mergeobjects).
+  p = st['p']
+  labels = st['labels']
+  echoes = np.zeros((w1-w0,labels.shape[1]),dtype=np.int32)
+  for (j,(s0,s1)) in enumerate(p['bounds']):
+    (lo,hi) = (max(s0,w0),min(s1,w1))
+    if lo >= hi:
+      continue
+    local = labels[lo:hi]
+    prov = np.where(local > 0,local + st['offsets'][j],0)
+    np.take(st['globalid'],prov,out=echoes[lo-w0:hi-w0])
+
+  return echoes
+
+def classifystrip(st,k):
+
+  #Classifies strip k and writes the result to its rows of st['out'].
+  p = st['p']
+  (ny,nx) = st['refl'].shape
+  (r0,r1) = p['bounds'][k]
+  (bgmask,maskcell) = rtf.getmasks(*p['maskargs'])
+
+  #Rows whose cores can reach the strip (w0:w1) and rows needed for their background (b0:b1).
+  n = maskcell[-1].shape[0]//2
+  w0 = max(0,r0-n)
+  w1 = min(ny,r1+n)
+  b0 = max(0,w0-bgmask.shape[0]//2)
+  b1 = min(ny,w1+bgmask.shape[0]//2)
+
+  #Same steps as raintype.raintype on rows b0:b1.
+  refl = np.asarray(st['refl'][b0:b1])
+  refl = refl.astype(refl.dtype if np.issubdtype(refl.dtype,np.floating) else float)
+  mask = np.isnan(refl)
+  mask |= (refl == p['refl_missing_val'])
+  refl[mask] = np.nan
+  Z = rtf.DBZtoZ(refl)
+  background = rtf.get_background_refl(Z,bgmask,p['bgmethod'],inplace=True)
+  background = rtf.ZtoDBZ(background)
+
+  convsfmat = alg.convectivecore(background[w0-b0:w1-b0],refl[w0-b0:w1-b0],p['minZdiff'],
+                                 dict(rt.TYPES),p['dBZformaxconvradius'],p['maxConvRadius'],
+                                 p['weakechothres'],p['deepcoszero'],p['minsize'],p['maxsize'],
+                                 p['startslope'],p['shallowconvmin'],p['truncZconvthres'],
+                                 p['refl_dx'],maskcell,st['work'],
+                                 echoes=globalechoes(st,w0,w1),clusterarea=st['clusterarea'],
+                                 dy=p['refl_dy'])
+
+  out = st['out'][r0:r1]
+  out[...] = convsfmat[r0-w0:r1-w0]
+  out[mask[r0-b0:r1-b0]] = p['refl_missing_val']
+
+def runlabel(k):
+  return labelstrip(_tile,k)
+
+def runclassify(k):
+  classifystrip(_tile,k)
+  return k
+
+def mergeobjects(labels,bounds,counts,dx,dy=None):
+
+  #Joins the echo objects of neighbouring strips that touch across the strip
+  #boundary. Object i of strip k gets the provisional number offsets[k] + i; globalid
+  #maps provisional numbers to merged object numbers (0 for no echo), and clusterarea
+  #gives the area (km^2) of each merged object, as computed in makedBZcluster.
+  if dy is None:
+    dy = dx
+  from scipy.sparse import coo_matrix
+  from scipy.sparse.csgraph import connected_components
+
+  nobj = [len(c)-1 for c in counts]
+  offsets = np.concatenate([[0],np.cumsum(nobj)[:-1]]).astype(np.int64)
+  npoints = np.concatenate([[0]]+[c[1:] for c in counts]).astype(np.int64)
+  nprov = len(npoints)
+
+  #Pairs of objects on either side of each boundary. Edges must touch, as in nd.label.
+  (I,J) = ([],[])
+  for k in range(0,len(bounds)-1):
+    above = labels[bounds[k][1]-1]
+    below = labels[bounds[k+1][0]]
+    touch = (above > 0) & (below > 0)
+    I.append(above[touch] + offsets[k])
+    J.append(below[touch] + offsets[k+1])
+  I = np.concatenate(I) if I else np.zeros(0,dtype=np.int64)
+  J = np.concatenate(J) if J else np.zeros(0,dtype=np.int64)
+  graph = coo_matrix((np.ones(len(I),dtype=np.int8),(I,J)),shape=(nprov,nprov))
+  (nmerged,globalid) = connected_components(graph,directed=False)
+
+  #Provisional number 0 (no echo) is never joined to anything; make it merged object 0.
+  if globalid[0] != 0:
+    (zero,first) = (globalid == 0,globalid == globalid[0])
+    globalid[zero] = globalid[0]
+    globalid[first] = 0
+  area = np.zeros(nmerged,dtype=np.int64)
+  np.add.at(area,globalid,npoints)
+  area[0] = 0
+
+  return offsets, globalid.astype(np.int32), (dx*dy)*area
+
+def raintype_tiled(refl, tilerows=500, nworkers=1, out=None, refl_missing_val=-9999, refl_dx=1,
+                   minZdiff=20, deepcoszero=40, shallowconvmin=28, truncZconvthres=43,
+                   dBZformaxconvradius=46, weakechothres=7, backgrndradius=5, maxConvRadius=10,
+                   minsize=8, startslope=50, maxsize=2000, bgmethod='direct', refl_dy=None):
+
+  """
+  Description: Same classification as raintype.raintype, computed strip by strip so
+  that grids too large to classify in one piece fit in memory, optionally with the
+  strips spread over several processes. See the top of this file for how the strips
+  are made exact.
+
+  Inputs:
+  refl = Reflectivity (y,x); an array, an np.memmap, or an (array, block) pair from
+     batch.sharearray or batch.readshared. refl is not modified.
+  tilerows = number of rows in each strip (the strips span all columns)
+  nworkers = number of worker processes; 1 runs everything in this process
+  out = optional integer output array of the shape of refl (an np.memmap opened with
+     mode 'r+' or 'w+', or an (array, block) pair, is written to by the workers directly)
+  All other inputs are the same as for raintype (see raintype for descriptions).
+
+  Outputs:
+  rain_type = rain type classification
+  types = dict of rain types and their values
+  """
+
+  arr = refl[0] if isinstance(refl,tuple) else refl
+  outarr = out[0] if isinstance(out,tuple) else out
+  if arr.ndim != 2:
+    raise ValueError('refl must have shape (y,x), not {}'.format(arr.shape))
+  (ny,nx) = arr.shape
+  maskargs = (backgrndradius,maxConvRadius,float(refl_dx),
+              None if refl_dy is None else float(refl_dy))
+  (bgmask,maskcell) = rtf.getmasks(*maskargs)
+
+  #Pick the background method for the whole grid, so every strip uses the method
+  #raintype would use.
+  if bgmethod == 'auto':
+    bgmethod = rtf.choose_bg_method(arr.shape,bgmask)
+  p = {'refl_missing_val': refl_missing_val, 'refl_dx': refl_dx, 'minZdiff': minZdiff,
+       'deepcoszero': deepcoszero, 'shallowconvmin': shallowconvmin,
+       'truncZconvthres': truncZconvthres, 'dBZformaxconvradius': dBZformaxconvradius,
+       'weakechothres': weakechothres, 'backgrndradius': backgrndradius,
+       'maxConvRadius': maxConvRadius, 'minsize': minsize, 'startslope': startslope,
+       'maxsize': maxsize, 'bgmethod': bgmethod, 'refl_dy': refl_dy, 'maskargs': maskargs,
+       'bounds': stripbounds(ny,tilerows)}
+  strips = list(range(0,len(p['bounds'])))
+
+  if not (nworkers is None or nworkers > 1):
+    if outarr is None:
+      outarr = np.empty(arr.shape,dtype=int)
+    st = {'p': p, 'refl': arr, 'out': outarr, 'work': {},
+          'labels': np.empty(arr.shape,dtype=np.int32)}
+    counts = [labelstrip(st,k) for k in strips]
+    (st['offsets'],st['globalid'],st['clusterarea']) = mergeobjects(st['labels'],p['bounds'],
+                                                                    counts,refl_dx,refl_dy)
+    for k in strips:
+      classifystrip(st,k)
+    return outarr, dict(rt.TYPES)
+
+  #Share the input, labels and output with the workers, copying the input and output
+  #into shared memory if they are not already shared.
+  with batch.SharedArrays() as shared:
+    specs = {'refl': shared.describe('refl',refl,'r'),
+             'labels': shared.describe('labels',None,'r+',arr.shape,np.int32),
+             'out': shared.describe('out',out,'r+',arr.shape,
+                                    int if outarr is None else outarr.dtype)}
+
+    #Label the strips, merge the objects in this process, then classify the strips.
+    pool = mp.Pool(nworkers,initializer=inittileworker,initargs=(p,{'refl': specs['refl'],
+                   'labels': specs['labels']}))
+    try:
+      counts = pool.map(runlabel,strips,chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+    (offsets,globalid,clusterarea) = mergeobjects(shared.arrays['labels'],p['bounds'],counts,
+                                                  refl_dx,refl_dy)
+
+    tables = {'offsets': offsets, 'globalid': globalid, 'clusterarea': clusterarea}
+    pool = mp.Pool(nworkers,initializer=inittileworker,initargs=(p,specs,tables))
+    try:
+      pool.map(runclassify,strips,chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+    result = shared.result('out',outarr)
+
+  return result, dict(rt.TYPES)
@@ -0,0 +1,195 @@
+""" Zarr output of rain type classifications
+
+A Zarr store holds the classifications of many scans on the same grid in one rain_type
+array (time,y,x), with the same variables and attributes as the files written by
+netcdf_io.writeCFnetcdf. Each chunk of the time dimension is a separate file in the
+store, so any number of processes can write their own times at once. Example:
+
+>> zarr_io.createCFzarr('raintype.zarr',types,params,ntimes,shape,coords,missing_value)
+>> (in each worker) zarr_io.writeCFzarr('raintype.zarr',i0,rain_types,missing_value)
+>> zarr_io.finishCFzarr('raintype.zarr',times,sources)
+
+Requires zarr 3 or later. The store can be read lazily with zarr.open_group or
+xarray.open_zarr, or with readCFzarr.
+"""
+
+import time as tm
+import numpy as np
+from uw_raintype import netcdf_io as net
+
+def importzarr():
+
+  #Imports zarr, which is only needed for Zarr output.
+  try:
+    import zarr
+  except ImportError:
+    raise ImportError('zarr is required for Zarr output')
+  return zarr
+
+def createCFzarr(storename,types,params,ntimes,shape,coords,missing_value,storage=None,
+                 timechunk=1):
+
+  """
+  Description: Creates a Zarr store for ntimes rain type classifications on a grid of
+  shape (y,x). Everything except rain_type and time is written here; rain_type starts
+  out missing and time starts out NaN.
+
+  Inputs:
+  storename = directory of the store; replaced if it exists
+  types = dict of rain types and their values
+  params = dict with the algorithm parameters and the title, institution, source,
+     references1, references2 and comment attributes (see batch.DEFAULT_PARAMS)
+  ntimes = number of times
+  shape = (y,x) shape of the grid
+  coords = dict with x, y, lat, lon, lat_origin and lon_origin for the CF coordinates
+     written by writeCFnetcdf, or with dx and optionally dy, radar_lat and radar_lon if
+     there are none
+  missing_value = missing value of the rain type classifications
+  storage = storage of rain_type as for the netcdf_io writers (see netcdf_io.STORAGE);
+     compression may be 'zlib' or 'zstd', and packbits is not supported
+  timechunk = number of times in each chunk of rain_type; writers of different chunks
+     never touch the same file
+
+  Outputs:
+  None
+  """
+
+  zarr = importzarr()
+  options = net.storageoptions(storage)
+  if options['packbits']:
+    raise ValueError('packbits is not supported for Zarr stores')
+  if options['complevel'] == 0:
+    compressors = None
+  elif options['compression'] == 'zlib':
+    compressors = zarr.codecs.GzipCodec(level=options['complevel'])
+  elif options['compression'] == 'zstd':
+    compressors = zarr.codecs.ZstdCodec(level=options['complevel'])
+  else:
+    raise ValueError('Unknown compression {} for Zarr stores'.format(options['compression']))
+
+  dtype = np.dtype(options['dtype'])
+  fill = net.storagefill(dtype,missing_value)
+  if options['chunks'] is None:
+    chunks = (timechunk,min(shape[0],1024),min(shape[1],1024))
+  else:
+    chunks = (timechunk,) + tuple(options['chunks'][-2:])
+
+  g = zarr.open_group(storename,mode='w')
+  g.attrs.update({'Conventions': 'CF-1.0',
+                  'history': 'File created ' + tm.strftime("%m/%d/%Y %H:%M:%S")})
+  for name in ['title','institution','source','references1','references2','comment']:
+    g.attrs[name] = params[name]
+
+  timeVar = g.create_array('time',shape=(ntimes,),dtype=np.float64,chunks=(max(ntimes,1),),
+                           fill_value=np.nan,dimension_names=('time',))
+  timeVar.attrs.update({'standard_name': 'time', 'long_name': 'Data time',
+                        'units': 'seconds since 1970-01-01T00:00:00Z', 'calendar': 'standard',
+                        'axis': 'T'})
+
+  if 'lat' in coords:
+    #CF coordinates, as in writeCFnetcdf
+    for (name,dims,attrs) in [
+        ('x',('x',),{'standard_name': 'projection_x_coordinate', 'axis': 'X', 'units': 'km',
+                     'long_name': 'x distance on the projection plane from the origin'}),
+        ('y',('y',),{'standard_name': 'projection_y_coordinate', 'axis': 'Y', 'units': 'km',
+                     'long_name': 'y distance on the projection plane from the origin'}),
+        ('lat',('y','x'),{'standard_name': 'latitude', 'units': 'degrees_north'}),
+        ('lon',('y','x'),{'standard_name': 'longitude', 'units': 'degrees_east'})]:
+      data = np.asarray(coords[name],dtype=float)
+      var = g.create_array(name,shape=data.shape,dtype=float,dimension_names=dims)
+      var[...] = data
+      var.attrs.update(attrs)
+    gmVar = g.create_array('grid_mapping',shape=(),dtype=np.int64)
+    gmVar.attrs.update({'grid_mapping_name': 'azimuthal_equidistant',
+                        'longitude_of_projection_origin': float(coords['lon_origin']),
+                        'latitude_of_projection_origin': float(coords['lat_origin']),
+                        'false_easting': 0, 'false_northing': 0})
+  else:
+    for (name,value) in [('x_spacing',coords['dx']),
+                         ('y_spacing',coords['dx'] if coords.get('dy') is None else coords['dy'])]:
+      var = g.create_array(name,shape=(),dtype=float)
+      var[...] = value
+      var.attrs['units'] = 'km'
+    g.attrs['radar_lat'] = float(coords.get('radar_lat',params.get('radar_lat')))
+    g.attrs['radar_lon'] = float(coords.get('radar_lon',params.get('radar_lon')))
+
+  for (name,key,units,long_name,comment) in net.PARAM_VARS:
+    var = g.create_array(name,shape=(),dtype=float)
+    var[...] = params[key]
+    var.attrs.update({'units': units, 'long_name': long_name, 'comment': comment})
+
+  rt = g.create_array('rain_type',shape=(ntimes,)+tuple(shape),dtype=dtype,chunks=chunks,
+                      fill_value=fill,compressors=compressors,dimension_names=('time','y','x'))
+  attrs = {'units': 'none', 'long_name': 'rain_type_classification',
+           'ancillary_variables': ' '.join(v[0] for v in net.PARAM_VARS)}
+  if 'lat' in coords:
+    attrs.update({'coordinates': 'lon lat', 'grid_mapping': 'grid_mapping'})
+  for name in ['NO_ECHO','STRATIFORM','CONVECTIVE','MIXED','ISO_CONV_CORE','ISO_CONV_FRINGE','WEAK_ECHO']:
+    attrs[name] = int(types[name])
+  rt.attrs.update(attrs)
+
+def writeCFzarr(storename,index,raintype,missing_value):
+
+  #Writes raintype (y,x), or a stack of them (n,y,x), to rain_type at time index onwards.
+  #Safe to call from many processes at once as long as they write different chunks of
+  #the time dimension, i.e. index and the number of times are multiples of timechunk.
+  zarr = importzarr()
+  rt = zarr.open_array(storename,path='rain_type',mode='r+')
+  raintype = np.asarray(raintype)
+  if raintype.ndim == 2:
+    raintype = raintype[np.newaxis]
+  fill = rt.fill_value
+  info = np.iinfo(rt.dtype)
+  missing = (raintype == missing_value)
+  if np.any(((raintype < info.min) | (raintype > info.max)) & ~missing):
+    raise ValueError('Rain types do not fit in {}'.format(rt.dtype))
+  rt[index:index+raintype.shape[0]] = np.where(missing,fill,raintype).astype(rt.dtype)
+
+def finishCFzarr(storename,times,sources=None):
+
+  #Writes the times (seconds since 1970-01-01, NaN where unknown) and the list of input
+  #files once all workers are done, and consolidates the metadata of the store so that
+  #readers open it with a single read.
+  zarr = importzarr()
+  g = zarr.open_group(storename,mode='r+')
+  g['time'][:] = np.asarray(times,dtype=np.float64)
+  if sources is not None:
+    g.attrs['source_files'] = [str(f) for f in sources]
+  zarr.consolidate_metadata(storename)
+
+def readCFzarr(storename,tstart=None,tend=None,missing_value=None):
+
+  """
+  Description: Reads the rain type classifications with tstart <= time < tend from a Zarr
+  store. Only the chunks holding those times are read. If tstart or tend is given,
+  times that are NaN are left out.
+
+  Inputs:
+  storename = directory of the store
+  tstart, tend = time range (seconds since 1970-01-01); None for no limit
+  missing_value = value for missing points; if None, a masked array is returned
+
+  Outputs:
+  times = times of the classifications
+  rain_type = classifications (time,y,x)
+  """
+
+  zarr = importzarr()
+  g = zarr.open_group(storename,mode='r')
+  times = g['time'][:]
+  keep = np.ones(times.shape,dtype=bool)
+  if tstart is not None:
+    keep &= (times >= tstart)
+  if tend is not None:
+    keep &= (times < tend)
+  index = np.nonzero(keep)[0]
+
+  rt = g['rain_type']
+  data = rt.oindex[index,:,:] if len(index) else np.empty((0,)+rt.shape[1:],dtype=rt.dtype)
+  missing = (data == rt.fill_value)
+  if missing_value is None:
+    return times[index], np.ma.masked_array(data,mask=missing)
+  if not np.can_cast(np.min_scalar_type(missing_value),data.dtype):
+    data = data.astype(np.result_type(data.dtype,np.min_scalar_type(missing_value)))
+  data[missing] = missing_value
+  return times[index], data